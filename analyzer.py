@@ -9,29 +9,49 @@ this whole file should really be broken between a library file and a program
 
 '''
 import argparse
+import collections
+import functools
+import itertools
+import json
 import logging
 import os
 import sys
-# Third Party
-import openpyxl
+import timeit
+import traceback
 # Custom
+import cache
 import fields
+import ingest
+import metrics
+import pipeline
+import query
 import root
+import spill
+import status
+import store
+import summary
 import tube
 import utility
+import validate
+import writers
 
-from errors import AnalyzerError, DataError, SerializationError
+from errors import AnalyzerError, DataError, FieldsError, SerializationError
 
 
-# logging config
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s: %(levelname)s: %(message)s [%(filename)s:%(funcName)s]')
+LOG_FORMAT = '%(asctime)s: %(levelname)s: %(message)s [%(filename)s:%(funcName)s]'
+
 log = logging.getLogger(__name__)
 
 
 class Analyzer(object):
     def __init__(self,
                  additional_root_fields=None,
-                 required_sheet_names=None):
+                 required_sheet_names=None,
+                 read_only=False,
+                 tube_workers=1,
+                 cache_dir=None,
+                 trace_memory=False,
+                 status_rules=None):
         self.root_fields = fields.RootDataFields(additional_fields=additional_root_fields)
         self.synthesis_fields = fields.SynthesisDataFields()
         self.required_sheet_names = {'root_data': 'ROOT',
@@ -43,91 +63,284 @@ class Analyzer(object):
                     raise AnalyzerError('Missing key in required_sheet_names - [{}]'.format(key))
             self.required_sheet_names = required_sheet_names
 
+        # When set, workbooks are opened in read only mode and the sheets are streamed row by row.
+        self.read_only = read_only
+        # Number of worker processes used to process tubes in parse.  None uses one per CPU.
+        self.tube_workers = tube_workers
+        # When set, parsed workbooks are cached in this directory and reused by later runs.
+        self.cache = None
+        if cache_dir:
+            self.cache = cache.ParseCache(cache_dir)
+
+        # Every root shares a single attribute map, and a Root class with a slot for each attribute.
+        # status_rules classifies the TipLivStatus values, and defaults to status.DEFAULT_RULES.
+        self.schema = fields.RecordSchema(self.root_fields, self.synthesis_fields, status_rules=status_rules)
+        self.root_class = self.schema.root_class
+        # Values are coerced into native types, and repeated values interned, as they are loaded.
+        self.ingest = ingest.Ingester(self.schema)
+
+        # Stage timings and counters for the run.  trace_memory records the peak allocation of each stage.
+        self.metrics = metrics.Metrics(trace_memory=trace_memory)
+
         self.root_data = {}  # Tube number -> list of roots from that tube.
         self.synthesis_data = {}  # tube number -> rootidentity -> data
         self.tubes = []  # List of tube objects
+        self._query = None  # RootQuery over self.tubes, see query().
+        self._query_tubes = 0
+        self.changed_tubes = []  # Numbers of the tubes changed by merge, in the order of self.tubes.
 
     def insert(self, fp):
+        if store.is_store(fp):
+            return self._insert_store(fp)
+        if self.cache is not None:
+            return self._insert_cached(fp)
+        with self.metrics.stage('load_workbook'):
+            wb = self._load_workbook(fp)
+        try:
+            self.parse(wb)
+        finally:
+            if self.read_only:
+                # Read only workbooks keep the source archive open until they are closed.
+                wb.close()
+
+    def _load_workbook(self, fp, read_only=None):
+        if read_only is None:
+            read_only = self.read_only
         log.info('Opening workbook [{}]'.format(fp))
+        # openpyxl is slow to import, so it is only imported where workbooks are opened or written.
+        import openpyxl
         try:
-            wb = openpyxl.load_workbook(filename=fp)
+            wb = openpyxl.load_workbook(filename=fp, read_only=read_only)
         except:
             log.exception('')
             raise AnalyzerError('Failed to load workbook [{}]'.format(fp))
         sheets = set(wb.get_sheet_names())
         if not sheets.issuperset(set(self.required_sheet_names.values())):
+            if read_only:
+                wb.close()
             raise AnalyzerError('Workbook is missing expected sheet names {}'.format(list(self.required_sheet_names)))
-        self.parse(wb)
+        return wb
+
+    def _insert_cached(self, fp):
+        """Insert a workbook, reusing the parse cache entry for it where possible.
+
+        If the source is unchanged since it was cached, the cached tube states are finalized
+        without opening the workbook.  If rows were appended to the ROOT sheet, only the new rows
+        are inserted into the cached tube states.  Otherwise the workbook is parsed in full.
+        """
+        with self.metrics.stage('cache_load'):
+            source_digest = cache.file_digest(fp)
+            key = self.cache.key(fp, self.required_sheet_names, self.schema)
+            entry = self.cache.load(key)
+        if entry is not None and entry.source_digest == source_digest:
+            log.info('Using cached data for unchanged workbook [{}]'.format(fp))
+            self.metrics.incr('cache_hits')
+        else:
+            with self.metrics.stage('load_workbook'):
+                wb = self._load_workbook(fp)
+            try:
+                with self.metrics.stage('parse_incremental'):
+                    entry = self._parse_incremental(wb, entry)
+            finally:
+                if self.read_only:
+                    wb.close()
+            entry.source_digest = source_digest
+            with self.metrics.stage('cache_store'):
+                self.cache.store(key, entry)
+
+        if set(entry.tubes) != set(entry.synthesis_data):
+            raise DataError('Tube numbers from root_data does not match the tube numbers from the synthesis_data')
+        log.info('Processing collected data')
+        with self.metrics.stage('tubes'):
+            for tn in entry.tubes:
+                tube_obj, final_roots = entry.tube_state(tn)
+                sdata = entry.synthesis_data.get(tn)
+                self.synthesis_data[tn] = sdata
+                with metrics.trace_peak(tube_obj.stats, enabled=self.metrics.trace_memory):
+                    finalize_tube(tube_obj, final_roots, sdata, self.root_fields, self.schema.synthesis_slots)
+                self._add_tube(tube_obj)
+
+    def _parse_incremental(self, wb, entry=None):
+        """Parse a workbook into a new cache entry, building on the tube states of a previous entry.
 
-    def _process_synthesis_table(self, ws):
+        The previous tube states are reused when the ROOT sheet starts with exactly the rows they
+        were built from, and none of the rows after those belong to an earlier session than the
+        last cached session of their tube.
+        """
+        root_sheet = wb.get_sheet_by_name(self.required_sheet_names.get('root_data'))
+        synthesis_sheet = wb.get_sheet_by_name(self.required_sheet_names.get('synthesis_data'))
+
+        new_entry = cache.CacheEntry()
+        self._process_synthesis_table(ws=synthesis_sheet, synthesis_data=new_entry.synthesis_data)
+        if not self._parse_root_rows(root_sheet, new_entry, entry):
+            self._parse_root_rows(root_sheet, new_entry)
+        return new_entry
+
+    def _parse_root_rows(self, ws, new_entry, entry=None):
+        """Parse the ROOT sheet into the tube states of a new cache entry, building on those of a previous entry.
+
+        Returns False, leaving the new entry unchanged, if rows were added to an earlier session of
+        a cached tube, in which case the sheet must be parsed again without the previous entry.
+        """
+        log.info('Extracting root table')
+        rows = utility.iter_rows_from_columns(ws, self.schema.root_columns)
+        digest = cache.RowDigest()
+        pending = []
+        if entry is not None:
+            pending = list(itertools.islice(rows, entry.root_rows))
+            for row in pending:
+                digest.update(row)
+            if len(pending) == entry.root_rows and digest.hexdigest() == entry.root_digest:
+                log.info('Reusing cached state for the first {} rows'.format(entry.root_rows))
+                pending = []
+            else:
+                log.info('Cached rows have changed, parsing the workbook in full')
+                entry = None
+        tube_position = self.schema.tube_position
+        new_roots = collections.OrderedDict()
+        for row in pending:
+            new_roots.setdefault(row[tube_position], []).append(self._root_from_row(row))
+        for row in rows:
+            digest.update(row)
+            new_roots.setdefault(row[tube_position], []).append(self._root_from_row(row))
+
+        states = []
+        for tn, raw_roots in new_roots.items():
+            state = None if entry is None else entry.tube_state(tn)
+            if state is None:
+                tube_obj, final_roots = tube.Tube(tn), []
+            else:
+                tube_obj, final_roots = state
+            previous_max = tube_obj.maxSessionCount
+            if any(root_obj.get('Session#') < previous_max for root_obj in raw_roots):
+                log.info('Rows were added to an earlier session of tube [{}], parsing the workbook in full'.format(tn))
+                return False
+            log.info('Inserting {} new roots into tube [{}]'.format(len(raw_roots), tn))
+            collect_tube(tube_obj, raw_roots)
+            if tube_obj.maxSessionCount != previous_max:
+                final_roots = []
+            final_roots.extend(root_obj for root_obj in raw_roots
+                               if root_obj.get('Session#') == tube_obj.maxSessionCount)
+            states.append((tn, tube_obj, final_roots))
+
+        if entry is not None:
+            new_entry.tubes.update(entry.tubes)
+        for tn, tube_obj, final_roots in states:
+            new_entry.set_tube_state(tn, tube_obj, final_roots)
+        new_entry.root_rows = digest.rows
+        new_entry.root_digest = digest.hexdigest()
+        # Counted once the rows are applied, so a pass abandoned for a full parse is not counted.
+        self.metrics.incr('root_rows', digest.rows)
+        self.metrics.incr('root_rows_parsed', sum(len(raw_roots) for raw_roots in new_roots.values()))
+        return True
+
+    def _insert_store(self, fp):
+        """Insert a store written by the convert command, reading its columns from the mapped file."""
+        log.info('Opening store [{}]'.format(fp))
+        with self.metrics.stage('load_store'):
+            data_store = store.open_store(fp)
+        try:
+            with self.metrics.stage('synthesis_table'):
+                columns = store.read_columns(data_store, self.required_sheet_names.get('synthesis_data'),
+                                             self.schema.synthesis_columns)
+                self._process_synthesis_rows(zip(*columns.values()))
+            with self.metrics.stage('root_table'):
+                columns = store.read_columns(data_store, self.required_sheet_names.get('root_data'),
+                                             self.schema.root_columns)
+                self._process_root_columns(columns)
+            self._parse_roots()
+            # Release the views over the store before it is closed.
+            del columns
+        finally:
+            data_store.close()
+
+    def _process_synthesis_table(self, ws, synthesis_data=None):
+        """Extract the synthesis only values of each root, keyed by tube number and root identity."""
         log.info('Extracting synthesis data')
-        synthesis_data = utility.build_data_from_fields(ws, self.synthesis_fields)
-        for d in synthesis_data:
-            tn = d.get('Tube#')
-            if tn not in self.synthesis_data:
-                self.synthesis_data[tn] = {}
-            sd = self.synthesis_data.get(tn)
-            root_identity = root.RootIdentity(rootname=d.get('RootName'),
-                                              location=d.get('Location#'),
-                                              birthsession=d.get('BirthSession'))
+        columns = self.schema.synthesis_columns
+        if self.read_only:
+            synthesis_rows = utility.iter_rows_from_columns(ws, columns)
+        else:
+            synthesis_rows = zip(*utility.build_columns_from_fields(ws, columns).values())
+        return self._process_synthesis_rows(synthesis_rows, synthesis_data)
+
+    def _process_synthesis_rows(self, synthesis_rows, synthesis_data=None):
+        """Add tuples of synthesis values, in schema.synthesis_columns order, to the synthesis data."""
+        if synthesis_data is None:
+            synthesis_data = self.synthesis_data
+        # The identity columns lead each row, see RecordSchema.synthesis_columns.
+        count = 0
+        for row in synthesis_rows:
+            count += 1
+            row = self.ingest.synthesis_row(row)
+            tn = row[0]
+            if tn not in synthesis_data:
+                synthesis_data[tn] = {}
+            sd = synthesis_data.get(tn)
+            root_identity = root.RootIdentity(rootname=row[1], location=row[2], birthsession=row[3])
             if root_identity in sd:
                 raise DataError('Duplicate root encountered in synthesis data: {}'.format(root_identity))
-            sd[root_identity] = d
+            sd[root_identity] = row[4:]
+        self.metrics.incr('synthesis_rows', count)
         return True
 
     def _process_root_table(self, ws):
         log.info('Extracting root table')
-        root_data = utility.build_data_from_fields(ws, self.root_fields)
+        if not self.read_only:
+            return self._process_root_columns(utility.build_columns_from_fields(ws, self.schema.root_columns))
+        root_data = utility.iter_rows_from_columns(ws, self.schema.root_columns)
         log.info('Building roots from root_data')
-        for d in root_data:
-            tn = d.get('Tube#')
+        tube_position = self.schema.tube_position
+        count = 0
+        for row in root_data:
+            count += 1
+            tn = row[tube_position]
             # XXX Use collections.Defaultdict
             if tn not in self.root_data:
                 self.root_data[tn] = []
             rl = self.root_data.get(tn)
-            root_obj = self._root_from_dict(d)
+            root_obj = self._root_from_row(row)
             rl.append(root_obj)
+        self.metrics.incr('root_rows', count)
         return True
 
-    def _root_from_dict(self, d):
+    def _process_root_columns(self, columns):
+        """Build roots from a mapping of ROOT column name -> column values, covering schema.root_columns."""
+        log.info('Building roots from root columns')
+        columns = self.ingest.root_columns(columns)
+        tube_column = columns.get('Tube#')
+        rows = zip(*[columns.get(k) for k in self.schema.root_columns])
+        for tn, row in zip(tube_column, rows):
+            # XXX Use collections.Defaultdict
+            if tn not in self.root_data:
+                self.root_data[tn] = []
+            self.root_data.get(tn).append(self._build_root(row))
+        self.metrics.incr('root_rows', len(tube_column))
+        return True
 
-        attr_map = dict(self.root_fields.required_attributes)
-        for k, v in self.synthesis_fields.required_attributes.items():
-            if k in attr_map:
-                continue
-            attr_map[k] = v
+    def _root_from_row(self, row):
+        """Build a root from a tuple of ROOT values in schema.root_columns order."""
+        return self._build_root(self.ingest.root_row(row))
 
-        root_obj = root.Root(attr_map=attr_map,
-                             rootname=d.get('RootName'),
-                             location=d.get('Location#'),
-                             birthsession=d.get('BirthSession'))
+    def _build_root(self, row):
+        """Build a root from a tuple of ROOT values which have already been coerced by self.ingest."""
+        schema = self.schema
+        root_obj = self.root_class(rootname=row[schema.rootname_position],
+                                   location=row[schema.location_position],
+                                   birthsession=row[schema.birthsession_position])
 
         # Check for anomalous roots
-        num_tips = d.get('NumberOfTips')
-        tip_liv_status = d.get('TipLivStatus')
-        if num_tips == 1:
-            root_obj.anomaly = False
-            if tip_liv_status.startswith('A'):
-                root_obj.isAlive = 'A'
-            # XXX Configurable status!
-            elif tip_liv_status.startswith(('D', 'G')):
-                root_obj.isAlive = 'G'
-            else:
-                raise DataError('Unknown tip_liv_status [{}][{}]'.format(root_obj.identity, tip_liv_status))
-        else:
-            root_obj.anomaly = True
-            root_obj.isAlive = 'A'
-        # Set required attributes
-        for k in self.root_fields.required_attributes:
-            root_obj.set(k, d.get(k))
+        tip_liv_status = row[schema.status_position]
+        classified = schema.status_rules.classify(row[schema.tips_position], tip_liv_status)
+        if classified is None:
+            raise DataError('Unknown tip_liv_status [{}][{}]'.format(root_obj.identity, tip_liv_status))
+        root_obj.status, root_obj.anomaly = classified
+        # Set required attributes.  These include the custom fields.
+        for attr, value in zip(schema.root_slots, row):
+            setattr(root_obj, attr, value)
         # Check to see if the current root is gone
-        # XXX Configurable value!
-        if root_obj.isAlive.startswith(('D', 'G')):
-            # XXX Eww hardcorded attribute access!
-            root_obj.DeathSession = root_obj.get('Session#')
-        # Now we add arbitrary keys to the root.
-        for key in self.root_fields.custom_attributes:
-            root_obj.set(key, d.get(key))
+        if root_obj.status == root.STATUS_GONE:
+            setattr(root_obj, schema.death_session_slot, row[schema.session_position])
         return root_obj
 
     def parse(self, wb):
@@ -136,89 +349,588 @@ class Analyzer(object):
         root_sheet = wb.get_sheet_by_name(self.required_sheet_names.get('root_data'))
         synthesis_sheet = wb.get_sheet_by_name(self.required_sheet_names.get('synthesis_data'))
 
-        self._process_synthesis_table(ws=synthesis_sheet)
-        self._process_root_table(ws=root_sheet)
+        with self.metrics.stage('synthesis_table'):
+            self._process_synthesis_table(ws=synthesis_sheet)
+        with self.metrics.stage('root_table'):
+            self._process_root_table(ws=root_sheet)
+        self._parse_roots()
+
+    def _parse_roots(self):
+        """Build the tubes from the roots collected in root_data."""
+        self._check_tube_numbers(self.root_data.keys())
+
+        log.info('Processing collected data')
+        with self.metrics.stage('tubes'):
+            tubes = self._build_tubes()
+        for tube_obj in tubes:
+            self._add_tube(tube_obj)
 
-        if set(self.root_data.keys()) != set(self.synthesis_data.keys()):
-            log.error('# Root data keys [{}]'.format(len(self.root_data.keys())))
+    def _check_tube_numbers(self, tube_numbers):
+        if set(tube_numbers) != set(self.synthesis_data.keys()):
+            log.error('# Root data keys [{}]'.format(len(set(tube_numbers))))
             log.error('# Syn  data keys [{}]'.format(len(self.synthesis_data.keys())))
             log.error(self.synthesis_data)
             raise DataError('Tube numbers from root_data does not match the tube numbers from the synthesis_data')
 
-        log.info('Processing collected data')
-        for tn in self.root_data:
-            log.info('Processing data for tube [{}]'.format(tn))
-            tube_obj = tube.Tube(tn)
-            raw_roots = self.root_data.get(tn)
-
-            for root_obj in raw_roots:
-                rsession = root_obj.get('Session#')
-                if rsession > tube_obj.maxSessionCount:
-                    tube_obj.maxSessionCount = rsession
-                    log.debug('Max session count updated to {}'.format(tube_obj.maxSessionCount))
-                if rsession not in tube_obj.sessionDates:
-                    tube_obj.sessionDates[rsession] = root_obj.get('Date')
-                    log.debug('Inserted session {} - Date {}'.format(rsession, root_obj.get('Date')))
-            final_roots = []
-            log.info('Inserting roots into tube [{}]'.format(tn))
-            for root_obj in raw_roots:
-                tube_obj.insert_or_update_root(root_obj)
-                if root_obj.get('Session#') == tube_obj.maxSessionCount:
-                    final_roots.append(root_obj)
-            log.info('Finalizing roots')
-            for root_obj in final_roots:
-                status = tube_obj.finalize_root(root_obj, root_fields=self.root_fields)
-                if not status:
-                    log.error('Failed to finalize root {}'.format(root_obj.identity))
-            log.info('Inserting synthesis data')
-            # Insert the sythesis data (containing the tip stats) into the roots.
-            sdata = self.synthesis_data.get(tn)
-            tube_obj.insert_synthesis_data(sdata)
-            self.tubes.append(tube_obj)
-
-    def write(self, fp):
-        if not self.tubes:
-            raise SerializationError('No tubes available to serialize data from')
+    def _add_tube(self, tube_obj):
+        """Add a finalized tube to the results."""
+        self._report_tube(tube_obj)
+        self.tubes.append(tube_obj)
+
+    def _report_tube(self, tube_obj):
+        """Record the statistics of a finalized tube, and report the roots left unmatched by the synthesis join."""
+        for identity in tube_obj.missingSynthesis:
+            log.warning('No synthesis data for root in tube [{}]: {}'.format(tube_obj.tubeNumber, identity))
+        for identity in tube_obj.orphanedSynthesis:
+            log.warning('No root for synthesis data in tube [{}]: {}'.format(tube_obj.tubeNumber, identity))
+        self.metrics.add_tube(tube_obj)
+
+    def _build_tubes(self):
+        jobs = [(tn, self.root_data.get(tn), self.synthesis_data.get(tn), self.root_fields, self.schema.synthesis_slots,
+                 self.metrics.trace_memory) for tn in self.root_data]
+        workers = self.tube_workers
+        if workers == 1 or len(jobs) < 2:
+            return [build_tube(*job) for job in jobs]
+        # multiprocessing is only imported when processes are started, to keep startup fast.
+        import multiprocessing
+        if multiprocessing.current_process().daemon:
+            # Pool workers (for example in batch mode) may not start processes of their own.
+            log.warning('Unable to process tubes in parallel from a daemonic process')
+            return [build_tube(*job) for job in jobs]
+        log.info('Processing {} tubes with a pool of workers'.format(len(jobs)))
+        pool = multiprocessing.Pool(processes=workers)
+        try:
+            # Pool.map returns the tubes in the same order as the jobs.
+            return pool.map(_build_tube_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def query(self):
+        """Return a query.RootQuery over the analyzed tubes.
 
+        The indexes are built on first use, and rebuilt when tubes have been added since.
+        """
+        if self._query is None or self._query_tubes != len(self.tubes):
+            with self.metrics.stage('query_index'):
+                self._query = query.RootQuery(self.tubes)
+            self._query_tubes = len(self.tubes)
+        return self._query
+
+    def output_header(self):
         header = sorted(self.root_fields.identity_attributes.keys())
         header.extend(sorted([k for k in self.root_fields.required_attributes.keys() if k not in header]))
         header.extend(sorted([k for k in self.synthesis_fields.required_attributes.keys() if k not in header]))
         header.extend(sorted([k for k in root.Root.fixed_attributes if k not in header]))
+        return header
+
+    def _output_attributes(self, header):
+        """Resolve each column in the header to the root attribute which holds its value."""
+        attributes = []
+        for v in header:
+            if v in self.root_fields.required_attributes:
+                v = self.root_fields.required_attributes.get(v)
+            elif v in self.synthesis_fields.required_attributes:
+                v = self.synthesis_fields.required_attributes.get(v)
+            attributes.append(v)
+        return attributes
+
+    def iter_output_rows(self, header, tubes=None):
+        """Yield a list of values, in header order, for every root in the given tubes."""
+        attributes = self._output_attributes(header)
+        if tubes is None:
+            tubes = self.tubes
+        for tube_obj in tubes:
+            log.info('Writing out data for tube [{}]'.format(tube_obj.tubeNumber))
+            for root_obj in tube_obj:
+                yield [getattr(root_obj, attr, 'NO VALUE') for attr in attributes]
+            self.metrics.incr('rows_written', len(tube_obj))
+
+    def write(self, fp, write_only=False, output_format=writers.FORMAT_XLSX, tubes=None):
+        """Write out the compiled data of the given tubes, by default every tube in self.tubes."""
+        if tubes is None:
+            tubes = self.tubes
+        if not tubes:
+            raise SerializationError('No tubes available to serialize data from')
+
+        header = self.output_header()
         log.debug('Header row is {}'.format(header))
 
+        with self.metrics.stage('write'):
+            if write_only or output_format != writers.FORMAT_XLSX:
+                return self._write_streaming(fp, header, output_format=output_format, tubes=tubes)
+            return self._write_workbook(fp, header, tubes=tubes)
+
+    def write_changes(self, fp, write_only=False, output_format=writers.FORMAT_XLSX):
+        """Write out the compiled data of only the tubes changed by merge."""
+        changed = set(self.changed_tubes)
+        tubes = [tube_obj for tube_obj in self.tubes if tube_obj.tubeNumber in changed]
+        if not tubes:
+            raise SerializationError('No changed tubes available to serialize data from')
+        return self.write(fp, write_only=write_only, output_format=output_format, tubes=tubes)
+
+    def _write_workbook(self, fp, header, tubes=None):
+        import openpyxl
+
         wb = openpyxl.Workbook()
         ws = wb.worksheets[0]
         ws.title = 'Compiled Data'  # XXX Custom title?
-        row_index = 1
-        for i, v in enumerate(header, 1):
-            # noinspection PyUnresolvedReferences
-            col = openpyxl.cell.get_column_letter(i)
-            ws.cell('{x}{y}'.format(x=col, y=row_index)).value = v
-
-        row_index += 1
-        for tube_obj in self.tubes:
-            log.info('Writing out data for tube [{}]'.format(tube_obj.tubeNumber))
-            for root_obj in tube_obj:
-                for i, v in enumerate(header, 1):
-                    # noinspection PyUnresolvedReferences
-                    col = openpyxl.cell.get_column_letter(i)
-                    if v in self.root_fields.required_attributes:
-                        v = self.root_fields.required_attributes.get(v)
-                    elif v in self.synthesis_fields.required_attributes:
-                        v = self.synthesis_fields.required_attributes.get(v)
-                    cv = getattr(root_obj, v, 'NO VALUE')
-                    ws.cell('{x}{y}'.format(x=col, y=row_index)).value = cv
-                row_index += 1
+        ws.append(header)
+        for row in self.iter_output_rows(header, tubes):
+            ws.append(row)
 
         wb.save(filename=fp)
         return True
 
+    def _write_streaming(self, fp, header, output_format=writers.FORMAT_XLSX, tubes=None):
+        """Serialize the tubes through one of the streaming output backends.
+
+        Whole rows are handed to the backend as they are produced, so the xlsx and csv outputs
+        are written at constant memory.
+        """
+        writer = writers.get_writer(output_format)(fp, header)
+        writer.write_rows(self.iter_output_rows(header, tubes))
+        return writer.close()
+
+    def load_compiled(self, fp):
+        """Load the tubes of a result previously compiled by write, in any output format, into self.tubes.
+
+        The columns of the result must match output_header, so the same custom fields must be
+        given as when it was compiled.  Each root is restored as it was finalized, with its status
+        code taken from its isAlive label.  The custom field values of a csv result are converted
+        back from text to the types they were written from.  The last session of each tube is not part of the
+        result, so it is taken to be the latest birth or death session of its roots.
+        """
+        log.info('Loading compiled result [{}]'.format(fp))
+        expected = self.output_header()
+        identity_columns = ['RootName', 'Location#', 'BirthSession', 'Tube#']
+        tubes = collections.OrderedDict()
+        count = 0
+        with self.metrics.stage('load_compiled'):
+            rows = writers.read_rows(fp)
+            header = [str(v) for v in next(rows, None) or ()]
+            if sorted(header) != sorted(expected):
+                missing = sorted(set(expected).difference(header))
+                extra = sorted(set(header).difference(expected))
+                raise DataError('Compiled result columns do not match the expected columns.  Missing {}, '
+                                'unexpected {}'.format(missing, extra))
+            converters = self.ingest.compiled_converters(header, typed=writers.get_format(fp) != writers.FORMAT_CSV)
+            attributes = self._output_attributes(header)
+            positions = [header.index(k) for k in identity_columns]
+            session_positions = [header.index(k) for k in ('BirthSession', 'DeathSession')]
+            date_position = header.index('Date')
+            for row in rows:
+                if not any(v is not None and v != '' for v in row):
+                    continue
+                count += 1
+                row = [v if type(v) is int else f(v) for f, v in zip(converters, row)]
+                rootname, location, birthsession, tn = [row[i] for i in positions]
+                root_obj = self.root_class(rootname=rootname, location=location, birthsession=birthsession)
+                for attr, value in zip(attributes, row):
+                    if attr == 'isAlive':
+                        value = value or ''
+                        if value not in root.STATUS_CODES:
+                            raise DataError('Unknown isAlive label in compiled result [{}][{}]'.format(
+                                root_obj.identity, value))
+                    setattr(root_obj, attr, value)
+                tube_obj = tubes.get(tn)
+                if tube_obj is None:
+                    tube_obj = tubes[tn] = tube.Tube(tn)
+                if tube_obj.get_root(root_obj.identity) is not None:
+                    raise DataError('Duplicate root encountered in compiled result: {}'.format(root_obj.identity))
+                tube_obj.add_root(root_obj)
+                for i in session_positions:
+                    if type(row[i]) is int and row[i] > tube_obj.maxSessionCount:
+                        tube_obj.maxSessionCount = row[i]
+                tube_obj.sessionDates.setdefault(birthsession, row[date_position])
+        self.metrics.incr('compiled_rows', count)
+        self.tubes.extend(tubes.values())
+        self._query = None
+        return True
+
+    def merge(self, fp):
+        """Apply the sessions of a newer source to the tubes loaded with load_compiled.
+
+        ROOT rows from sessions after the last session of their tube are inserted into it with
+        Tube.insert_or_update_root, and the roots observed in the new last session are finalized
+        again with Tube.finalize_root.  Rows from sessions which are already part of a tube are
+        skipped, so a source may also hold every session.  Newer synthesis values replace the ones
+        held by the roots.  The numbers of the tubes whose compiled data changed are added to
+        self.changed_tubes.
+
+        A full analysis leaves the final values of a root blank when the root is not observed in
+        the last session of its tube.  The compiled result does not hold the values such a root
+        had before it was finalized, so a DataError is raised, before any tube is changed, if a
+        root finalized in the compiled result is not observed in the new last session of its tube.
+        """
+        log.info('Merging source [{}]'.format(fp))
+        schema = self.schema
+        tubes = collections.OrderedDict((tube_obj.tubeNumber, tube_obj) for tube_obj in self.tubes)
+        last_sessions = {tn: tube_obj.maxSessionCount for tn, tube_obj in tubes.items()}
+        raw_roots = collections.OrderedDict()  # Tube number -> roots from the new sessions.
+        synthesis_data = {}
+        skipped = 0
+        with self.metrics.stage('merge_load'):
+            source, synthesis_rows, root_rows = self._open_rows(fp)
+            try:
+                self._process_synthesis_rows(synthesis_rows, synthesis_data)
+                for row in root_rows:
+                    row = self.ingest.root_row(row)
+                    tn = row[schema.tube_position]
+                    if tn in last_sessions and row[schema.session_position] <= last_sessions[tn]:
+                        skipped += 1
+                        continue
+                    raw_roots.setdefault(tn, []).append(self._build_root(row))
+            finally:
+                source.close()
+        self.metrics.incr('merge_rows_skipped', skipped)
+        for tn, new_roots in raw_roots.items():
+            if tn in tubes:
+                check_merged_roots(tubes[tn], new_roots)
+
+        attributes = self._output_attributes(self.output_header())
+        changed = set(self.changed_tubes)
+        with self.metrics.stage('merge'):
+            for tn in list(raw_roots) + [tn for tn in synthesis_data if tn not in raw_roots]:
+                tube_obj = tubes.get(tn)
+                if tube_obj is None:
+                    if tn not in raw_roots:
+                        log.warning('No roots for the synthesis data of tube [{}]'.format(tn))
+                        continue
+                    tube_obj = tubes[tn] = tube.Tube(tn)
+                    self.tubes.append(tube_obj)
+                before = [[getattr(root_obj, attr, 'NO VALUE') for attr in attributes] for root_obj in tube_obj]
+                new_roots = raw_roots.get(tn, [])
+                if new_roots:
+                    self.metrics.incr('root_rows', len(new_roots))
+                    collect_tube(tube_obj, new_roots)
+                    for root_obj in new_roots:
+                        if root_obj.get('Session#') == tube_obj.maxSessionCount:
+                            tube_obj.finalize_root(root_obj, root_fields=self.root_fields)
+                tube_obj.insert_synthesis_data(synthesis_data.get(tn, {}), schema.synthesis_slots, update=True)
+                after = [[getattr(root_obj, attr, 'NO VALUE') for attr in attributes] for root_obj in tube_obj]
+                if after != before:
+                    self._report_tube(tube_obj)
+                    if tn not in changed:
+                        changed.add(tn)
+                        self.metrics.incr('tubes_changed')
+        order = dict((tube_obj.tubeNumber, i) for i, tube_obj in enumerate(self.tubes))
+        self.changed_tubes = sorted(changed, key=order.get)
+        self._query = None
+        log.info('Merged [{}], {} of {} tubes changed'.format(fp, len(self.changed_tubes), len(self.tubes)))
+        return True
+
+    def insert_pipelined(self, fp, output, output_format=writers.FORMAT_XLSX,
+                         queue_size=pipeline.DEFAULT_QUEUE_SIZE):
+        """Insert a source and write out its compiled data in a single pipelined pass.
+
+        The Synthesis sheet is read first.  The ROOT sheet is then streamed on a reader thread, in
+        chunks of pipeline.CHUNK_ROWS rows.  A second thread builds the roots of each chunk and
+        inserts them into their tubes as the chunk arrives, so the rows of a tube need not be
+        contiguous.  Once every row has been read, the tubes are finalized and joined with their
+        synthesis data, and each finished tube is written out on a third thread, through a
+        streaming output backend.  At most queue_size chunks or tubes wait between two stages.
+        The tubes are not kept in self.tubes.
+        """
+        with self.metrics.stage('pipeline'):
+            source, synthesis_rows, root_rows = self._open_rows(fp)
+            try:
+                with self.metrics.stage('synthesis_table'):
+                    self._process_synthesis_rows(synthesis_rows)
+                stages = [self._pipeline_tubes,
+                          functools.partial(self._pipeline_write, fp=output, output_format=output_format), ]
+                pipeline.Pipeline(queue_size=queue_size).run(pipeline.chunked(root_rows, pipeline.CHUNK_ROWS), stages)
+            finally:
+                source.close()
+        return True
+
+    def _open_rows(self, fp):
+        """Open a source, returning (source, Synthesis row iterator, ROOT row iterator).
+
+        The rows are in schema.synthesis_columns and schema.root_columns order.  Workbooks are always
+        streamed from a read only workbook.  The caller must close the source once the rows are consumed.
+        """
+        if store.is_store(fp):
+            source = store.open_store(fp)
+            synthesis_rows = zip(*store.read_columns(source, self.required_sheet_names.get('synthesis_data'),
+                                                     self.schema.synthesis_columns).values())
+            root_rows = zip(*store.read_columns(source, self.required_sheet_names.get('root_data'),
+                                                self.schema.root_columns).values())
+            return source, synthesis_rows, root_rows
+        source = self._load_workbook(fp, read_only=True)
+        synthesis_rows = utility.iter_rows_from_columns(
+            source.get_sheet_by_name(self.required_sheet_names.get('synthesis_data')),
+            self.schema.synthesis_columns)
+        root_rows = utility.iter_rows_from_columns(
+            source.get_sheet_by_name(self.required_sheet_names.get('root_data')),
+            self.schema.root_columns)
+        return source, synthesis_rows, root_rows
+
+    def _pipeline_tubes(self, chunks):
+        """Insert each chunk of ROOT rows into its tubes, and yield the finalized tubes once every chunk is in.
+
+        Only the roots observed in the last session of each tube so far are kept for finalizing it.
+        Tubes are yielded in the order they are first seen, with their synthesis data.
+        """
+        tube_position = self.schema.tube_position
+        # Tube number -> (tube, roots observed in the last session of the tube so far).
+        states = collections.OrderedDict()
+        for rows in chunks:
+            self.metrics.incr('root_rows', len(rows))
+            new_roots = collections.OrderedDict()
+            for row in rows:
+                row = self.ingest.root_row(row)
+                new_roots.setdefault(row[tube_position], []).append(self._build_root(row))
+            for tn, raw_roots in new_roots.items():
+                start = timeit.default_timer()
+                if tn not in states:
+                    states[tn] = (tube.Tube(tn), [])
+                tube_obj, final_roots = states[tn]
+                previous_max = tube_obj.maxSessionCount
+                collect_tube(tube_obj, raw_roots)
+                if tube_obj.maxSessionCount != previous_max:
+                    del final_roots[:]
+                final_roots.extend(root_obj for root_obj in raw_roots
+                                   if root_obj.get('Session#') == tube_obj.maxSessionCount)
+                tube_obj.stats['seconds'] += timeit.default_timer() - start
+
+        if not states:
+            raise SerializationError('No tubes available to serialize data from')
+        self._check_tube_numbers(states)
+        while states:
+            tn, (tube_obj, final_roots) = states.popitem(last=False)
+            start = timeit.default_timer()
+            finalize_tube(tube_obj, final_roots, self.synthesis_data.get(tn), self.root_fields,
+                          self.schema.synthesis_slots)
+            tube_obj.stats['seconds'] += timeit.default_timer() - start
+            self._report_tube(tube_obj)
+            yield tube_obj
+
+    def _tube_from_rows(self, tn, rows, sdata):
+        """Build a finalized tube, with its synthesis data, from the ROOT rows of a single tube."""
+        self.metrics.incr('root_rows', len(rows))
+        raw_roots = [self._root_from_row(row) for row in rows]
+        tube_obj = build_tube(tn, raw_roots, sdata, self.root_fields, self.schema.synthesis_slots,
+                              trace_memory=self.metrics.trace_memory)
+        self._report_tube(tube_obj)
+        return tube_obj
+
+    def _pipeline_write(self, tubes, fp, output_format):
+        """Write out each tube as it is received.  The output is only finished if every tube was written."""
+        header = self.output_header()
+        writer = writers.get_writer(output_format)(fp, header)
+        try:
+            for tube_obj in tubes:
+                writer.write_rows(self.iter_output_rows(header, [tube_obj]))
+        except:
+            # Do not leave a partial output behind when any stage of the pipeline fails.
+            writer.abort()
+            raise
+        with self.metrics.stage('write'):
+            writer.close()
+
+    def insert_out_of_core(self, fp, output, output_format=writers.FORMAT_XLSX, spill_dir=None,
+                           buffer_rows=spill.DEFAULT_BUFFER_ROWS):
+        """Insert a source and write out its compiled data, holding a single tube in memory at a time.
+
+        The Synthesis and ROOT rows are streamed from the source and spilled to a temporary
+        spill.SpillStore in spill_dir, partitioned by tube number.  Each tube is then read back,
+        built and written out through a streaming output backend before the next one is read, so
+        peak memory is bounded by the largest tube rather than the whole source.  The tubes are not
+        kept in self.tubes.
+        """
+        root_table = self.required_sheet_names.get('root_data')
+        synthesis_table = self.required_sheet_names.get('synthesis_data')
+        with spill.SpillStore(spill_dir=spill_dir, buffer_rows=buffer_rows) as spilled:
+            with self.metrics.stage('spill'):
+                source, synthesis_rows, root_rows = self._open_rows(fp)
+                try:
+                    for row in synthesis_rows:
+                        row = self.ingest.synthesis_row(row)
+                        spilled.append(synthesis_table, row[0], row)
+                    tube_position = self.schema.tube_position
+                    for row in root_rows:
+                        row = self.ingest.root_row(row)
+                        spilled.append(root_table, row[tube_position], row)
+                    spilled.flush()
+                finally:
+                    source.close()
+            self.metrics.incr('rows_spilled', spilled.rows_spilled)
+            tube_numbers = spilled.keys(root_table)
+            if not tube_numbers:
+                raise SerializationError('No tubes available to serialize data from')
+            if set(tube_numbers) != set(spilled.keys(synthesis_table)):
+                log.error('# Root data keys [{}]'.format(len(tube_numbers)))
+                log.error('# Syn  data keys [{}]'.format(len(spilled.keys(synthesis_table))))
+                raise DataError('Tube numbers from root_data does not match the tube numbers from the synthesis_data')
+
+            header = self.output_header()
+            writer = writers.get_writer(output_format)(output, header)
+            try:
+                for tn in tube_numbers:
+                    with self.metrics.stage('tubes'):
+                        synthesis_data = {}
+                        self._process_synthesis_rows(spilled.rows(synthesis_table, tn), synthesis_data)
+                        tube_obj = self._tube_from_rows(tn, spilled.rows(root_table, tn), synthesis_data.get(tn))
+                    with self.metrics.stage('write'):
+                        writer.write_rows(self.iter_output_rows(header, [tube_obj]))
+                    del tube_obj
+            except:
+                writer.abort()
+                raise
+            with self.metrics.stage('write'):
+                writer.close()
+        return True
+
+
+def collect_tube(tube_obj, raw_roots):
+    """Record the sessions of the raw roots in the tube, and insert or update the roots in it."""
+    for root_obj in raw_roots:
+        rsession = root_obj.get('Session#')
+        if rsession > tube_obj.maxSessionCount:
+            tube_obj.maxSessionCount = rsession
+            log.debug('Max session count updated to %s', tube_obj.maxSessionCount)
+        if rsession not in tube_obj.sessionDates:
+            tube_obj.sessionDates[rsession] = root_obj.get('Date')
+            log.debug('Inserted session %s - Date %s', rsession, root_obj.get('Date'))
+    log.info('Inserting roots into tube [{}]'.format(tube_obj.tubeNumber))
+    for root_obj in raw_roots:
+        tube_obj.insert_or_update_root(root_obj)
+
+
+def check_merged_roots(tube_obj, new_roots):
+    """Check that every root finalized in a compiled tube is observed in the last session of the new roots."""
+    last_session = max(root_obj.get('Session#') for root_obj in new_roots)
+    observed = set(root_obj.identity for root_obj in new_roots if root_obj.get('Session#') == last_session)
+    unobserved = [root_obj.identity for root_obj in tube_obj
+                  if root_obj.censored not in ('', None) and root_obj.identity not in observed]
+    if unobserved:
+        raise DataError('Roots of tube [{}] finalized in the compiled result are not observed in its new last '
+                        'session [{}], so they would not match a full analysis: {}'.format(tube_obj.tubeNumber,
+                                                                                           last_session, unobserved))
+
+
+def finalize_tube(tube_obj, final_roots, sdata, root_fields, synthesis_slots):
+    """Finalize the roots of a tube from their observations in its last session, and insert the synthesis data."""
+    log.info('Finalizing roots')
+    for root_obj in final_roots:
+        status = tube_obj.finalize_root(root_obj, root_fields=root_fields)
+        if not status:
+            log.error('Failed to finalize root {}'.format(root_obj.identity))
+    log.info('Inserting synthesis data')
+    # Insert the sythesis data (containing the tip stats) into the roots.
+    tube_obj.insert_synthesis_data(sdata, synthesis_slots)
+    return tube_obj
+
+
+def build_tube(tn, raw_roots, sdata, root_fields, synthesis_slots, trace_memory=False):
+    """Build a finalized Tube from the roots observed in it and its synthesis data.
+
+    Every tube is processed independently of the others, so this may be run in a worker process.
+    When trace_memory is set, the peak memory allocated while building the tube is recorded in its stats.
+    """
+    log.info('Processing data for tube [{}]'.format(tn))
+    start = timeit.default_timer()
+    peak = {}
+    with metrics.trace_peak(peak, enabled=trace_memory):
+        tube_obj = tube.Tube(tn)
+        collect_tube(tube_obj, raw_roots)
+        final_roots = [root_obj for root_obj in raw_roots if root_obj.get('Session#') == tube_obj.maxSessionCount]
+        finalize_tube(tube_obj, final_roots, sdata, root_fields, synthesis_slots)
+    tube_obj.stats['seconds'] = timeit.default_timer() - start
+    tube_obj.stats.update(peak)
+    return tube_obj
+
+
+def _build_tube_job(job):
+    return build_tube(*job)
+
 
 #
 # Main program functions
 #
 
 
+BatchResult = collections.namedtuple('BatchResult', ['source', 'output', 'success', 'error', 'metrics'])
+
+
+def collect_sources(sources=None, source_dirs=None):
+    """Return the sorted list of source workbooks named directly or found in the given directories."""
+    ret = set(os.path.abspath(src) for src in sources or [])
+    for source_dir in source_dirs or []:
+        for name in os.listdir(source_dir):
+            # Skip the lock files excel leaves next to open workbooks.
+            if not name.lower().endswith(('.xlsx', store.STORE_EXTENSION)) or name.startswith('~$'):
+                continue
+            ret.add(os.path.abspath(os.path.join(source_dir, name)))
+    return sorted(ret)
+
+
+def batch_output_path(src, output_dir, output_format=writers.FORMAT_XLSX):
+    stem = os.path.splitext(os.path.basename(src))[0]
+    return os.path.join(output_dir, stem + writers.get_writer(output_format).extension)
+
+
+def process_source(job):
+    """Analyze a single source workbook and write out its compiled data.
+
+    This is run in the batch worker processes, so failures are logged and returned in the
+    BatchResult instead of being raised.
+    """
+    src, output, analyzer_kwargs, write_kwargs, pipeline_kwargs, spill_kwargs = job
+    log.info('Processing source [{}]'.format(src))
+    analyzer = None
+    try:
+        analyzer = Analyzer(**analyzer_kwargs)
+        output_format = write_kwargs.get('output_format', writers.FORMAT_XLSX)
+        if pipeline_kwargs is not None:
+            analyzer.insert_pipelined(src, output, output_format=output_format, **pipeline_kwargs)
+        elif spill_kwargs is not None:
+            analyzer.insert_out_of_core(src, output, output_format=output_format, **spill_kwargs)
+        else:
+            analyzer.insert(src)
+            analyzer.write(output, **write_kwargs)
+    except Exception:
+        log.exception('Failed to process source [{}]'.format(src))
+        report = analyzer.metrics.report() if analyzer else None
+        return BatchResult(source=src, output=output, success=False, error=traceback.format_exc(), metrics=report)
+    return BatchResult(source=src, output=output, success=True, error=None, metrics=analyzer.metrics.report())
+
+
+def run_batch(sources, output_dir, jobs=None, analyzer_kwargs=None, write_kwargs=None, pipeline_kwargs=None,
+              spill_kwargs=None):
+    """Process each source workbook with a fresh Analyzer in a pool of worker processes.
+
+    Each source is written to its own output file in output_dir.  A failure in one source does
+    not stop the others.  Returns a list of BatchResult in the same order as sources.  When
+    pipeline_kwargs is given, each source is processed with Analyzer.insert_pipelined, and when
+    spill_kwargs is given, with Analyzer.insert_out_of_core.
+    """
+    analyzer_kwargs = analyzer_kwargs or {}
+    write_kwargs = write_kwargs or {}
+    output_format = write_kwargs.get('output_format', writers.FORMAT_XLSX)
+    job_list = []
+    outputs = set()
+    for src in sources:
+        output = batch_output_path(src, output_dir, output_format)
+        if output in outputs:
+            raise AnalyzerError('Multiple sources would be written to the same output [{}]'.format(output))
+        outputs.add(output)
+        job_list.append((src, output, analyzer_kwargs, write_kwargs, pipeline_kwargs, spill_kwargs))
+
+    if jobs == 1 or len(job_list) < 2:
+        return [process_source(job) for job in job_list]
+    import multiprocessing
+    pool = multiprocessing.Pool(processes=jobs)
+    try:
+        # chunksize=1 keeps a slow workbook from holding up a queue of others behind it.
+        results = pool.map(process_source, job_list, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
 def main(options):
     #
     #   DOES NOT HANDLE EXCEPTION LISTS
@@ -229,46 +941,413 @@ def main(options):
         log.info('Output will not be verbose')
         logging.disable(logging.DEBUG)
 
-    if not os.path.isfile(options.src_file):
-        log.error('specified source is not a file')
-        sys.exit(-1)
-
-    if os.path.exists(options.output):
-        log.warning('Specified output file already exists.\n')
-        if not utility.query_yes_no('Do you want to overwrite that file?', 'no'):
-            log.info('Exiting')
+    for src in options.src_files:
+        if not os.path.isfile(src):
+            log.error('specified source is not a file [{}]'.format(src))
+            sys.exit(-1)
+    for source_dir in options.src_dirs:
+        if not os.path.isdir(source_dir):
+            log.error('specified source directory is not a directory [{}]'.format(source_dir))
             sys.exit(-1)
 
+    sources = collect_sources(options.src_files, options.src_dirs)
+    if not sources:
+        log.error('No source files to process')
+        sys.exit(-1)
+
     # Unpack the custom fields into a mapping
     fdict = {k: v for k, v in options.fields}
+    status_rules = None
+    if options.status_rules:
+        try:
+            status_rules = status.load_rules(options.status_rules)
+        except FieldsError as e:
+            log.error('Failed to load status rules [{}], which are neither a rules file nor valid inline rules: '
+                      '{}'.format(options.status_rules, e))
+            sys.exit(-1)
+        log.info('Using {}'.format(status_rules))
+    analyzer_kwargs = {'additional_root_fields': fdict,
+                       'read_only': options.read_only,
+                       'tube_workers': options.tube_workers,
+                       'cache_dir': options.cache_dir,
+                       'trace_memory': options.trace_memory,
+                       'status_rules': status_rules, }
+    write_kwargs = {'write_only': options.write_only,
+                    'output_format': options.output_format, }
+    pipeline_kwargs = None
+    if options.pipeline:
+        pipeline_kwargs = {'queue_size': options.queue_size}
+    spill_kwargs = None
+    if options.out_of_core:
+        if options.pipeline:
+            log.error('--pipeline and --out-of-core may not be used together')
+            sys.exit(-1)
+        if options.spill_dir and not os.path.isdir(options.spill_dir):
+            log.error('specified spill directory is not a directory [{}]'.format(options.spill_dir))
+            sys.exit(-1)
+        if options.spill_buffer < 1:
+            log.error('--spill-buffer must be at least 1')
+            sys.exit(-1)
+        spill_kwargs = {'spill_dir': options.spill_dir,
+                        'buffer_rows': options.spill_buffer, }
 
-    analyzer = Analyzer(additional_root_fields=fdict)
-    analyzer.insert(options.src_file)
-    analyzer.write(options.output)
+    if len(sources) == 1 and not options.src_dirs:
+        if os.path.exists(options.output):
+            log.warning('Specified output file already exists.\n')
+            if not utility.query_yes_no('Do you want to overwrite that file?', 'no'):
+                log.info('Exiting')
+                sys.exit(-1)
 
-    log.info('Done processing all data')
-    sys.exit(0)
+        analyzer = Analyzer(**analyzer_kwargs)
+        if pipeline_kwargs is not None:
+            analyzer.insert_pipelined(sources[0], options.output, output_format=options.output_format,
+                                      **pipeline_kwargs)
+        elif spill_kwargs is not None:
+            analyzer.insert_out_of_core(sources[0], options.output, output_format=options.output_format,
+                                        **spill_kwargs)
+        else:
+            analyzer.insert(sources[0])
+            analyzer.write(options.output, **write_kwargs)
+        if options.metrics:
+            analyzer.metrics.write_json(options.metrics)
+
+        log.info('Done processing all data')
+        sys.exit(0)
+
+    # Batch mode - the output is a directory holding one output file per source.
+    if os.path.exists(options.output) and not os.path.isdir(options.output):
+        log.error('The output must be a directory when processing multiple sources')
+        sys.exit(-1)
+    if not os.path.exists(options.output):
+        os.makedirs(options.output)
+    existing = [src for src in sources
+                if os.path.exists(batch_output_path(src, options.output, options.output_format))]
+    if existing:
+        log.warning('Output files already exist for {} of the sources.\n'.format(len(existing)))
+        if not utility.query_yes_no('Do you want to overwrite those files?', 'no'):
+            log.info('Exiting')
+            sys.exit(-1)
+
+    results = run_batch(sources, options.output, jobs=options.jobs, analyzer_kwargs=analyzer_kwargs,
+                        write_kwargs=write_kwargs, pipeline_kwargs=pipeline_kwargs, spill_kwargs=spill_kwargs)
+    if options.metrics:
+        with open(options.metrics, 'w') as f:
+            json.dump({result.source: result.metrics for result in results}, f, indent=2, sort_keys=True)
+    failures = [result for result in results if not result.success]
+    for result in failures:
+        log.error('Failed to process [{}]\n{}'.format(result.source, result.error))
+    log.info('Processed {} sources, {} failed'.format(len(results), len(failures)))
+    sys.exit(1 if failures else 0)
 
 
 def root_options():
     parser = argparse.ArgumentParser(prog=__name__)
-    parser.add_argument('-s', '--source', dest='src_file', required=True, type=str, action='store',
-                        help='Source xlsx file to process')
+    parser.add_argument('-s', '--source', dest='src_files', default=[], type=str, action='append',
+                        help='Source xlsx file, or store written by the convert command, to process.  This may be '
+                             'given multiple times to process a batch of files.')
+    parser.add_argument('-d', '--source-dir', dest='src_dirs', default=[], type=str, action='append',
+                        help='Directory of source xlsx files and stores to process as a batch.  This may be given '
+                             'multiple times.')
     parser.add_argument('-o', '--output', dest='output', required=True, type=str, action='store',
-                        help='Define the output file (xlsx)')
+                        help='Define the output file.  The format is set with --format.  When processing a batch '
+                             'of sources, this is a directory which receives one output file per source.')
+    parser.add_argument('-j', '--jobs', dest='jobs', default=None, type=int, action='store',
+                        help='Number of worker processes used for a batch of sources.  Defaults to the number of '
+                             'CPUs.')
     parser.add_argument('-f', '--field', dest='fields', default=[], action='append', nargs=2,
                         help='Define a custom field that is extracted.  This take two values.'
                              ' The first value is the  column name from the ROOT table.  The'
                              ' second value must be in [{b},{d}], indicating that the value '
                              'is set at the birth or finalization of root.'.format(b=fields.ROOT_BIRTH,
                                                                                    d=fields.ROOT_FINAL))
+    parser.add_argument('--status-rules', dest='status_rules', default=None, type=str, action='store',
+                        help='TipLivStatus classification rules.  This is either a JSON file, or inline rules such as '
+                             '"alive=A;gone=D,G;match=prefix;ignore_case=false".  Defaults to the alive prefix A, and '
+                             'the gone prefixes D and G.')
+    parser.add_argument('-t', '--tube-workers', dest='tube_workers', default=1, type=int, action='store',
+                        help='Number of worker processes used to process the tubes of a workbook in parallel.  '
+                             'Defaults to 1.  This is ignored for batches processed by multiple --jobs.')
+    parser.add_argument('-c', '--cache-dir', dest='cache_dir', default=None, type=str, action='store',
+                        help='Cache parsed workbooks in this directory.  Unchanged workbooks are then not parsed '
+                             'again, and only the rows appended to a cached workbook are processed.')
+    parser.add_argument('-r', '--read-only', dest='read_only', default=False, action='store_true',
+                        help='Stream the source sheets row by row from a read only workbook.  This keeps memory use '
+                             'low for very large source files.')
+    parser.add_argument('-w', '--write-only', dest='write_only', default=False, action='store_true',
+                        help='Stream the compiled data into a write only workbook.  This keeps memory use constant '
+                             'when writing very large outputs.')
+    parser.add_argument('-p', '--pipeline', dest='pipeline', default=False, action='store_true',
+                        help='Read, process and write each source in a single pipelined pass, with the reading, '
+                             'tube processing and writing overlapped on separate threads.  The ROOT rows are inserted '
+                             'into their tubes while they are read, and the tubes are written out once they are '
+                             'finalized.  Output is always streamed, and --cache-dir and --tube-workers are not used.')
+    parser.add_argument('--queue-size', dest='queue_size', default=pipeline.DEFAULT_QUEUE_SIZE, type=int,
+                        action='store',
+                        help='Number of chunks of rows, or of tubes, which may wait between two stages of the '
+                             'pipeline.  Defaults to {}.'.format(pipeline.DEFAULT_QUEUE_SIZE))
+    parser.add_argument('--out-of-core', dest='out_of_core', default=False, action='store_true',
+                        help='Spill the rows of each source to temporary files partitioned by tube, then process and '
+                             'write one tube at a time, so memory use is bounded by the largest tube.  Output is '
+                             'always streamed, and --cache-dir and --tube-workers are not used.')
+    parser.add_argument('--spill-dir', dest='spill_dir', default=None, type=str, action='store',
+                        help='Directory for the temporary files of --out-of-core.  Defaults to the system temporary '
+                             'directory.')
+    parser.add_argument('--spill-buffer', dest='spill_buffer', default=spill.DEFAULT_BUFFER_ROWS, type=int,
+                        action='store',
+                        help='Number of rows buffered in memory before they are spilled to disk with --out-of-core.  '
+                             'Defaults to {}.'.format(spill.DEFAULT_BUFFER_ROWS))
+    parser.add_argument('--format', dest='output_format', default=writers.FORMAT_XLSX, type=str, action='store',
+                        choices=sorted(writers.WRITERS),
+                        help='Output format.  csv and columnar are always streamed, and columnar is a compact typed '
+                             'binary format which can be read with columnar.ColumnarFile.  Defaults to xlsx.')
+    parser.add_argument('-m', '--metrics', dest='metrics', default=None, type=str, action='store',
+                        help='Write a JSON report of the stage timings, counters and per tube statistics of the run '
+                             'to this file.  For a batch, the report holds one entry per source.')
+    parser.add_argument('--trace-memory', dest='trace_memory', default=False, action='store_true',
+                        help='Record the peak memory allocated in each stage, and while building each tube, in the '
+                             'metrics.  This slows the run down.')
+    parser.add_argument('-v', '--verbose', dest='verbose', default=False, action='store_true',
+                        help='Enable verbose output')
+    return parser
+
+
+def convert_main(options):
+    if not options.verbose:
+        logging.disable(logging.DEBUG)
+    if not os.path.isfile(options.src_file):
+        log.error('specified source is not a file [{}]'.format(options.src_file))
+        sys.exit(-1)
+    if os.path.exists(options.output):
+        log.warning('Specified output file already exists.\n')
+        if not utility.query_yes_no('Do you want to overwrite that file?', 'no'):
+            log.info('Exiting')
+            sys.exit(-1)
+    # Convert with the default sheet names used by the Analyzer.
+    sheet_names = Analyzer().required_sheet_names
+    counts = store.convert(options.src_file, options.output,
+                           [sheet_names.get('root_data'), sheet_names.get('synthesis_data')])
+    for sheet_name, rows in counts.items():
+        log.info('Stored {} rows from sheet [{}]'.format(rows, sheet_name))
+    sys.exit(0)
+
+
+def convert_options():
+    parser = argparse.ArgumentParser(prog='{} convert'.format(__name__),
+                                     description='Convert the ROOT and Synthesis sheets of a workbook into a binary '
+                                                 'store, which is analyzed without opening the workbook.')
+    parser.add_argument('-s', '--source', dest='src_file', required=True, type=str, action='store',
+                        help='Source xlsx file to convert')
+    parser.add_argument('-o', '--output', dest='output', required=True, type=str, action='store',
+                        help='Define the output store.  By convention this has the {} extension.'.format(
+                            store.STORE_EXTENSION))
+    parser.add_argument('-v', '--verbose', dest='verbose', default=False, action='store_true',
+                        help='Enable verbose output')
+    return parser
+
+
+def stats_main(options):
+    if not options.verbose:
+        logging.disable(logging.DEBUG)
+    if not os.path.isfile(options.src_file):
+        log.error('specified source is not a file [{}]'.format(options.src_file))
+        sys.exit(-1)
+    if options.jobs is not None and options.jobs < 1:
+        log.error('--jobs must be at least 1')
+        sys.exit(-1)
+    try:
+        results = summary.summarize(options.src_file, sheets=options.sheets, columns=options.columns,
+                                    jobs=options.jobs, session_column=options.session_column, top=options.top)
+    except (AnalyzerError, DataError) as e:
+        log.error('Failed to summarize [{}]: {}'.format(options.src_file, e))
+        sys.exit(-1)
+    if options.output:
+        summary.write_json(results, options.output)
+        log.info('Wrote summary to [{}]'.format(options.output))
+    else:
+        for line in summary.format_summary(results):
+            print(line)
+    sys.exit(0)
+
+
+def stats_options():
+    parser = argparse.ArgumentParser(prog='{} stats'.format(__name__),
+                                     description='Summarize the columns of the sheets of a workbook or store in a '
+                                                 'single streaming pass: value counts, null counts and the minimum '
+                                                 'and maximum value, overall and per session.')
+    parser.add_argument('-s', '--source', dest='src_file', required=True, type=str, action='store',
+                        help='Source xlsx file or store to summarize')
+    parser.add_argument('--sheet', dest='sheets', default=None, type=str, action='append',
+                        help='Sheet to summarize.  May be given more than once.  Defaults to every sheet, or with '
+                             '--column, to every sheet holding the columns.')
+    parser.add_argument('-c', '--column', dest='columns', default=None, type=str, action='append',
+                        help='Column to summarize.  May be given more than once.  Defaults to every column.')
+    parser.add_argument('-j', '--jobs', dest='jobs', default=None, type=int, action='store',
+                        help='Number of worker processes, each summarizing one sheet.  Defaults to the number of '
+                             'CPUs.')
+    parser.add_argument('--session-column', dest='session_column', default=summary.SESSION_COLUMN, type=str,
+                        action='store', help='Column holding the session of each row, used for the per session '
+                                             'summaries.  Defaults to {}.'.format(summary.SESSION_COLUMN))
+    parser.add_argument('--top', dest='top', default=None, type=int, action='store',
+                        help='Only report the counts of the most common values of each column.')
+    parser.add_argument('-o', '--output', dest='output', default=None, type=str, action='store',
+                        help='Write the full summary, including value counts, to this JSON file.  Otherwise a table '
+                             'of the summary is printed.')
     parser.add_argument('-v', '--verbose', dest='verbose', default=False, action='store_true',
                         help='Enable verbose output')
     return parser
 
 
+def merge_main(options):
+    if not options.verbose:
+        logging.disable(logging.DEBUG)
+    for src in [options.base] + options.src_files:
+        if not os.path.isfile(src):
+            log.error('specified source is not a file [{}]'.format(src))
+            sys.exit(-1)
+    outputs = [fp for fp in (options.output, options.full_output) if fp]
+    if any(os.path.exists(fp) for fp in outputs):
+        log.warning('Specified output file already exists.\n')
+        if not utility.query_yes_no('Do you want to overwrite that file?', 'no'):
+            log.info('Exiting')
+            sys.exit(-1)
+    status_rules = None
+    if options.status_rules:
+        try:
+            status_rules = status.load_rules(options.status_rules)
+        except FieldsError as e:
+            log.error('Failed to load status rules [{}], which are neither a rules file nor valid inline rules: '
+                      '{}'.format(options.status_rules, e))
+            sys.exit(-1)
+        log.info('Using {}'.format(status_rules))
+    analyzer = Analyzer(additional_root_fields={k: v for k, v in options.fields},
+                        status_rules=status_rules)
+    analyzer.load_compiled(options.base)
+    for src in options.src_files:
+        analyzer.merge(src)
+    if analyzer.changed_tubes:
+        analyzer.write_changes(options.output, write_only=True, output_format=options.output_format)
+    else:
+        log.info('No tubes changed, so no changes were written')
+    if options.full_output:
+        analyzer.write(options.full_output, write_only=True, output_format=options.output_format)
+    if options.metrics:
+        analyzer.metrics.write_json(options.metrics)
+    log.info('Done merging all data')
+    sys.exit(0)
+
+
+def merge_options():
+    parser = argparse.ArgumentParser(prog='{} merge'.format(__name__),
+                                     description='Apply the sessions of newer workbooks to a previously compiled '
+                                                 'result, and write out only the tubes which changed.')
+    parser.add_argument('-b', '--base', dest='base', required=True, type=str, action='store',
+                        help='Previously compiled result, in any of the output formats.')
+    parser.add_argument('-s', '--source', dest='src_files', required=True, type=str, action='append',
+                        help='Newer source xlsx file, or store written by the convert command, to merge into the '
+                             'compiled result.  This may be given multiple times, and the sources are merged in the '
+                             'order they are given.')
+    parser.add_argument('-o', '--output', dest='output', required=True, type=str, action='store',
+                        help='Output file receiving the compiled data of the changed tubes.')
+    parser.add_argument('--full-output', dest='full_output', default=None, type=str, action='store',
+                        help='Also write the compiled data of every tube, changed or not, to this file.')
+    parser.add_argument('-f', '--field', dest='fields', default=[], action='append', nargs=2,
+                        help='Define a custom field that is extracted, as for the analysis.  The custom fields must '
+                             'match the ones the compiled result was built with.')
+    parser.add_argument('--status-rules', dest='status_rules', default=None, type=str, action='store',
+                        help='TipLivStatus classification rules, as for the analysis.')
+    parser.add_argument('--format', dest='output_format', default=writers.FORMAT_XLSX, type=str, action='store',
+                        choices=sorted(writers.WRITERS), help='Output format.  Defaults to xlsx.')
+    parser.add_argument('-m', '--metrics', dest='metrics', default=None, type=str, action='store',
+                        help='Write a JSON report of the stage timings and counters of the merge to this file.')
+    parser.add_argument('-v', '--verbose', dest='verbose', default=False, action='store_true',
+                        help='Enable verbose output')
+    return parser
+
+
+def validate_main(options):
+    if not options.verbose:
+        logging.disable(logging.INFO)
+    for src in options.src_files:
+        if not os.path.isfile(src):
+            log.error('specified source is not a file [{}]'.format(src))
+            sys.exit(-1)
+    for source_dir in options.src_dirs:
+        if not os.path.isdir(source_dir):
+            log.error('specified source directory is not a directory [{}]'.format(source_dir))
+            sys.exit(-1)
+    sources = collect_sources(options.src_files, options.src_dirs)
+    if not sources:
+        log.error('No source files to validate')
+        sys.exit(-1)
+    status_rules = None
+    if options.status_rules:
+        try:
+            status_rules = status.load_rules(options.status_rules)
+        except FieldsError as e:
+            log.error('Failed to load status rules [{}], which are neither a rules file nor valid inline rules: '
+                      '{}'.format(options.status_rules, e))
+            sys.exit(-1)
+    reports = validate.validate_batch(sources, jobs=options.jobs,
+                                      additional_root_fields={k: v for k, v in options.fields},
+                                      status_rules=status_rules,
+                                      max_issues=options.max_issues)
+    for report in reports:
+        for line in validate.format_report(report):
+            print(line)
+    if options.output:
+        validate.write_json(reports, options.output)
+    invalid = [report for report in reports if not report.ok]
+    print('Validated {} sources, {} invalid'.format(len(reports), len(invalid)))
+    sys.exit(1 if invalid else 0)
+
+
+def validate_options():
+    parser = argparse.ArgumentParser(prog='{} validate'.format(__name__),
+                                     description='Check the sources in a single streaming pass, reporting every '
+                                                 'problem which would stop or spoil their analysis: missing sheets '
+                                                 'and columns, non integer values, duplicate Synthesis roots, '
+                                                 'unknown TipLivStatus values and tubes missing from either sheet.  '
+                                                 'Exits with 1 if any source is invalid.')
+    parser.add_argument('-s', '--source', dest='src_files', default=[], type=str, action='append',
+                        help='Source xlsx file, or store written by the convert command, to validate.  This may be '
+                             'given multiple times.')
+    parser.add_argument('-d', '--source-dir', dest='src_dirs', default=[], type=str, action='append',
+                        help='Directory of source xlsx files and stores to validate.  This may be given multiple '
+                             'times.')
+    parser.add_argument('-j', '--jobs', dest='jobs', default=None, type=int, action='store',
+                        help='Number of worker processes, each validating one source at a time.  Defaults to the '
+                             'number of CPUs.')
+    parser.add_argument('-f', '--field', dest='fields', default=[], action='append', nargs=2,
+                        help='Define a custom field that is extracted, as for the analysis.  The custom field columns '
+                             'must be present in the ROOT sheet.')
+    parser.add_argument('--status-rules', dest='status_rules', default=None, type=str, action='store',
+                        help='TipLivStatus classification rules, as for the analysis.')
+    parser.add_argument('--max-issues', dest='max_issues', default=validate.DEFAULT_MAX_ISSUES, type=int,
+                        action='store',
+                        help='Number of issues of each kind listed for a source.  Every issue is still counted.  '
+                             'Defaults to {}.'.format(validate.DEFAULT_MAX_ISSUES))
+    parser.add_argument('-o', '--output', dest='output', default=None, type=str, action='store',
+                        help='Write a JSON report of the issues of every source to this file.')
+    parser.add_argument('-v', '--verbose', dest='verbose', default=False, action='store_true',
+                        help='Enable verbose output')
+    return parser
+
+
+# Sub command name -> (options, main) pair.  Without a sub command, the sources are analyzed.
+COMMANDS = {'convert': (convert_options, convert_main),
+            'merge': (merge_options, merge_main),
+            'stats': (stats_options, stats_main),
+            'validate': (validate_options, validate_main), }
+
+
 if __name__ == "__main__":
-    p = root_options()
-    opts = p.parse_args()
+    # logging config.  This is only set up for the command line, not when the module is imported.
+    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        command_options, command_main = COMMANDS[sys.argv[1]]
+        command_main(command_options().parse_args(sys.argv[2:]))
+    else:
+        p = root_options()
+        opts = p.parse_args()
 
-    main(opts)
+        main(opts)
@@ -0,0 +1,218 @@
+"""
+Benchmark the stages of the analyzer against a synthetic (or given) workbook.
+
+Each stage is timed over a number of repeats, and the peak memory allocated during each stage is
+measured with tracemalloc in a separate run, since tracing slows down the timed code.  Results
+are written as JSON, and may be compared against the results of a previous run.
+"""
+from __future__ import print_function
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Third Party
+import openpyxl
+# Custom
+import analyzer
+import fields
+import utility
+import writers
+from generate import generate_workbook
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+STAGES = ['load',
+          'root_rows',
+          'synthesis_table',
+          'root_from_row',
+          'insert',
+          'finalize',
+          'synthesis_merge',
+          'write', ]
+
+
+class StageRecorder(object):
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.seconds = {}
+        self.peak_bytes = {}
+
+    def run(self, name, func, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = timeit.default_timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.seconds[name] = timeit.default_timer() - start
+            if self.trace_memory:
+                self.peak_bytes[name] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+
+def run_stages(src, output, custom_fields, recorder, read_only=False, output_format=writers.FORMAT_XLSX,
+               write_only=False):
+    a = analyzer.Analyzer(additional_root_fields={k: fields.ROOT_BIRTH for k in custom_fields},
+                          read_only=read_only)
+    wb = recorder.run('load', openpyxl.load_workbook, filename=src, read_only=read_only)
+    root_ws = wb.get_sheet_by_name(a.required_sheet_names.get('root_data'))
+    synthesis_ws = wb.get_sheet_by_name(a.required_sheet_names.get('synthesis_data'))
+
+    rows = recorder.run('root_rows', lambda: list(utility.iter_rows_from_columns(root_ws, a.schema.root_columns)))
+    recorder.run('synthesis_table', a._process_synthesis_table, synthesis_ws)
+
+    def root_from_row():
+        tube_position = a.schema.tube_position
+        for row in rows:
+            a.root_data.setdefault(row[tube_position], []).append(a._root_from_row(row))
+    recorder.run('root_from_row', root_from_row)
+
+    tubes = []
+
+    def insert():
+        for tn, raw_roots in a.root_data.items():
+            tube_obj = analyzer.tube.Tube(tn)
+            analyzer.collect_tube(tube_obj, raw_roots)
+            final_roots = [r for r in raw_roots if r.get('Session#') == tube_obj.maxSessionCount]
+            tubes.append((tube_obj, final_roots))
+    recorder.run('insert', insert)
+
+    def finalize():
+        for tube_obj, final_roots in tubes:
+            for root_obj in final_roots:
+                tube_obj.finalize_root(root_obj, root_fields=a.root_fields)
+    recorder.run('finalize', finalize)
+
+    def synthesis_merge():
+        for tube_obj, _ in tubes:
+            tube_obj.insert_synthesis_data(a.synthesis_data.get(tube_obj.tubeNumber), a.schema.synthesis_slots)
+            a.tubes.append(tube_obj)
+    recorder.run('synthesis_merge', synthesis_merge)
+
+    recorder.run('write', a.write, output, write_only=write_only, output_format=output_format)
+    if read_only:
+        wb.close()
+    return len(rows)
+
+
+def compare(results, previous):
+    print('{:<24}{:>12}{:>12}{:>10}'.format('stage', 'previous', 'current', 'ratio'))
+    for name in STAGES:
+        prev = previous.get('stages', {}).get(name, {}).get('min_seconds')
+        cur = results.get('stages', {}).get(name, {}).get('min_seconds')
+        if prev is None or cur is None:
+            continue
+        ratio = cur / prev if prev else float('inf')
+        print('{:<24}{:>12.4f}{:>12.4f}{:>10.2f}'.format(name, prev, cur, ratio))
+
+
+def options():
+    parser = argparse.ArgumentParser(prog='bench_analyzer', description='Benchmark the analyzer stages')
+    parser.add_argument('-s', '--source', dest='src_file', default=None, type=str, action='store',
+                        help='Benchmark an existing workbook instead of generating one')
+    parser.add_argument('--tubes', dest='tubes', default=4, type=int, action='store',
+                        help='Number of tubes in the generated workbook')
+    parser.add_argument('--sessions', dest='sessions', default=10, type=int, action='store',
+                        help='Number of sessions in the generated workbook')
+    parser.add_argument('--roots', dest='roots', default=250, type=int, action='store',
+                        help='Number of distinct roots per tube in the generated workbook')
+    parser.add_argument('-f', '--field', dest='fields', default=[], action='append',
+                        help='Custom ROOT column to generate and extract.  This may be given multiple times.')
+    parser.add_argument('-n', '--repeat', dest='repeat', default=3, type=int, action='store',
+                        help='Number of timed runs.  The fastest run of each stage is reported.')
+    parser.add_argument('-r', '--read-only', dest='read_only', default=False, action='store_true',
+                        help='Read the workbook in read only mode')
+    parser.add_argument('-w', '--write-only', dest='write_only', default=False, action='store_true',
+                        help='Write xlsx output through a write only workbook')
+    parser.add_argument('--format', dest='output_format', default=writers.FORMAT_XLSX, type=str, action='store',
+                        choices=sorted(writers.WRITERS), help='Output format')
+    parser.add_argument('--no-memory', dest='memory', default=True, action='store_false',
+                        help='Skip the memory profiling run')
+    parser.add_argument('-o', '--output', dest='output', default=None, type=str, action='store',
+                        help='Write the JSON results to this file instead of stdout')
+    parser.add_argument('--compare', dest='compare', default=None, type=str, action='store',
+                        help='JSON results of a previous run to compare against')
+    return parser
+
+
+def run_benchmark(opts, workdir):
+    """Run the timed and memory profiling runs in workdir, returning (rows, timings, peak_bytes, params)."""
+    src = opts.src_file
+    params = {'read_only': opts.read_only,
+              'write_only': opts.write_only,
+              'output_format': opts.output_format,
+              'fields': opts.fields,
+              'repeat': opts.repeat, }
+    if src is None:
+        src = os.path.join(workdir, 'synthetic.xlsx')
+        generate_workbook(src, tubes=opts.tubes, sessions=opts.sessions, roots=opts.roots, custom_fields=opts.fields)
+        params.update({'tubes': opts.tubes, 'sessions': opts.sessions, 'roots': opts.roots})
+    else:
+        params['source'] = os.path.abspath(src)
+    output = os.path.join(workdir, 'output' + writers.get_writer(opts.output_format).extension)
+    kwargs = {'read_only': opts.read_only, 'output_format': opts.output_format, 'write_only': opts.write_only}
+
+    timings = []
+    rows = 0
+    for _ in range(opts.repeat):
+        recorder = StageRecorder()
+        rows = run_stages(src, output, opts.fields, recorder, **kwargs)
+        timings.append(recorder.seconds)
+    peak_bytes = {}
+    if opts.memory and tracemalloc is not None:
+        recorder = StageRecorder(trace_memory=True)
+        run_stages(src, output, opts.fields, recorder, **kwargs)
+        peak_bytes = recorder.peak_bytes
+    return rows, timings, peak_bytes, params
+
+
+def main(opts):
+    logging.disable(logging.INFO)
+    workdir = tempfile.mkdtemp(prefix='winroot-bench-')
+    try:
+        rows, timings, peak_bytes, params = run_benchmark(opts, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    params['rows'] = rows
+    results = {'python': platform.python_version(),
+               'openpyxl': openpyxl.__version__,
+               'params': params,
+               'stages': {}, }
+    for name in STAGES:
+        seconds = [t.get(name) for t in timings]
+        best = min(seconds)
+        results['stages'][name] = {'seconds': seconds,
+                                   'min_seconds': best,
+                                   'rows_per_second': rows / best if best else None,
+                                   'peak_bytes': peak_bytes.get(name), }
+    results['total_seconds'] = sum(r.get('min_seconds') for r in results['stages'].values())
+
+    report = json.dumps(results, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+    if opts.compare:
+        with open(opts.compare) as f:
+            compare(results, json.load(f))
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main(options().parse_args())
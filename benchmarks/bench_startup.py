@@ -0,0 +1,120 @@
+"""
+Benchmark the startup time of the analyzer command line.
+
+Batch drivers start many short lived analyzer processes, so the time to import the modules and
+parse the command line matters as much as the processing itself.  Each case runs a fresh
+interpreter a number of times, and the fastest run is reported along with the time over a bare
+interpreter start.  The modules which are meant to be imported lazily are also checked, so a
+module level import of them shows up as a failure.  Results are written as JSON, and may be
+compared against the results of a previous run, failing when a case has slowed down by more than
+--max-ratio.
+"""
+from __future__ import print_function
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Case name -> interpreter arguments, run from the repository directory.
+CASES = [('python', ['-c', 'pass']),
+         ('import_analyzer', ['-c', 'import analyzer']),
+         ('help', ['analyzer.py', '--help']),
+         ('convert_help', ['analyzer.py', 'convert', '--help']),
+         ('stats_help', ['analyzer.py', 'stats', '--help']),
+         ('merge_help', ['analyzer.py', 'merge', '--help']),
+         ('validate_help', ['analyzer.py', 'validate', '--help']), ]
+# Modules which must not be imported by importing the analyzer.
+LAZY_MODULES = ['openpyxl']
+
+
+def time_case(args, repeat):
+    seconds = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = timeit.default_timer()
+            subprocess.check_call([sys.executable] + args, cwd=REPO_DIR, stdout=devnull, stderr=devnull)
+            seconds.append(timeit.default_timer() - start)
+    return seconds
+
+
+def eager_modules(modules):
+    """Return the modules, of the given ones, which are imported along with the analyzer."""
+    code = 'import sys, analyzer; print(" ".join(m for m in sys.argv[1:] if m in sys.modules))'
+    output = subprocess.check_output([sys.executable, '-c', code] + list(modules), cwd=REPO_DIR)
+    return output.decode('utf-8').split()
+
+
+def compare(results, previous, max_ratio):
+    """Print the change of each case from a previous run, and return the names of the cases which slowed down."""
+    slower = []
+    print('{:<24}{:>12}{:>12}{:>10}'.format('case', 'previous', 'current', 'ratio'))
+    for name, _ in CASES:
+        prev = previous.get('cases', {}).get(name, {}).get('min_seconds')
+        cur = results.get('cases', {}).get(name, {}).get('min_seconds')
+        if prev is None or cur is None:
+            continue
+        ratio = cur / prev if prev else float('inf')
+        print('{:<24}{:>12.4f}{:>12.4f}{:>10.2f}'.format(name, prev, cur, ratio))
+        if ratio > max_ratio:
+            slower.append(name)
+    return slower
+
+
+def options():
+    parser = argparse.ArgumentParser(prog='bench_startup', description='Benchmark the analyzer startup time')
+    parser.add_argument('-n', '--repeat', dest='repeat', default=10, type=int, action='store',
+                        help='Number of timed runs of each case.  The fastest run is reported.')
+    parser.add_argument('-o', '--output', dest='output', default=None, type=str, action='store',
+                        help='Write the JSON results to this file instead of stdout')
+    parser.add_argument('--compare', dest='compare', default=None, type=str, action='store',
+                        help='JSON results of a previous run to compare against')
+    parser.add_argument('--max-ratio', dest='max_ratio', default=1.5, type=float, action='store',
+                        help='Fail if a case is slower than the compared run by more than this ratio.  Defaults to '
+                             '1.5.')
+    return parser
+
+
+def main(opts):
+    results = {'python': platform.python_version(),
+               'params': {'repeat': opts.repeat},
+               'cases': {}, }
+    for name, args in CASES:
+        seconds = time_case(args, opts.repeat)
+        results['cases'][name] = {'seconds': seconds,
+                                  'min_seconds': min(seconds), }
+    baseline = results['cases']['python']['min_seconds']
+    for case in results['cases'].values():
+        case['over_python_seconds'] = case['min_seconds'] - baseline
+    eager = eager_modules(LAZY_MODULES)
+    results['eager_modules'] = eager
+
+    report = json.dumps(results, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+    failed = False
+    if eager:
+        log.error('Modules imported along with the analyzer which should be imported lazily: {}'.format(eager))
+        failed = True
+    if opts.compare:
+        with open(opts.compare) as f:
+            slower = compare(results, json.load(f), opts.max_ratio)
+        if slower:
+            log.error('Startup slowed down by more than {}x: {}'.format(opts.max_ratio, slower))
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main(options().parse_args())
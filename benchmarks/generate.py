@@ -0,0 +1,103 @@
+"""
+Generate synthetic WinRHIZO workbooks for benchmarking.
+
+The generated workbook has a ROOT sheet with one row per observation of each root, in session
+order, and a Synthesis sheet with one row per root.  Roots are born in a random session, are
+observed in every later session, and may go from alive to gone (and occasionally back).
+"""
+from __future__ import print_function
+import argparse
+import datetime
+import logging
+import random
+import sys
+# Third Party
+import openpyxl
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+ROOT_HEADER = ['Tube#', 'Location#', 'RootName', 'BirthSession', 'Session#', 'DeathSession', 'TipLivStatus',
+               'NumberOfTips', 'Date', 'Order']
+SYNTHESIS_HEADER = ['Tube#', 'Location#', 'RootName', 'BirthSession', 'AliveTipsAtBirth', 'AliveTipsAtDeath']
+START_DATE = datetime.datetime(2015, 4, 1)
+
+
+def generate_workbook(fp, tubes=4, sessions=10, roots=100, custom_fields=None, locations=40,
+                      death_rate=0.15, revival_rate=0.02, anomaly_rate=0.05, session_days=14, seed=0):
+    """Write a synthetic workbook to fp.
+
+    roots is the number of distinct roots in each tube.  Each of the custom_fields is added as an
+    extra column of random integers in the ROOT sheet.  Returns the number of ROOT rows written.
+    """
+    rnd = random.Random(seed)
+    custom_fields = list(custom_fields or [])
+
+    wb = openpyxl.Workbook(write_only=True)
+    root_ws = wb.create_sheet(title='ROOT')
+    synthesis_ws = wb.create_sheet(title='Synthesis')
+    root_ws.append(ROOT_HEADER + custom_fields)
+    synthesis_ws.append(SYNTHESIS_HEADER)
+
+    # Tube number -> list of [location, name, birth session, alive]
+    tube_roots = {}
+    for tn in range(1, tubes + 1):
+        tube_roots[tn] = []
+        for i in range(roots):
+            birth = rnd.randint(1, sessions)
+            tube_roots[tn].append([rnd.randint(1, locations), 'R{}'.format(i), birth, True])
+            synthesis_ws.append([tn, tube_roots[tn][-1][0], tube_roots[tn][-1][1], birth,
+                                 rnd.randint(0, 5), rnd.randint(0, 5)])
+
+    rows = 0
+    for session in range(1, sessions + 1):
+        date = START_DATE + datetime.timedelta(days=session_days * (session - 1))
+        for tn in range(1, tubes + 1):
+            for r in tube_roots[tn]:
+                location, name, birth, alive = r
+                if birth > session:
+                    continue
+                if session > birth:
+                    if alive and rnd.random() < death_rate:
+                        alive = False
+                    elif not alive and rnd.random() < revival_rate:
+                        alive = True
+                r[3] = alive
+                num_tips = 1
+                if rnd.random() < anomaly_rate:
+                    num_tips = rnd.randint(2, 4)
+                status = 'A' if alive else rnd.choice(['G', 'D'])
+                row = [tn, location, name, birth, session, None, status, num_tips, date, rnd.randint(0, 4)]
+                row.extend(rnd.randint(0, 1000) for _ in custom_fields)
+                root_ws.append(row)
+                rows += 1
+    wb.save(fp)
+    return rows
+
+
+def options():
+    parser = argparse.ArgumentParser(prog='generate', description='Generate a synthetic WinRHIZO workbook')
+    parser.add_argument('-o', '--output', dest='output', required=True, type=str, action='store',
+                        help='Output xlsx file')
+    parser.add_argument('--tubes', dest='tubes', default=4, type=int, action='store',
+                        help='Number of tubes')
+    parser.add_argument('--sessions', dest='sessions', default=10, type=int, action='store',
+                        help='Number of sessions')
+    parser.add_argument('--roots', dest='roots', default=100, type=int, action='store',
+                        help='Number of distinct roots per tube')
+    parser.add_argument('-f', '--field', dest='fields', default=[], action='append',
+                        help='Name of a custom ROOT column to add.  This may be given multiple times.')
+    parser.add_argument('--seed', dest='seed', default=0, type=int, action='store',
+                        help='Random seed')
+    return parser
+
+
+def main(opts):
+    rows = generate_workbook(opts.output, tubes=opts.tubes, sessions=opts.sessions, roots=opts.roots,
+                             custom_fields=opts.fields, seed=opts.seed)
+    print('Wrote {} ROOT rows to {}'.format(rows, opts.output))
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main(options().parse_args())
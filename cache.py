@@ -0,0 +1,127 @@
+"""
+On disk cache of parsed workbooks.
+
+A cache entry holds the parsed Synthesis data of a source workbook, and the state of each of its
+tubes after every ROOT row has been inserted but before the roots are finalized.  Entries record
+the digest of the source file and a digest of the ROOT rows they were built from, so an unchanged
+source can be used without reading it again, and rows appended to a source can be applied on top
+of the cached tube state.
+"""
+from __future__ import print_function
+import collections
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+CACHE_VERSION = 3
+CACHE_EXTENSION = '.cache'
+
+
+def file_digest(fp, blocksize=1 << 20):
+    """Return the sha1 hex digest of the content of a file."""
+    h = hashlib.sha1()
+    with open(fp, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+class RowDigest(object):
+    """Running digest over a sequence of row value tuples."""
+
+    def __init__(self):
+        self._hash = hashlib.sha1()
+        self.rows = 0
+
+    def update(self, row):
+        self._hash.update(repr(row).encode('utf-8'))
+        self.rows += 1
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+class CacheEntry(object):
+    def __init__(self, source_digest=None):
+        self.version = CACHE_VERSION
+        self.source_digest = source_digest
+        self.root_rows = 0  # Number of ROOT rows which the tube states were built from.
+        self.root_digest = None  # RowDigest of those ROOT rows.
+        self.synthesis_data = {}  # Tube number -> root identity -> synthesis only values.
+        self.tubes = collections.OrderedDict()  # Tube number -> pickled (tube, final roots) state.
+
+    def tube_state(self, tn):
+        """Return the cached (tube, final roots) for a tube number, or None if the tube is not cached.
+
+        Each call returns a new copy of the state, which the caller may modify.
+        """
+        state = self.tubes.get(tn)
+        if state is None:
+            return None
+        return pickle.loads(state)
+
+    def set_tube_state(self, tn, tube_obj, final_roots):
+        self.tubes[tn] = pickle.dumps((tube_obj, final_roots), pickle.HIGHEST_PROTOCOL)
+
+
+class ParseCache(object):
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def key(fp, sheet_names, schema):
+        """Build the cache key for a source file, the sheets read from it, the fields extracted from them and
+        the status rules used to classify them.
+
+        The source path is part of the key, so a source whose content changes keeps using the same
+        entry, and the entry is checked against the content digest.
+        """
+        h = hashlib.sha1()
+        h.update(repr((CACHE_VERSION,
+                       os.path.abspath(fp),
+                       sorted(sheet_names.items()),
+                       sorted(schema.attr_map.items()),
+                       repr(schema.status_rules))).encode('utf-8'))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_EXTENSION)
+
+    def load(self, key):
+        """Return the CacheEntry stored for key, or None if there is no usable entry."""
+        fp = self._path(key)
+        if not os.path.isfile(fp):
+            return None
+        try:
+            with open(fp, 'rb') as f:
+                entry = pickle.load(f)
+        except Exception:
+            log.exception('Failed to load cache entry [{}]'.format(fp))
+            return None
+        if getattr(entry, 'version', None) != CACHE_VERSION:
+            log.info('Ignoring cache entry from another version [{}]'.format(fp))
+            return None
+        return entry
+
+    def store(self, key, entry):
+        fp = self._path(key)
+        # Write to a temporary file first, so an interrupted write never leaves a partial entry.
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=CACHE_EXTENSION)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, fp)
+        except:
+            os.remove(tmp)
+            raise
+        return True
@@ -0,0 +1,477 @@
+"""
+Compact columnar binary format.
+
+A columnar file holds one or more named tables.  Every column is stored as a fixed width typed
+array, and string columns are dictionary encoded against a per column string table.  Files are
+small, and their columns can be mapped straight into memory when they are read back.
+
+File layout::
+
+    MAGIC | metadata length (uint64, little endian) | metadata (utf-8 json) | padding | column data
+
+Each column data segment is aligned to 8 bytes, and the offsets recorded in the metadata are
+relative to the start of the column data.  Empty cells (None or '') are stored as nulls.
+
+Tables built in exact mode keep the type of every value.  A column of mixed types is stored as a
+string column whose string table records the type of each distinct value, rather than being
+widened to a common type.
+"""
+from __future__ import print_function
+import array
+import collections
+import datetime
+import json
+import logging
+import mmap
+import struct
+import sys
+
+from errors import SerializationError
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+MAGIC = b'WRCOL\x00\x00\x01'
+VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+ALIGNMENT = 8
+
+TYPE_BOOL = 'bool'
+TYPE_INT = 'int'
+TYPE_FLOAT = 'float'
+TYPE_DATE = 'date'
+TYPE_DATETIME = 'datetime'
+TYPE_STR = 'str'
+
+# Typecodes used while a column is being built.
+_BUILD_TYPECODES = {TYPE_BOOL: 'b',
+                    TYPE_INT: 'q',
+                    TYPE_FLOAT: 'd',
+                    TYPE_DATE: 'i',
+                    TYPE_DATETIME: 'q',
+                    TYPE_STR: 'i', }
+# Integer columns are narrowed to the smallest of these which holds every value.
+_INT_TYPECODES = (('b', -2 ** 7, 2 ** 7 - 1),
+                  ('h', -2 ** 15, 2 ** 15 - 1),
+                  ('i', -2 ** 31, 2 ** 31 - 1),
+                  ('q', -2 ** 63, 2 ** 63 - 1), )
+# Pairs of column types which may be widened into a common type without going through strings.
+_PROMOTIONS = {frozenset([TYPE_BOOL, TYPE_INT]): TYPE_INT,
+               frozenset([TYPE_BOOL, TYPE_FLOAT]): TYPE_FLOAT,
+               frozenset([TYPE_INT, TYPE_FLOAT]): TYPE_FLOAT,
+               frozenset([TYPE_DATE, TYPE_DATETIME]): TYPE_DATETIME, }
+# Types recorded in the string_kinds segment of mixed type string columns, by position.
+_STRING_KINDS = (TYPE_STR, TYPE_BOOL, TYPE_INT, TYPE_FLOAT, TYPE_DATE, TYPE_DATETIME)
+NULL_CODE = -1
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _type_of(value):
+    # bool must be checked before int, and datetime before date, since they are subclasses.
+    if isinstance(value, bool):
+        return TYPE_BOOL
+    if isinstance(value, int):
+        return TYPE_INT
+    if isinstance(value, float):
+        return TYPE_FLOAT
+    if isinstance(value, datetime.datetime):
+        return TYPE_DATETIME
+    if isinstance(value, datetime.date):
+        return TYPE_DATE
+    return TYPE_STR
+
+
+def _encode(column_type, value):
+    if column_type == TYPE_DATE:
+        return value.toordinal()
+    if column_type == TYPE_DATETIME:
+        if not isinstance(value, datetime.datetime):
+            value = datetime.datetime(value.year, value.month, value.day)
+        delta = value.replace(tzinfo=None) - EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    if column_type == TYPE_FLOAT:
+        return float(value)
+    return int(value)
+
+
+def _decode(column_type, value):
+    if column_type == TYPE_BOOL:
+        return bool(value)
+    if column_type == TYPE_DATE:
+        return datetime.date.fromordinal(value)
+    if column_type == TYPE_DATETIME:
+        return EPOCH + datetime.timedelta(microseconds=value)
+    return value
+
+
+def _format_string(kind, value):
+    if kind == TYPE_BOOL:
+        return '1' if value else '0'
+    if kind == TYPE_FLOAT:
+        return repr(value)
+    if kind in (TYPE_DATE, TYPE_DATETIME):
+        return value.isoformat()
+    return str(value)
+
+
+def _parse_string(kind, text):
+    if kind == TYPE_BOOL:
+        return text == '1'
+    if kind == TYPE_INT:
+        return int(text)
+    if kind == TYPE_FLOAT:
+        return float(text)
+    if kind == TYPE_DATE:
+        return datetime.date.fromisoformat(text)
+    if kind == TYPE_DATETIME:
+        return datetime.datetime.fromisoformat(text)
+    return text
+
+
+class ColumnBuilder(object):
+    """Accumulate the values of a single column into a typed array.
+
+    The column type is inferred from the values appended to it.  Mixed numeric or date values
+    are widened to a common type, and any other mix of types turns the column into a string
+    column.  In exact mode values are never widened, so any mix of types turns the column into a
+    string column which records the type of each value.
+    """
+
+    def __init__(self, name, exact=False):
+        self.name = name
+        self.exact = exact
+        self.type = None
+        self.data = None
+        self.nulls = array.array('b')
+        self.strings = None  # (value type, value) -> code, for string columns.
+        self.null_count = 0
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def append(self, value):
+        if value is None or (isinstance(value, str) and value == ''):
+            self.nulls.append(1)
+            self.null_count += 1
+            if self.data is not None:
+                self.data.append(NULL_CODE if self.type == TYPE_STR else 0)
+            return
+        value_type = _type_of(value)
+        if self.type is None:
+            self._start(value_type)
+        elif value_type != self.type and self.type != TYPE_STR:
+            promotion = None if self.exact else _PROMOTIONS.get(frozenset([self.type, value_type]))
+            self._promote(promotion or TYPE_STR)
+        if self.type == TYPE_STR:
+            self.data.append(self._string_code(value))
+        else:
+            try:
+                self.data.append(_encode(self.type, value))
+            except OverflowError:
+                self._promote(TYPE_STR)
+                self.data.append(self._string_code(value))
+        self.nulls.append(0)
+
+    def _start(self, column_type):
+        self.type = column_type
+        self.data = array.array(_BUILD_TYPECODES[column_type])
+        if column_type == TYPE_STR:
+            self.strings = collections.OrderedDict()
+            self.data.extend([NULL_CODE] * len(self.nulls))
+        else:
+            self.data.extend([0] * len(self.nulls))
+
+    def _promote(self, column_type):
+        values = [None if null else _decode(self.type, v) for v, null in zip(self.data, self.nulls)]
+        self._start(column_type)
+        del self.data[:]
+        for value in values:
+            if value is None:
+                self.data.append(NULL_CODE if column_type == TYPE_STR else 0)
+            elif column_type == TYPE_STR:
+                self.data.append(self._string_code(value))
+            else:
+                self.data.append(_encode(column_type, value))
+
+    def _string_code(self, value):
+        kind = _type_of(value) if self.exact else TYPE_STR
+        if kind == TYPE_STR and not isinstance(value, str):
+            value = str(value)
+        # The type is part of the key, since values such as 1, 1.0 and True compare equal.
+        key = (kind, value)
+        code = self.strings.get(key)
+        if code is None:
+            code = len(self.strings)
+            self.strings[key] = code
+        return code
+
+    def segments(self):
+        """Return the column metadata and a list of (metadata key, array) data segments."""
+        column_type = self.type or TYPE_INT
+        data = self.data
+        if data is None:
+            data = array.array('b', [0] * len(self.nulls))
+        elif column_type in (TYPE_INT, TYPE_DATE):
+            low = min(data) if data else 0
+            high = max(data) if data else 0
+            for typecode, type_min, type_max in _INT_TYPECODES:
+                if type_min <= low and high <= type_max:
+                    break
+            if typecode != data.typecode:
+                data = array.array(typecode, data)
+        meta = {'name': self.name,
+                'type': column_type,
+                'typecode': data.typecode,
+                'segments': {}, }
+        segments = [('data', data)]
+        if self.null_count and column_type != TYPE_STR:
+            segments.append(('nulls', self.nulls))
+        if column_type == TYPE_STR:
+            blob = bytearray()
+            offsets = array.array('q', [0])
+            kinds = array.array('b')
+            for kind, value in self.strings:
+                blob.extend(_format_string(kind, value).encode('utf-8'))
+                offsets.append(len(blob))
+                kinds.append(_STRING_KINDS.index(kind))
+            segments.append(('string_offsets', offsets))
+            segments.append(('string_data', array.array('B', bytes(blob))))
+            if any(kinds):
+                segments.append(('string_kinds', kinds))
+        return meta, segments
+
+
+class TableBuilder(object):
+    def __init__(self, name, header, exact=False):
+        self.name = name
+        self.header = list(header)
+        self.columns = [ColumnBuilder(h, exact=exact) for h in self.header]
+        self.rows = 0
+
+    def append(self, row):
+        if len(row) != len(self.columns):
+            raise SerializationError('Row length [{}] does not match the header length [{}] of table [{}]'.format(
+                len(row), len(self.columns), self.name))
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        self.rows += 1
+
+
+class ColumnarWriter(object):
+    """Build one or more tables and serialize them to a columnar file when closed."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.tables = collections.OrderedDict()
+
+    def add_table(self, name, header, exact=False):
+        if name in self.tables:
+            raise SerializationError('Duplicate table name [{}]'.format(name))
+        table = TableBuilder(name, header, exact=exact)
+        self.tables[name] = table
+        return table
+
+    def close(self):
+        tables_meta = []
+        segments = []
+        offset = 0
+        for table in self.tables.values():
+            columns_meta = []
+            for column in table.columns:
+                meta, column_segments = column.segments()
+                for key, data in column_segments:
+                    nbytes = len(data) * data.itemsize
+                    meta['segments'][key] = [offset, nbytes]
+                    segments.append((offset, data))
+                    offset = _align(offset + nbytes)
+                columns_meta.append(meta)
+            tables_meta.append({'name': table.name,
+                                'rows': table.rows,
+                                'columns': columns_meta, })
+        meta = json.dumps({'version': VERSION,
+                           'byteorder': sys.byteorder,
+                           'tables': tables_meta, }).encode('utf-8')
+        header_size = _align(len(MAGIC) + 8 + len(meta))
+        with open(self.fp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(meta)))
+            f.write(meta)
+            f.write(b'\x00' * (header_size - f.tell()))
+            for segment_offset, data in segments:
+                f.write(b'\x00' * (header_size + segment_offset - f.tell()))
+                f.write(data.tobytes())
+        return True
+
+
+class Column(object):
+    """A read only view of a stored column.
+
+    The typed values are exposed through the values attribute.  When the file is memory mapped
+    and was written with the native byte order, values is a memoryview over the mapping, so no
+    data is copied until individual values are decoded.
+    """
+
+    def __init__(self, cfile, meta, rows):
+        self.name = meta.get('name')
+        self.type = meta.get('type')
+        self.rows = rows
+        segments = meta.get('segments')
+        self.values = cfile._segment(segments.get('data'), meta.get('typecode'))
+        self.nulls = None
+        if 'nulls' in segments:
+            self.nulls = cfile._segment(segments.get('nulls'), 'b')
+        self._string_offsets = None
+        self._string_data = None
+        self._string_kinds = None
+        self._strings = None
+        if self.type == TYPE_STR:
+            self._string_offsets = cfile._segment(segments.get('string_offsets'), 'q')
+            self._string_data = cfile._segment(segments.get('string_data'), 'B')
+            if 'string_kinds' in segments:
+                self._string_kinds = cfile._segment(segments.get('string_kinds'), 'b')
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def strings(self):
+        """The decoded string table of a string column."""
+        if self._strings is None:
+            offsets = self._string_offsets
+            data = bytes(self._string_data)
+            self._strings = [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+            if self._string_kinds is not None:
+                self._strings = [_parse_string(_STRING_KINDS[kind], text)
+                                 for kind, text in zip(self._string_kinds, self._strings)]
+        return self._strings
+
+    def __getitem__(self, index):
+        value = self.values[index]
+        if self.type == TYPE_STR:
+            if value == NULL_CODE:
+                return None
+            return self.strings[value]
+        if self.nulls is not None and self.nulls[index]:
+            return None
+        return _decode(self.type, value)
+
+    def __iter__(self):
+        for i in range(self.rows):
+            yield self[i]
+
+    def to_list(self):
+        return list(self)
+
+    def decoded(self):
+        """Return the values of the column as a sequence of python values.
+
+        Numeric columns without nulls are returned as their typed values, so no data is copied.
+        String columns are decoded through the string table, so each distinct string is a single
+        shared object.
+        """
+        if self.type == TYPE_STR:
+            # NULL_CODE (-1) selects the trailing None.
+            lookup = self.strings + [None]
+            return [lookup[code] for code in self.values]
+        if self.nulls is None and self.type in (TYPE_INT, TYPE_FLOAT):
+            return self.values
+        return self.to_list()
+
+
+class Table(object):
+    def __init__(self, cfile, meta):
+        self.name = meta.get('name')
+        self.rows = meta.get('rows')
+        self.columns = collections.OrderedDict()
+        for column_meta in meta.get('columns'):
+            self.columns[column_meta.get('name')] = Column(cfile, column_meta, self.rows)
+
+    @property
+    def header(self):
+        return list(self.columns)
+
+    def __len__(self):
+        return self.rows
+
+    def column(self, name):
+        return self.columns[name]
+
+    def iter_rows(self):
+        """Yield each row of the table as a tuple of decoded values in header order."""
+        columns = list(self.columns.values())
+        for i in range(self.rows):
+            yield tuple(column[i] for column in columns)
+
+
+class ColumnarFile(object):
+    """Open a columnar file for reading, memory mapping it by default."""
+
+    def __init__(self, fp, use_mmap=True):
+        self.fp = fp
+        self._views = []
+        self._fh = open(fp, 'rb')
+        try:
+            magic = self._fh.read(len(MAGIC))
+            if magic != MAGIC:
+                raise SerializationError('File is not a columnar file [{}]'.format(fp))
+            meta_size, = struct.unpack('<Q', self._fh.read(8))
+            meta = json.loads(self._fh.read(meta_size).decode('utf-8'))
+        except:
+            self._fh.close()
+            raise
+        if meta.get('version') not in SUPPORTED_VERSIONS:
+            self._fh.close()
+            raise SerializationError('Unsupported columnar file version [{}][{}]'.format(fp, meta.get('version')))
+        self.byteorder = meta.get('byteorder')
+        self._data_start = _align(len(MAGIC) + 8 + meta_size)
+        if use_mmap:
+            self._buffer = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._fh.seek(0)
+            self._buffer = self._fh.read()
+        self._view = memoryview(self._buffer)
+        self.tables = collections.OrderedDict()
+        for table_meta in meta.get('tables'):
+            self.tables[table_meta.get('name')] = Table(self, table_meta)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def table(self, name=None):
+        """Return the named table, or the first table in the file if no name is given."""
+        if name is None:
+            return next(iter(self.tables.values()))
+        try:
+            return self.tables[name]
+        except KeyError:
+            raise SerializationError('Columnar file does not contain table [{}]'.format(name))
+
+    def _segment(self, segment, typecode):
+        offset, nbytes = segment
+        start = self._data_start + offset
+        raw = self._view[start:start + nbytes]
+        if self.byteorder == sys.byteorder:
+            view = raw.cast(typecode)
+            self._views.extend([raw, view])
+            return view
+        values = array.array(typecode)
+        values.frombytes(raw)
+        values.byteswap()
+        raw.release()
+        return values
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._view.release()
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._fh.close()
@@ -5,6 +5,8 @@ from __future__ import print_function
 import logging
 import re
 
+import root
+import status
 from errors import FieldsError
 
 log = logging.getLogger(__name__)
@@ -19,22 +21,47 @@ invalid_python_identifiers = r'[^a-zA-Z0-9_]'
 replacement_str = 'X'
 
 
+def scrub_field(k, kind):
+    """Return the column name k scrubbed into a valid python identifier, for use as an attribute name."""
+    new_key = str(k)
+    if not re.search(valid_python_identifer, new_key):
+        new_key = re.sub(invalid_python_identifiers, replacement_str, new_key)
+        if re.search(digit_start, new_key):
+            new_key = ''.join([replacement_str, new_key])
+        if not re.search(valid_python_identifer, new_key):
+            raise FieldsError('Unable to scrub {} field into a valid python identifier [{}]'.format(kind, k))
+    return new_key
+
+
+class ScrubbedFields(object):
+    """Class attribute holding the mapping of column name -> attribute name for a list of columns.
+
+    The column names are scrubbed the first time the attribute is used rather than when the class
+    is defined, so importing the module does no regular expression work.
+    """
+
+    def __init__(self, fields_attribute, kind):
+        self.fields_attribute = fields_attribute
+        self.kind = kind
+        self._attributes = {}  # Owner class -> mapping
+
+    def __get__(self, obj, owner=None):
+        if owner is None:
+            owner = type(obj)
+        ret = self._attributes.get(owner)
+        if ret is None:
+            ret = {k: scrub_field(k, self.kind) for k in getattr(owner, self.fields_attribute)}
+            self._attributes[owner] = ret
+        return ret
+
+
 class IdentityFields(object):
     identity_fields = ['RootName',
                        'Location#',
                        'BirthSession',
                        'Tube#']
 
-    identity_attributes = {}
-    for k in identity_fields:
-        new_key = str(k)
-        if not re.search(valid_python_identifer, new_key):
-            new_key = re.sub(invalid_python_identifiers, replacement_str, new_key)
-            if re.search(digit_start, new_key):
-                new_key = ''.join([replacement_str, new_key])
-            if not re.search(valid_python_identifer, new_key):
-                raise FieldsError('Unable to scrub identity field into a valid python identifier [{}]'.format(k))
-        identity_attributes[k] = new_key
+    identity_attributes = ScrubbedFields('identity_fields', 'identity')
 
 
 class RootDataFields(IdentityFields):
@@ -49,14 +76,7 @@ class RootDataFields(IdentityFields):
         self.required_attributes = {k: v for k, v in IdentityFields.identity_attributes.items()}
 
         for k in self.base_fields:
-            new_key = str(k)
-            if not re.search(valid_python_identifer, new_key):
-                new_key = re.sub(invalid_python_identifiers, replacement_str, new_key)
-                if re.search(digit_start, new_key):
-                    new_key = ''.join([replacement_str, new_key])
-                if not re.search(valid_python_identifer, new_key):
-                    raise FieldsError('Unable to scrub required field into a valid python identifier [{}]'.format(k))
-            self.required_attributes[k] = new_key
+            self.required_attributes[k] = scrub_field(k, 'required')
 
         self.additional_fields = {}
         self.custom_attributes = {}
@@ -69,13 +89,7 @@ class RootDataFields(IdentityFields):
                     raise FieldsError('Additional field duplicates a required field [{}]'.format(k))
                 if v not in [ROOT_BIRTH, ROOT_FINAL]:
                     raise FieldsError('Unknown custom field propogation value [{}][{}]'.format(k, v))
-                new_key = str(k)
-                if not re.search(valid_python_identifer, new_key):
-                    new_key = re.sub(invalid_python_identifiers, replacement_str, new_key)
-                    if re.search(digit_start, new_key):
-                        new_key = ''.join([replacement_str, new_key])
-                    if not re.search(valid_python_identifer, new_key):
-                        raise FieldsError('Unable to scrub custom field into a valid python identifier [{}]'.format(k))
+                new_key = scrub_field(k, 'custom')
                 self.custom_attributes[k] = new_key
                 self.required_attributes[k] = new_key
 
@@ -87,11 +101,60 @@ class SynthesisDataFields(IdentityFields):
         self.required_attributes = {k: v for k, v in IdentityFields.identity_attributes.items()}
 
         for k in self.synthesis_fields:
-            new_key = str(k)
-            if not re.search(valid_python_identifer, new_key):
-                new_key = re.sub(invalid_python_identifiers, replacement_str, new_key)
-                if re.search(digit_start, new_key):
-                    new_key = ''.join([replacement_str, new_key])
-                if not re.search(valid_python_identifer, new_key):
-                    raise FieldsError('Unable to scrub synthesis field into a valid python identifier [{}]'.format(k))
-            self.required_attributes[k] = new_key
+            self.required_attributes[k] = scrub_field(k, 'synthesis')
+
+
+class RecordSchema(object):
+    """Precompiled layout of the ROOT data, derived once from a RootDataFields and SynthesisDataFields pair.
+
+    ROOT rows are handled as tuples of values in root_columns order.  The schema resolves each
+    column to its position in those tuples and to the Root slot that holds its value, so rows can
+    be turned into roots without building a dictionary or remapping keys for every row.
+
+    Synthesis rows are handled as tuples in synthesis_columns order: the identity columns followed
+    by the synthesis only columns.  Only the values of the synthesis only columns are kept, and
+    joined onto the roots through synthesis_slots.
+    """
+    synthesis_identity_columns = ('Tube#', 'RootName', 'Location#', 'BirthSession')
+
+    def __init__(self, root_fields, synthesis_fields, status_rules=None):
+        self.root_fields = root_fields
+        self.synthesis_fields = synthesis_fields
+        # Classifies the TipLivStatus values of the ROOT rows.
+        self.status_rules = status_rules or status.DEFAULT_RULES
+
+        self.attr_map = dict(root_fields.required_attributes)
+        for k, v in synthesis_fields.required_attributes.items():
+            if k in self.attr_map:
+                continue
+            self.attr_map[k] = v
+        columns_by_attribute = {}
+        for k, v in self.attr_map.items():
+            if v in columns_by_attribute:
+                raise FieldsError('Fields [{}] and [{}] both map to the attribute [{}]'.format(
+                    columns_by_attribute[v], k, v))
+            columns_by_attribute[v] = k
+        self.root_class = root.root_class(self.attr_map)
+
+        self.root_columns = tuple(sorted(root_fields.required_attributes))
+        self.root_positions = {k: i for i, k in enumerate(self.root_columns)}
+        # The Root slot for each value of a ROOT row.
+        self.root_slots = tuple(self.attr_map[k] for k in self.root_columns)
+
+        p = self.root_positions
+        self.tube_position = p['Tube#']
+        self.rootname_position = p['RootName']
+        self.location_position = p['Location#']
+        self.birthsession_position = p['BirthSession']
+        self.session_position = p['Session#']
+        self.tips_position = p['NumberOfTips']
+        self.status_position = p['TipLivStatus']
+        self.death_session_slot = self.attr_map['DeathSession']
+
+        self.synthesis_value_columns = tuple(sorted(k for k in synthesis_fields.required_attributes
+                                                    if k not in synthesis_fields.identity_attributes))
+        self.synthesis_columns = self.synthesis_identity_columns + self.synthesis_value_columns
+        self.synthesis_slots = tuple(self.attr_map[k] for k in self.synthesis_value_columns)
+
+    def attribute(self, column):
+        return self.attr_map[column]
@@ -0,0 +1,197 @@
+"""
+Typed ingestion of ROOT and Synthesis values.
+
+Cell values are coerced into native types as they are loaded: session numbers, locations, tip
+counts and orders into ints, and dates into datetimes.  Repeated values such as root names, tip
+statuses and dates are interned, so each distinct value is held by a single object no matter how
+many rows repeat it.
+"""
+from __future__ import print_function
+import array
+import collections
+import datetime
+import logging
+import re
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+INT_COLUMNS = frozenset(['Tube#',
+                         'Location#',
+                         'BirthSession',
+                         'Session#',
+                         'DeathSession',
+                         'NumberOfTips',
+                         'Order',
+                         'AliveTipsAtBirth',
+                         'AliveTipsAtDeath', ])
+DATE_COLUMNS = frozenset(['Date'])
+# Formats tried, in order, for dates stored as text.
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%d',
+                '%m/%d/%Y',
+                '%m/%d/%y', )
+# Columns of a compiled result, other than the ROOT and Synthesis columns, which hold ints or flags.
+COMPILED_INT_COLUMNS = frozenset(['censored', 'highestOrder'])
+COMPILED_BOOL_COLUMNS = frozenset(['anomaly'])
+# Text of a float, as written by str(float), excluding the inf and nan spellings float() also accepts.
+_FLOAT_TEXT = re.compile(r'^-?[0-9]+(\.[0-9]*)?([eE][-+]?[0-9]+)?$')
+# Typecodes of the typed columns which already hold ints.
+_INT_TYPECODES = frozenset('bBhHiIlLqQ')
+
+
+def coerce_int(value):
+    """Return value as an int if it is an integral float or a string of digits, otherwise unchanged."""
+    value_type = type(value)
+    if value_type is int:
+        return value
+    if value_type is float:
+        return int(value) if value.is_integer() else value
+    if value_type is str:
+        text = value.strip()
+        if text.isdigit() or (text[:1] == '-' and text[1:].isdigit()):
+            return int(text)
+    return value
+
+
+def coerce_bool(value):
+    """Return value as a bool if it is a bool written out as text, otherwise unchanged."""
+    if type(value) is str:
+        text = value.strip()
+        if text == 'True':
+            return True
+        if text == 'False':
+            return False
+    return value
+
+
+def coerce_date(value):
+    """Return value as a datetime if it is a date stored as text, otherwise unchanged."""
+    if type(value) is not str:
+        return value
+    text = value.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    return value
+
+
+def coerce_text(value):
+    """Return a value read back as text, such as from a csv output, as the int, float, bool or date it was written from.
+
+    Empty text is returned as None, and any other text is returned unchanged.
+    """
+    if type(value) is not str:
+        return value
+    if value == '':
+        return None
+    ret = coerce_int(value)
+    if ret is not value:
+        return ret
+    if _FLOAT_TEXT.match(value):
+        return float(value)
+    ret = coerce_bool(value)
+    if ret is not value:
+        return ret
+    return coerce_date(value)
+
+
+class Interner(object):
+    """Return a single shared object for each distinct string or date value given to it."""
+
+    def __init__(self):
+        self._values = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def __call__(self, value):
+        # Only strings and dates are shared; numbers of different types may compare equal.
+        if type(value) is str or isinstance(value, datetime.date):
+            return self._values.setdefault(value, value)
+        return value
+
+    def column(self, values):
+        """Return a list of a column of values, interned."""
+        setdefault = self._values.setdefault
+        date = datetime.date
+        return [setdefault(v, v) if type(v) is str or isinstance(v, date) else v for v in values]
+
+
+class Ingester(object):
+    """Coerce ROOT and Synthesis values, row by row or column by column, for a RecordSchema."""
+
+    def __init__(self, schema):
+        self.schema = schema
+        # Column name -> interner, shared between the ROOT and Synthesis values of a column.
+        self.interners = {}
+        self.root_converters = tuple(self._converter(k) for k in schema.root_columns)
+        self.synthesis_converters = tuple(self._converter(k) for k in schema.synthesis_columns)
+
+    def _converter(self, column):
+        if column in INT_COLUMNS:
+            return coerce_int
+        interner = self.interners.setdefault(column, Interner())
+        if column in DATE_COLUMNS:
+            return lambda value: interner(coerce_date(value))
+        return interner
+
+    def compiled_converters(self, header, typed=True):
+        """Return a converter for each column of the header of a compiled result, as written by Analyzer.write.
+
+        typed is False for results which hold every value as text, such as csv outputs.  The values
+        of the custom fields are then converted back with coerce_text, as their types are not known.
+        """
+        custom_columns = self.schema.root_fields.custom_attributes
+        ret = []
+        for column in header:
+            if column in COMPILED_INT_COLUMNS:
+                ret.append(coerce_int)
+            elif column in COMPILED_BOOL_COLUMNS:
+                ret.append(coerce_bool)
+            elif not typed and column in custom_columns:
+                ret.append(self._text_converter(column))
+            else:
+                ret.append(self._converter(column))
+        return tuple(ret)
+
+    def _text_converter(self, column):
+        interner = self.interners.setdefault(column, Interner())
+        return lambda value: interner(coerce_text(value))
+
+    def root_row(self, row):
+        """Return a ROOT row, in schema.root_columns order, with its values coerced."""
+        # Every converter leaves ints unchanged, so the call is skipped for them.
+        return tuple([v if type(v) is int else f(v) for f, v in zip(self.root_converters, row)])
+
+    def synthesis_row(self, row):
+        """Return a Synthesis row, in schema.synthesis_columns order, with its values coerced."""
+        return tuple([v if type(v) is int else f(v) for f, v in zip(self.synthesis_converters, row)])
+
+    def root_columns(self, columns):
+        """Return a copy of a mapping of ROOT column name -> column values, with the values coerced.
+
+        Typed int columns (arrays, or views over a store) are returned unchanged.
+        """
+        ret = collections.OrderedDict()
+        for key in self.schema.root_columns:
+            values = columns.get(key)
+            if key in INT_COLUMNS:
+                if _typecode(values) not in _INT_TYPECODES:
+                    values = [v if type(v) is int else coerce_int(v) for v in values]
+            else:
+                if key in DATE_COLUMNS:
+                    values = [coerce_date(v) if type(v) is str else v for v in values]
+                values = self.interners[key].column(values)
+            ret[key] = values
+        return ret
+
+
+def _typecode(values):
+    if isinstance(values, array.array):
+        return values.typecode
+    if isinstance(values, memoryview):
+        return values.format
+    return None
@@ -0,0 +1,129 @@
+"""
+Run instrumentation.
+
+Metrics collects the wall time and peak memory of each stage of a run, counters such as the
+number of rows processed and roots created, and the statistics of each processed tube, which
+include the peak memory of building it when memory is traced.  The collected values are
+reported as a dictionary, or written out as JSON.
+"""
+from __future__ import print_function
+import collections
+import contextlib
+import json
+import logging
+import sys
+import timeit
+
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+
+# Peak traced memory dropped when trace_peak resets the peak inside a stage, so the stage still reports it.
+_reset_peak = 0
+
+
+def max_rss():
+    """Return the peak resident set size of the process in kilobytes, or None where it is not available."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports ru_maxrss in bytes rather than kilobytes.
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+def _traced_peak():
+    return max(tracemalloc.get_traced_memory()[1], _reset_peak)
+
+
+@contextlib.contextmanager
+def trace_peak(stats, enabled=True):
+    """Record the peak memory allocated in the enclosed block as stats['peak_bytes'].
+
+    Tracing is started for the block unless it is already running, as it is inside a traced stage,
+    in which case the peak is reset for the block.  Allocations made by other threads during the
+    block, such as the other stages of a pipeline, are included.
+    """
+    global _reset_peak
+    if not enabled or tracemalloc is None or not hasattr(tracemalloc, 'reset_peak'):
+        yield
+        return
+    tracing = not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    else:
+        _reset_peak = _traced_peak()
+        tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    try:
+        yield
+    finally:
+        stats['peak_bytes'] = tracemalloc.get_traced_memory()[1] - start
+        if tracing:
+            tracemalloc.stop()
+
+
+class Metrics(object):
+    def __init__(self, trace_memory=False):
+        # Tracing every allocation slows the traced code down considerably, so it is opt in.
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.stages = collections.OrderedDict()
+        self.counters = collections.Counter()
+        self.tubes = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the enclosed block, accumulating into the named stage."""
+        global _reset_peak
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            _reset_peak = 0
+            tracemalloc.start()
+        start = timeit.default_timer()
+        try:
+            yield self
+        finally:
+            seconds = timeit.default_timer() - start
+            s = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'peak_bytes': None, 'max_rss_kb': None})
+            s['seconds'] += seconds
+            s['calls'] += 1
+            if tracing:
+                peak = _traced_peak()
+                tracemalloc.stop()
+                s['peak_bytes'] = max(peak, s['peak_bytes'] or 0)
+            s['max_rss_kb'] = max_rss()
+
+    def incr(self, name, n=1):
+        self.counters[name] += n
+
+    def add_tube(self, tube_obj):
+        """Record the statistics of a processed tube, and add its counters to the run totals."""
+        stats = dict(tube_obj.stats)
+        stats['roots'] = len(tube_obj)
+        stats['maxSessionCount'] = tube_obj.maxSessionCount
+        self.tubes[str(tube_obj.tubeNumber)] = stats
+        for k, v in tube_obj.stats.items():
+            if k in ('seconds', 'peak_bytes'):
+                continue
+            self.counters[k] += v
+
+    def report(self):
+        return {'stages': self.stages,
+                'counters': dict(self.counters),
+                'tubes': self.tubes,
+                'max_rss_kb': max_rss(), }
+
+    def write_json(self, fp):
+        with open(fp, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+        return True
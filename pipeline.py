@@ -0,0 +1,111 @@
+"""
+Threaded pipeline of processing stages.
+
+Each stage runs on its own thread, and stages are connected by bounded queues.  A stage which
+gets ahead of the next one blocks once the queue between them is full, so the number of items in
+flight stays bounded, and reading, processing and writing overlap rather than running one after
+another.  The first error raised by any stage stops the whole pipeline, and is raised again by
+Pipeline.run.
+"""
+from __future__ import print_function
+import logging
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+DEFAULT_QUEUE_SIZE = 4
+# Number of rows handed between stages at a time by chunked, so the queues are not locked once per row.
+CHUNK_ROWS = 1000
+# How often blocked stages check if the pipeline has been stopped, in seconds.
+POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+def chunked(items, size=CHUNK_ROWS):
+    """Yield lists of up to size items from an iterable, in order."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _Stopped(Exception):
+    """Raised in a stage when another stage has failed."""
+
+
+class Pipeline(object):
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        if queue_size < 1:
+            raise ValueError('queue_size must be at least 1')
+        self.queue_size = queue_size
+        self._stop = threading.Event()
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def run(self, source, stages):
+        """Run source and each of the stages on their own thread.
+
+        source is an iterable of items.  Each stage is a callable which takes an iterable of the
+        items produced by the previous stage, and returns an iterable of its own items.  The last
+        stage consumes the items without producing any, so it may return None.  Returns once every
+        stage has finished.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in stages]
+        threads = [threading.Thread(target=self._run_stage, name='pipeline-source',
+                                    args=(lambda items: items, iter(source), queues[0]))]
+        for i, stage in enumerate(stages):
+            output = queues[i + 1] if i + 1 < len(queues) else None
+            threads.append(threading.Thread(target=self._run_stage, name='pipeline-{}'.format(i),
+                                            args=(stage, self._drain(queues[i]), output)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+        return True
+
+    def _run_stage(self, stage, items, output):
+        try:
+            for item in stage(items) or ():
+                if output is not None:
+                    self._put(output, item)
+            if output is not None:
+                self._put(output, _DONE)
+        except _Stopped:
+            pass
+        except Exception as e:
+            log.exception('Pipeline stage failed')
+            with self._lock:
+                self._errors.append(e)
+            self._stop.set()
+
+    def _put(self, q, item):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def _drain(self, q):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                item = q.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
@@ -0,0 +1,179 @@
+"""
+In process queries over analyzed tubes.
+
+RootQuery indexes the roots of a list of finalized tubes by tube, birth session, death session,
+location, status flags and the session dates of their birth and death.  Filters on indexed fields
+intersect the matching root ids from the indexes, and counts on a single indexed field are read
+straight from an index, so neither walks every root.  Criteria on any other field are checked
+against the roots which match the indexed criteria.
+
+    q = analyzer.query()
+    q.filter(birth_session=5, location=12)
+    q.count_by('Tube#', censored=1)
+    q.count_by('DeathDate', censored=0)
+"""
+from __future__ import print_function
+import collections
+import logging
+
+from errors import AnalyzerError
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+INDEXED_FIELDS = ('Tube#',
+                  'BirthSession',
+                  'DeathSession',
+                  'Location#',
+                  'censored',
+                  'anomaly',
+                  'isAlive',
+                  'BirthDate',
+                  'DeathDate', )
+# Keyword argument names for fields whose names are not python identifiers, or are awkward to type.
+ALIASES = {'tube': 'Tube#',
+           'birth_session': 'BirthSession',
+           'death_session': 'DeathSession',
+           'location': 'Location#',
+           'alive': 'isAlive',
+           'birth_date': 'BirthDate',
+           'death_date': 'DeathDate', }
+
+
+def _indexed_value(field, root_obj, tube_obj):
+    if field == 'BirthDate':
+        return tube_obj.sessionDates.get(root_obj.get('BirthSession'))
+    if field == 'DeathDate':
+        # Only roots which died have a death date; censored roots have a DeathSession of 0.
+        if root_obj.censored != 0:
+            return None
+        return tube_obj.sessionDates.get(root_obj.get('DeathSession'))
+    return _root_value(field, root_obj)
+
+
+def _root_value(field, root_obj):
+    if field in root_obj.attr_map:
+        return root_obj.get(field)
+    return getattr(root_obj, field, None)
+
+
+class RootQuery(object):
+    def __init__(self, tubes):
+        self.roots = []
+        self.tubes = []  # The tube of each root, by root id.
+        for tube_obj in tubes:
+            for root_obj in tube_obj:
+                self.roots.append(root_obj)
+                self.tubes.append(tube_obj)
+        # Field -> value of each root, by root id.
+        self._values = {}
+        # Field -> value -> ascending list of root ids.
+        self._indexes = {}
+        for field in INDEXED_FIELDS:
+            values = [_indexed_value(field, root_obj, tube_obj) for root_obj, tube_obj in zip(self.roots, self.tubes)]
+            index = collections.OrderedDict()
+            for root_id, value in enumerate(values):
+                index.setdefault(value, []).append(root_id)
+            self._values[field] = values
+            self._indexes[field] = index
+
+    def __len__(self):
+        return len(self.roots)
+
+    @staticmethod
+    def _field(name):
+        return ALIASES.get(name, name)
+
+    def _criteria(self, criteria, kwargs):
+        ret = {}
+        for name, value in list((criteria or {}).items()) + list(kwargs.items()):
+            field = self._field(name)
+            if field in ret:
+                raise AnalyzerError('Query field given more than once [{}]'.format(field))
+            # A list, tuple or set of values matches any one of them.
+            if isinstance(value, (list, tuple, set, frozenset)):
+                value = frozenset(value)
+            else:
+                value = frozenset([value])
+            ret[field] = value
+        return ret
+
+    def values(self, field):
+        """Return the distinct values of an indexed field."""
+        field = self._field(field)
+        if field not in self._indexes:
+            raise AnalyzerError('Field is not indexed [{}]'.format(field))
+        return list(self._indexes[field])
+
+    def _ids(self, criteria):
+        """Return the ascending list of root ids matching the criteria."""
+        indexed = []
+        other = []
+        for field, values in criteria.items():
+            if field in self._indexes:
+                index = self._indexes[field]
+                ids = set()
+                for value in values:
+                    ids.update(index.get(value, ()))
+                indexed.append(ids)
+            else:
+                other.append((field, values))
+        if indexed:
+            # Intersect starting from the smallest set of ids.
+            indexed.sort(key=len)
+            ids = indexed[0]
+            for s in indexed[1:]:
+                if not ids:
+                    break
+                ids = ids.intersection(s)
+            ids = sorted(ids)
+        else:
+            ids = range(len(self.roots))
+        for field, values in other:
+            ids = [root_id for root_id in ids if _root_value(field, self.roots[root_id]) in values]
+        return ids
+
+    def filter(self, criteria=None, **kwargs):
+        """Yield the roots matching every criterion, in tube and root order.
+
+        Criteria are given as a dictionary of field -> value, or as keyword arguments, using the
+        ALIASES for fields which are not identifiers.  A list, tuple or set of values matches any
+        one of the values.
+        """
+        for root_id in self._ids(self._criteria(criteria, kwargs)):
+            yield self.roots[root_id]
+
+    def filter_with_tubes(self, criteria=None, **kwargs):
+        """Yield (tube, root) pairs for the roots matching every criterion.  See filter."""
+        for root_id in self._ids(self._criteria(criteria, kwargs)):
+            yield self.tubes[root_id], self.roots[root_id]
+
+    def count(self, criteria=None, **kwargs):
+        """Return the number of roots matching every criterion.  See filter."""
+        criteria = self._criteria(criteria, kwargs)
+        if not criteria:
+            return len(self.roots)
+        if len(criteria) == 1:
+            field, values = next(iter(criteria.items()))
+            if field in self._indexes:
+                index = self._indexes[field]
+                return sum(len(index.get(value, ())) for value in values)
+        return len(self._ids(criteria))
+
+    def count_by(self, field, criteria=None, **kwargs):
+        """Return an OrderedDict of value of field -> number of roots matching every criterion.  See filter."""
+        field = self._field(field)
+        criteria = self._criteria(criteria, kwargs)
+        if not criteria and field in self._indexes:
+            return collections.OrderedDict((value, len(ids)) for value, ids in self._indexes[field].items())
+        ret = collections.OrderedDict()
+        if field in self._values:
+            values = self._values[field]
+            for root_id in self._ids(criteria):
+                value = values[root_id]
+                ret[value] = ret.get(value, 0) + 1
+        else:
+            for root_id in self._ids(criteria):
+                value = _root_value(field, self.roots[root_id])
+                ret[value] = ret.get(value, 0) + 1
+        return ret
@@ -5,6 +5,8 @@ from __future__ import print_function
 import collections
 import logging
 
+from errors import FieldsError
+
 log = logging.getLogger(__name__)
 __author__ = 'wgibb'
 
@@ -12,18 +14,50 @@ __author__ = 'wgibb'
 # Named tuples allow for the analyzer to create values for uniquely identifying roots if needed.
 RootIdentity = collections.namedtuple('RootIdentity', ['rootname', 'location', 'birthsession'])
 
+# Attribute map (as sorted items) -> Root subclass with slots for those attributes.
+_root_classes = {}
+
+# Lifecycle status codes held in Root.status, and the labels they are reported with as Root.isAlive.
+STATUS_UNKNOWN = 0
+STATUS_ALIVE = 1
+STATUS_GONE = 2
+STATUS_LABELS = {STATUS_UNKNOWN: '',
+                 STATUS_ALIVE: 'A',
+                 STATUS_GONE: 'G', }
+STATUS_CODES = {v: k for k, v in STATUS_LABELS.items()}
+
 
 class Root(object):
+    """A single root.
+
+    Roots do not carry a per instance __dict__.  Instances are created from a subclass built by
+    root_class, which declares a slot for every attribute named in its attribute map, and all of
+    the roots created from that subclass share a single attribute map.
+    """
+    __slots__ = ('identity', 'anomaly', 'status', 'censored', 'highestOrder')
+    _all_slots = __slots__
     fixed_attributes = ['isAlive', 'censored', 'highestOrder', 'anomaly']
+    attr_map = {}
 
-    def __init__(self, attr_map, rootname, location, birthsession):
-        self.attr_map = attr_map
+    def __init__(self, rootname, location, birthsession):
         self.identity = RootIdentity(rootname=rootname, location=location, birthsession=birthsession)
         self.anomaly = ''
-        self.isAlive = ''
+        self.status = STATUS_UNKNOWN
         self.censored = ''
         self.highestOrder = ''
 
+    @property
+    def isAlive(self):
+        """The label of the lifecycle status of the root.  The status itself is held as a code in status."""
+        return STATUS_LABELS[self.status]
+
+    @isAlive.setter
+    def isAlive(self, label):
+        try:
+            self.status = STATUS_CODES[label]
+        except KeyError:
+            raise FieldsError('Unknown root status label [{}]'.format(label))
+
     def set(self, key, value):
         new_key = self.attr_map.get(key, None)
         setattr(self, new_key, value)
@@ -31,3 +65,44 @@ class Root(object):
     def get(self, key, default=None):
         new_key = self.attr_map.get(key)
         return getattr(self, new_key, default)
+
+    def items(self):
+        """Yield (attribute, value) pairs for every attribute which has been set on the root."""
+        for attr in self._all_slots:
+            try:
+                yield attr, getattr(self, attr)
+            except AttributeError:
+                continue
+
+    def __reduce__(self):
+        # Root subclasses are created at runtime, so they are rebuilt from their attribute map.
+        return _restore_root, (tuple(sorted(self.attr_map.items())),), dict(self.items())
+
+    def __setstate__(self, state):
+        for attr, value in state.items():
+            setattr(self, attr, value)
+
+
+def root_class(attr_map):
+    """Return the Root subclass holding the attributes in attr_map, which maps keys to attribute names.
+
+    Classes are cached, so every call with an equal attribute map returns the same class.
+    """
+    key = tuple(sorted(attr_map.items()))
+    cls = _root_classes.get(key)
+    if cls is not None:
+        return cls
+    attributes = tuple(sorted(set(attr_map.values()).difference(Root.__slots__)))
+    for attr in attributes:
+        if hasattr(Root, attr):
+            raise FieldsError('Field attribute conflicts with a Root attribute [{}]'.format(attr))
+    cls = type('Root', (Root,), {'__slots__': attributes,
+                                 'attr_map': dict(attr_map),
+                                 '_all_slots': Root.__slots__ + attributes, })
+    _root_classes[key] = cls
+    return cls
+
+
+def _restore_root(attr_map_items):
+    cls = root_class(dict(attr_map_items))
+    return cls.__new__(cls)
@@ -0,0 +1,91 @@
+"""
+Temporary on disk partitions of rows, keyed by tube number.
+
+A SpillStore holds named tables of rows, such as the ROOT and Synthesis rows of a source, and
+partitions the rows of each table by a key.  Rows are buffered in memory, and once the buffers
+hold more than buffer_rows rows they are appended to one file per partition, as pickled chunks.
+The rows of a single partition are then read back on their own, so only one partition is held in
+memory at a time.  The files are removed when the store is closed.
+"""
+from __future__ import print_function
+import collections
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+DEFAULT_BUFFER_ROWS = 100000
+SPILL_EXTENSION = '.spill'
+
+
+class SpillStore(object):
+    def __init__(self, spill_dir=None, buffer_rows=DEFAULT_BUFFER_ROWS):
+        if buffer_rows < 1:
+            raise ValueError('buffer_rows must be at least 1')
+        self.buffer_rows = buffer_rows
+        self.directory = tempfile.mkdtemp(prefix='spill-', dir=spill_dir)
+        log.info('Spilling rows to [{}]'.format(self.directory))
+        # Table name -> key -> partition file name, in the order the keys were first seen.
+        self._files = {}
+        # (table name, key) -> list of buffered rows not yet written to the partition file.
+        self._buffers = collections.defaultdict(list)
+        self._buffered = 0
+        self.rows_spilled = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def append(self, table, key, row):
+        """Add a row to the partition of a table with the given key."""
+        files = self._files.setdefault(table, collections.OrderedDict())
+        if key not in files:
+            # Keys need not be valid file names, so partitions are numbered.
+            files[key] = os.path.join(self.directory, '{}-{}{}'.format(table, len(files), SPILL_EXTENSION))
+        self._buffers[(table, key)].append(row)
+        self._buffered += 1
+        if self._buffered >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered rows of every partition to the partition files."""
+        for (table, key), rows in self._buffers.items():
+            with open(self._files[table][key], 'ab') as f:
+                pickle.dump(rows, f, pickle.HIGHEST_PROTOCOL)
+            self.rows_spilled += len(rows)
+        self._buffers.clear()
+        self._buffered = 0
+
+    def keys(self, table):
+        """Return the keys of the partitions of a table, in the order they were first seen."""
+        return list(self._files.get(table, ()))
+
+    def rows(self, table, key):
+        """Return the list of rows in a partition, in the order they were appended."""
+        ret = []
+        fp = self._files.get(table, {}).get(key)
+        if fp is None:
+            return ret
+        if os.path.exists(fp):
+            with open(fp, 'rb') as f:
+                while True:
+                    try:
+                        ret.extend(pickle.load(f))
+                    except EOFError:
+                        break
+        ret.extend(self._buffers.get((table, key), ()))
+        return ret
+
+    def close(self):
+        """Remove the partition files."""
+        self._buffers.clear()
+        self._buffered = 0
+        if self.directory and os.path.isdir(self.directory):
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory = None
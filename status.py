@@ -0,0 +1,155 @@
+"""
+Classification of the TipLivStatus values of ROOT observations.
+
+A StatusRules lists the TipLivStatus labels which mean a root is alive, and those which mean it is
+gone.  Labels match either as prefixes of the raw value (the default, so 'A' matches 'Alive') or
+exactly.  Each distinct raw value is resolved against the rules once, and the result is kept in a
+lookup table, so classifying an observation is a single dictionary lookup.
+
+Rules may be given as a JSON file::
+
+    {"alive": ["A"], "gone": ["D", "G"], "match": "prefix", "ignore_case": false}
+
+or inline, as semicolon separated key=value pairs, with comma separated labels::
+
+    alive=A;gone=D,G;match=prefix;ignore_case=false
+"""
+from __future__ import print_function
+import json
+import logging
+import os
+
+from errors import FieldsError
+from root import STATUS_ALIVE, STATUS_GONE
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+MATCH_PREFIX = 'prefix'
+MATCH_EXACT = 'exact'
+MATCHES = [MATCH_PREFIX, MATCH_EXACT]
+
+DEFAULT_ALIVE = ('A',)
+DEFAULT_GONE = ('D', 'G')
+
+# Observations with other than one tip are anomalous, and are treated as alive.
+_ANOMALY = (STATUS_ALIVE, True)
+
+
+class StatusRules(object):
+    def __init__(self, alive=DEFAULT_ALIVE, gone=DEFAULT_GONE, match=MATCH_PREFIX, ignore_case=False):
+        if match not in MATCHES:
+            raise FieldsError('Unknown status match type [{}]'.format(match))
+        self.match = match
+        self.ignore_case = bool(ignore_case)
+        self.alive = tuple(self._label(label) for label in alive)
+        self.gone = tuple(self._label(label) for label in gone)
+        if not self.alive or not self.gone:
+            raise FieldsError('Status rules need at least one alive and one gone label')
+        overlap = set(self.alive).intersection(self.gone)
+        if overlap:
+            raise FieldsError('Status labels are both alive and gone {}'.format(sorted(overlap)))
+        # Raw TipLivStatus value -> (status code, anomaly), or None for values which match no rule.
+        self._table = {}
+
+    def _label(self, label):
+        if not isinstance(label, str) or not label:
+            raise FieldsError('Status labels must be non-empty strings [{!r}]'.format(label))
+        return label.lower() if self.ignore_case else label
+
+    def __repr__(self):
+        return 'StatusRules(alive={!r}, gone={!r}, match={!r}, ignore_case={!r})'.format(
+            self.alive, self.gone, self.match, self.ignore_case)
+
+    def __getstate__(self):
+        # The lookup table is rebuilt on demand, so it is not pickled along with the rules.
+        state = dict(self.__dict__)
+        state['_table'] = {}
+        return state
+
+    def classify(self, num_tips, tip_liv_status):
+        """Classify a single ROOT observation, returning (status code, anomaly).
+
+        Returns None if the tip_liv_status matches none of the rules.
+        """
+        if num_tips != 1:
+            return _ANOMALY
+        try:
+            return self._table[tip_liv_status]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable values can not match any rule.
+            return None
+        ret = self._resolve(tip_liv_status)
+        self._table[tip_liv_status] = ret
+        return ret
+
+    def _resolve(self, tip_liv_status):
+        if not isinstance(tip_liv_status, str):
+            return None
+        value = tip_liv_status.lower() if self.ignore_case else tip_liv_status
+        # The longest matching label wins, so a rule may refine a shorter label of the other status.
+        best = None
+        best_length = -1
+        for code, labels in ((STATUS_ALIVE, self.alive), (STATUS_GONE, self.gone)):
+            for label in labels:
+                if self.match == MATCH_EXACT:
+                    matched = value == label
+                else:
+                    matched = value.startswith(label)
+                if matched and len(label) > best_length:
+                    best = code
+                    best_length = len(label)
+        if best is None:
+            return None
+        return best, False
+
+
+DEFAULT_RULES = StatusRules()
+
+
+def rules_from_dict(d):
+    unknown = set(d).difference(['alive', 'gone', 'match', 'ignore_case'])
+    if unknown:
+        raise FieldsError('Unknown status rules keys {}'.format(sorted(unknown)))
+    return StatusRules(alive=d.get('alive', DEFAULT_ALIVE),
+                       gone=d.get('gone', DEFAULT_GONE),
+                       match=d.get('match', MATCH_PREFIX),
+                       ignore_case=d.get('ignore_case', False))
+
+
+def parse_rules(spec):
+    """Parse inline status rules, such as 'alive=A;gone=D,G'."""
+    d = {}
+    for item in spec.split(';'):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' not in item:
+            raise FieldsError('Status rules item is not a key=value pair [{}]'.format(item))
+        key, value = [part.strip() for part in item.split('=', 1)]
+        if key in ('alive', 'gone'):
+            d[key] = [label.strip() for label in value.split(',') if label.strip()]
+        elif key == 'ignore_case':
+            if value.lower() not in ('true', 'false', '1', '0', 'yes', 'no'):
+                raise FieldsError('Invalid ignore_case value [{}]'.format(value))
+            d[key] = value.lower() in ('true', '1', 'yes')
+        else:
+            d[key] = value
+    return rules_from_dict(d)
+
+
+def load_rules(value):
+    """Load status rules from a JSON file, or parse them inline if value is not a file."""
+    if os.path.isfile(value):
+        log.info('Loading status rules from [{}]'.format(value))
+        try:
+            with open(value) as f:
+                d = json.load(f)
+        except ValueError:
+            raise FieldsError('Failed to parse status rules file [{}]'.format(value))
+        if not isinstance(d, dict):
+            raise FieldsError('Status rules file must hold a JSON object [{}]'.format(value))
+        return rules_from_dict(d)
+    return parse_rules(value)
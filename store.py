@@ -0,0 +1,98 @@
+"""
+Binary store of the ROOT and Synthesis sheets of a workbook.
+
+Converting a workbook reads it through openpyxl once, and writes every column of the ROOT and
+Synthesis sheets into a columnar file (see columnar.py), one table per sheet.  Every value keeps
+its type, and repeated strings such as root names and tip statuses are stored once in the string
+table of their column.  The Analyzer reads a store straight from the memory mapped file, so it may
+be analyzed any number of times, with any set of custom fields, without opening the workbook.
+"""
+from __future__ import print_function
+import collections
+import logging
+# Custom
+import columnar
+import utility
+
+from errors import AnalyzerError, DataError
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+STORE_EXTENSION = '.wrs'
+
+
+def is_store(fp):
+    """Check if a file is a columnar store rather than a workbook."""
+    try:
+        with open(fp, 'rb') as f:
+            return f.read(len(columnar.MAGIC)) == columnar.MAGIC
+    except (IOError, OSError):
+        log.exception('')
+        raise AnalyzerError('Failed to open source [{}]'.format(fp))
+
+
+def convert(src, dst, sheet_names):
+    """Convert the named sheets of the source workbook into a store, with one table per sheet.
+
+    Every column with a header value is stored, in header order.  Rows without any values are
+    skipped.  Returns the number of rows stored from each sheet.
+    """
+    log.info('Opening workbook [{}]'.format(src))
+    import openpyxl
+    try:
+        wb = openpyxl.load_workbook(filename=src, read_only=True)
+    except:
+        log.exception('')
+        raise AnalyzerError('Failed to load workbook [{}]'.format(src))
+    try:
+        missing = set(sheet_names) - set(wb.get_sheet_names())
+        if missing:
+            raise AnalyzerError('Workbook is missing expected sheet names {}'.format(sorted(missing)))
+        writer = columnar.ColumnarWriter(dst)
+        counts = collections.OrderedDict()
+        for sheet_name in sheet_names:
+            log.info('Converting sheet [{}]'.format(sheet_name))
+            ws = wb.get_sheet_by_name(sheet_name)
+            try:
+                header = [cell.value for cell in next(ws.iter_rows())]
+            except StopIteration:
+                raise DataError('Failed to find a header row in sheet [{}]'.format(sheet_name))
+            columns = []
+            for value in header:
+                if value is not None and value not in columns:
+                    columns.append(value)
+            table = writer.add_table(sheet_name, columns, exact=True)
+            for row in utility.iter_rows_from_columns(ws, columns):
+                table.append(row)
+            counts[sheet_name] = table.rows
+        writer.close()
+    finally:
+        wb.close()
+    return counts
+
+
+def open_store(fp):
+    """Open a store for reading.  The caller must close it once the columns are no longer used."""
+    try:
+        return columnar.ColumnarFile(fp)
+    except:
+        log.exception('')
+        raise AnalyzerError('Failed to load store [{}]'.format(fp))
+
+
+def read_columns(store, sheet_name, columns):
+    """Return an OrderedDict of column name -> column values for the given columns of a stored sheet.
+
+    Numeric columns are returned as views over the store, so they are only valid while the store
+    is open.
+    """
+    if sheet_name not in store.tables:
+        raise AnalyzerError('Store is missing expected sheet name [{}]'.format(sheet_name))
+    table = store.tables[sheet_name]
+    ret = collections.OrderedDict()
+    for key in columns:
+        if key not in table.columns:
+            raise DataError('Failed to obtain header value: {}'.format(key))
+        ret[key] = table.columns[key].decoded()
+    return ret
@@ -0,0 +1,289 @@
+"""
+Streaming column summaries of workbook sheets, for QA of large exports.
+
+Each sheet is read once, row by row from a read only workbook (or from a store written by the
+convert command), and every requested column is summarized in the same pass: the number of rows
+and nulls, the count of each distinct value, the minimum and maximum value, and the same minimum,
+maximum, row and null counts for each session.  Rows are gathered into chunks, which are split
+into columns so the counts of each column are updated a chunk at a time.  Sheets are summarized
+in parallel worker processes.
+"""
+from __future__ import print_function
+import collections
+import datetime
+import itertools
+import json
+import logging
+# Custom
+import store
+import utility
+
+from errors import AnalyzerError, DataError
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+SESSION_COLUMN = 'Session#'
+CHUNK_SIZE = 10000
+
+
+def _order_key(value):
+    # Values of different types are ordered numbers, then dates, then anything else as strings.
+    if isinstance(value, (int, float)):
+        return 0, value
+    if isinstance(value, datetime.datetime):
+        return 1, value
+    if isinstance(value, datetime.date):
+        return 1, datetime.datetime(value.year, value.month, value.day)
+    return 2, str(value)
+
+
+def _min_max(values):
+    """Return (min, max) of a list of non null values, or (None, None) if it is empty."""
+    if not values:
+        return None, None
+    try:
+        return min(values), max(values)
+    except TypeError:
+        return min(values, key=_order_key), max(values, key=_order_key)
+
+
+class Range(object):
+    """Running row count, null count, minimum and maximum of a set of values."""
+    __slots__ = ('rows', 'nulls', 'min', 'max')
+
+    def __init__(self):
+        self.rows = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+
+    def update(self, values):
+        """Add a list of values, which may include nulls, and return the non null values."""
+        self.rows += len(values)
+        nulls = values.count(None)
+        if nulls:
+            self.nulls += nulls
+            values = [v for v in values if v is not None]
+        low, high = _min_max(values)
+        if low is not None:
+            self.min = low if self.min is None else _min_max([self.min, low])[0]
+            self.max = high if self.max is None else _min_max([self.max, high])[1]
+        return values
+
+    def report(self):
+        return {'rows': self.rows,
+                'nulls': self.nulls,
+                'min': self.min,
+                'max': self.max, }
+
+
+class ColumnSummary(object):
+    def __init__(self, name):
+        self.name = name
+        self.range = Range()
+        self.counts = collections.Counter()
+        self.sessions = {}  # Session -> Range of the values in that session.
+
+    def update(self, values, sessions=None):
+        """Add a chunk of values of the column, and the session of each value."""
+        self.counts.update(self.range.update(values))
+        if sessions is None:
+            return
+        # Chunks are usually ordered by session, so group runs of the same session.
+        position = 0
+        for session, run in itertools.groupby(sessions):
+            length = len(list(run))
+            r = self.sessions.get(session)
+            if r is None:
+                r = self.sessions[session] = Range()
+            r.update(values[position:position + length])
+            position += length
+
+    def report(self, top=None):
+        ret = self.range.report()
+        ret['distinct'] = len(self.counts)
+        ret['counts'] = collections.OrderedDict(self.counts.most_common(top))
+        ret['sessions'] = collections.OrderedDict((session, self.sessions[session].report())
+                                                  for session in sorted(self.sessions, key=_order_key))
+        return ret
+
+
+def _sheet_rows(src, sheet_name, columns, optional_columns=()):
+    """Open a sheet of a source, returning (source, column names, iterator over the rows of those columns).
+
+    The source is either a workbook, which is opened read only, or a store.  Every column is read
+    if no columns are given.  The optional_columns are also read when the sheet has them.  The
+    caller must close the returned source once the rows are consumed.
+    """
+    if store.is_store(src):
+        source = store.open_store(src)
+        if sheet_name not in source.tables:
+            source.close()
+            raise AnalyzerError('Store is missing expected sheet name [{}]'.format(sheet_name))
+        header = source.tables[sheet_name].header
+        columns = _read_columns(header, columns, optional_columns)
+        values = store.read_columns(source, sheet_name, columns)
+        return source, columns, zip(*values.values())
+    import openpyxl
+    source = openpyxl.load_workbook(filename=src, read_only=True)
+    if sheet_name not in source.get_sheet_names():
+        source.close()
+        raise AnalyzerError('Workbook is missing expected sheet name [{}]'.format(sheet_name))
+    ws = source.get_sheet_by_name(sheet_name)
+    try:
+        header = [cell.value for cell in next(ws.iter_rows())]
+    except StopIteration:
+        source.close()
+        raise DataError('Failed to find a header row in sheet [{}]'.format(sheet_name))
+    columns = _read_columns(header, columns, optional_columns)
+    return source, columns, utility.iter_rows_from_columns(ws, columns)
+
+
+def _read_columns(header, columns, optional_columns):
+    """Return the columns, or every column of the header, followed by the optional columns found in the header."""
+    if columns:
+        ret = list(columns)
+    else:
+        ret = []
+        for value in header:
+            if value is not None and value not in ret:
+                ret.append(value)
+    ret.extend(column for column in optional_columns if column in header and column not in ret)
+    return ret
+
+
+def summarize_sheet(src, sheet_name, columns=None, session_column=SESSION_COLUMN, chunk_size=CHUNK_SIZE, top=None):
+    """Summarize the given columns (by default every column) of one sheet of a source, in a single pass.
+
+    Values are also summarized per session when the sheet has the session_column.  Returns an
+    OrderedDict of column name -> summary.  top limits the number of value counts reported for
+    each column.
+    """
+    log.info('Summarizing sheet [{}] of [{}]'.format(sheet_name, src))
+    columns = list(columns or [])
+    # Read the session column along with the requested columns, where the sheet has it, without reporting on it.
+    source, read_columns, rows = _sheet_rows(src, sheet_name, columns,
+                                             optional_columns=[session_column] if columns and session_column else ())
+    try:
+        if not columns:
+            columns = list(read_columns)
+        session_position = None
+        if session_column in read_columns:
+            session_position = read_columns.index(session_column)
+        summaries = [ColumnSummary(name) for name in columns]
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            chunk_columns = [list(values) for values in zip(*chunk)]
+            sessions = chunk_columns[session_position] if session_position is not None else None
+            for summary, values in zip(summaries, chunk_columns):
+                summary.update(values, sessions)
+    finally:
+        source.close()
+    return collections.OrderedDict((summary.name, summary.report(top=top)) for summary in summaries)
+
+
+def _summarize_sheet_job(job):
+    src, sheet_name, kwargs = job
+    return summarize_sheet(src, sheet_name, **kwargs)
+
+
+def sheet_names(src):
+    """Return the names of the sheets of a workbook, or of the stored sheets of a store."""
+    if store.is_store(src):
+        source = store.open_store(src)
+        try:
+            return list(source.tables)
+        finally:
+            source.close()
+    import openpyxl
+    wb = openpyxl.load_workbook(filename=src, read_only=True)
+    try:
+        return wb.get_sheet_names()
+    finally:
+        wb.close()
+
+
+def sheets_with_columns(src, columns):
+    """Return the names of the sheets of a workbook or store whose header holds every one of the columns."""
+    ret = []
+    if store.is_store(src):
+        source = store.open_store(src)
+        try:
+            for sheet_name, table in source.tables.items():
+                if all(column in table.header for column in columns):
+                    ret.append(sheet_name)
+        finally:
+            source.close()
+        return ret
+    import openpyxl
+    wb = openpyxl.load_workbook(filename=src, read_only=True)
+    try:
+        for sheet_name in wb.get_sheet_names():
+            header = [cell.value for cell in next(wb.get_sheet_by_name(sheet_name).iter_rows(), ())]
+            if all(column in header for column in columns):
+                ret.append(sheet_name)
+    finally:
+        wb.close()
+    return ret
+
+
+def summarize(src, sheets=None, columns=None, jobs=None, **kwargs):
+    """Summarize the given sheets (by default every sheet) of a source, one sheet per worker process.
+
+    columns selects the columns summarized in every sheet.  Named sheets without one of them fail,
+    and when no sheets are named, only the sheets holding every one of the columns are summarized.
+    The other keyword arguments are passed to summarize_sheet.  Returns an OrderedDict of sheet
+    name -> summaries of its columns.
+    """
+    if sheets:
+        sheets = list(sheets)
+    elif columns:
+        sheets = sheets_with_columns(src, columns)
+        if not sheets:
+            raise AnalyzerError('No sheet holds every one of the columns {}'.format(list(columns)))
+        log.info('Summarizing the sheets holding the columns: {}'.format(sheets))
+    else:
+        sheets = sheet_names(src)
+    kwargs['columns'] = columns
+    job_list = [(src, sheet_name, kwargs) for sheet_name in sheets]
+    if jobs == 1 or len(job_list) < 2:
+        results = [_summarize_sheet_job(job) for job in job_list]
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes=min(jobs or multiprocessing.cpu_count(), len(job_list)))
+        try:
+            results = pool.map(_summarize_sheet_job, job_list, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return collections.OrderedDict(zip(sheets, results))
+
+
+def _json_keys(obj):
+    # JSON objects only have string keys, so keys such as session dates are written as strings.
+    if isinstance(obj, dict):
+        return collections.OrderedDict((k if isinstance(k, (str, int, float, bool)) or k is None else str(k),
+                                        _json_keys(v)) for k, v in obj.items())
+    return obj
+
+
+def write_json(results, fp):
+    with open(fp, 'w') as f:
+        json.dump(_json_keys(results), f, indent=2, default=str)
+    return True
+
+
+def format_summary(results):
+    """Return the lines of a plain text table of the summaries, without the value counts."""
+    lines = []
+    line_format = '{:<16}{:<24}{:>10}{:>10}{:>10}  {:<22}{:<22}'
+    lines.append(line_format.format('sheet', 'column', 'rows', 'nulls', 'distinct', 'min', 'max'))
+    for sheet_name, summaries in results.items():
+        for column, summary in summaries.items():
+            lines.append(line_format.format(str(sheet_name), str(column), summary.get('rows'),
+                                            summary.get('nulls'), summary.get('distinct'),
+                                            str(summary.get('min')), str(summary.get('max'))))
+    return lines
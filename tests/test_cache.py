@@ -0,0 +1,131 @@
+"""
+Tests of the parse cache, and of the incremental re-analysis of workbooks it allows.
+
+Workbooks are stood in for by the in memory workbooks of workbooks.py.  Each source file holds a
+repr of its workbook, so its digest changes with the workbook content.
+"""
+from __future__ import print_function
+import datetime
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Custom
+import analyzer
+import cache
+
+from workbooks import CUSTOM_FIELDS, Workbook, root_rows
+
+__author__ = 'wgibb'
+
+
+def setUpModule():
+    logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='winroot-test-')
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.src = os.path.join(self.tmpdir, 'source.xlsx')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def analyze(self, wb, cache_dir=None):
+        """Analyze a workbook, returning (analyzer, compiled rows, whether the workbook was loaded)."""
+        with open(self.src, 'w') as f:
+            f.write(repr(wb))
+        a = analyzer.Analyzer(additional_root_fields=CUSTOM_FIELDS, read_only=True, cache_dir=cache_dir)
+        loaded = []
+
+        def load_workbook(fp, read_only=None):
+            loaded.append(fp)
+            return wb
+        a._load_workbook = load_workbook
+        a.insert(self.src)
+        return a, list(a.iter_output_rows(a.output_header())), bool(loaded)
+
+    def assertMatchesFullParse(self, wb, **counters):
+        a, rows, _ = self.analyze(wb, cache_dir=self.cache_dir)
+        _, expected, _ = self.analyze(wb)
+        self.assertEqual(rows, expected)
+        for name, value in counters.items():
+            self.assertEqual(a.metrics.counters[name], value, name)
+        return a
+
+    def test_miss_then_hit(self):
+        wb = Workbook(root_rows([1, 2, 3]))
+        rows = len(wb.sheets['ROOT'].rows) - 1
+        self.assertMatchesFullParse(wb, cache_hits=0, root_rows=rows, root_rows_parsed=rows)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        a, cached, loaded = self.analyze(wb, cache_dir=self.cache_dir)
+        self.assertFalse(loaded)
+        self.assertEqual(a.metrics.counters['cache_hits'], 1)
+        self.assertEqual(cached, self.analyze(wb)[1])
+
+    def test_appended_sessions(self):
+        self.analyze(Workbook(root_rows([1, 2])), cache_dir=self.cache_dir)
+        new_rows = root_rows([3, 4])
+        wb = Workbook(root_rows([1, 2]) + new_rows)
+        a = self.assertMatchesFullParse(wb, cache_hits=0, root_rows_parsed=len(new_rows))
+        self.assertEqual(a.metrics.counters['root_rows'], len(root_rows([1, 2, 3, 4])))
+        # The grown workbook is itself cached.
+        _, _, loaded = self.analyze(wb, cache_dir=self.cache_dir)
+        self.assertFalse(loaded)
+
+    def test_appended_rows_from_an_earlier_session(self):
+        self.analyze(Workbook(root_rows([1, 2, 3])), cache_dir=self.cache_dir)
+        late_row = (1, 9, 'R9', 2, 2, 0, 'A', 1, datetime.datetime(2015, 4, 29), 0, 5)
+        wb = Workbook(root_rows([1, 2, 3]) + [late_row])
+        rows = len(wb.sheets['ROOT'].rows) - 1
+        # The abandoned incremental pass does not count any rows.
+        self.assertMatchesFullParse(wb, root_rows=rows, root_rows_parsed=rows,
+                                    synthesis_rows=len(wb.sheets['Synthesis'].rows) - 1)
+
+    def test_shrunk_workbook(self):
+        self.analyze(Workbook(root_rows([1, 2, 3])), cache_dir=self.cache_dir)
+        wb = Workbook(root_rows([1, 2]))
+        rows = len(wb.sheets['ROOT'].rows) - 1
+        self.assertMatchesFullParse(wb, cache_hits=0, root_rows=rows, root_rows_parsed=rows)
+
+    def test_changed_rows(self):
+        self.analyze(Workbook(root_rows([1, 2, 3])), cache_dir=self.cache_dir)
+        changed = root_rows([1, 2, 3])
+        changed[0] = changed[0][:-1] + (999, )
+        wb = Workbook(changed + root_rows([4]))
+        self.assertMatchesFullParse(wb, root_rows_parsed=len(changed) + len(root_rows([4])))
+
+    def test_key(self):
+        a = analyzer.Analyzer(additional_root_fields=CUSTOM_FIELDS)
+        key = cache.ParseCache.key(self.src, a.required_sheet_names, a.schema)
+        self.assertEqual(key, cache.ParseCache.key(self.src, a.required_sheet_names, a.schema))
+        # The extracted fields are part of the key.
+        b = analyzer.Analyzer()
+        self.assertNotEqual(key, cache.ParseCache.key(self.src, b.required_sheet_names, b.schema))
+
+    def test_unusable_entries(self):
+        parse_cache = cache.ParseCache(self.cache_dir)
+        self.assertIsNone(parse_cache.load('missing'))
+        entry = cache.CacheEntry(source_digest='digest')
+        parse_cache.store('key', entry)
+        self.assertEqual(parse_cache.load('key').source_digest, 'digest')
+        entry.version = cache.CACHE_VERSION - 1
+        parse_cache.store('key', entry)
+        self.assertIsNone(parse_cache.load('key'))
+        with open(os.path.join(self.cache_dir, 'key' + cache.CACHE_EXTENSION), 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertIsNone(parse_cache.load('key'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+Tests of merging newer sources into compiled results, which must match a full analysis of the sources.
+"""
+from __future__ import print_function
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Custom
+import analyzer
+import writers
+
+from errors import DataError, SerializationError
+from workbooks import CUSTOM_FIELDS, Workbook, root_rows
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+__author__ = 'wgibb'
+
+# Tube 3 is only observed from session 3 on, so it is not part of a result compiled from sessions 1 and 2.
+FULL_ROWS = root_rows([1, 2, 3, 4]) + root_rows([3, 4], tubes=(3, ))
+
+
+def setUpModule():
+    logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+class TestMerge(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='winroot-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def source(self, rows, name='source.xlsx'):
+        """Return the path of a source holding a workbook of the given ROOT rows, and the workbook."""
+        wb = Workbook(rows)
+        fp = os.path.join(self.tmpdir, name)
+        with open(fp, 'w') as f:
+            f.write(repr(wb))
+        return fp, wb
+
+    def analyzer(self, wb=None):
+        a = analyzer.Analyzer(additional_root_fields=CUSTOM_FIELDS, read_only=True)
+        if wb is not None:
+            a._load_workbook = lambda fp, read_only=None: wb
+        return a
+
+    def compile(self, rows, output_format):
+        """Analyze the ROOT rows, returning the path of the compiled result in the given format."""
+        src, wb = self.source(rows, name='compiled_source.xlsx')
+        a = self.analyzer(wb)
+        a.insert(src)
+        fp = os.path.join(self.tmpdir, 'base' + writers.get_writer(output_format).extension)
+        a.write(fp, output_format=output_format)
+        return fp
+
+    def csv_text(self, a):
+        fp = os.path.join(self.tmpdir, 'output.csv')
+        a.write(fp, output_format=writers.FORMAT_CSV)
+        with open(fp) as f:
+            return f.read()
+
+    def merged(self, base, rows):
+        src, wb = self.source(rows)
+        a = self.analyzer(wb)
+        a.load_compiled(base)
+        a.merge(src)
+        return a
+
+    def check_merge(self, output_format):
+        src, wb = self.source(FULL_ROWS)
+        full = self.analyzer(wb)
+        full.insert(src)
+        expected = self.csv_text(full)
+
+        a = self.merged(self.compile(root_rows([1, 2]), output_format), FULL_ROWS)
+        self.assertEqual(self.csv_text(a), expected)
+        self.assertEqual(a.changed_tubes, [1, 2, 3])
+
+        # The merged result is itself a compiled result, and merging the same source into it again changes nothing.
+        base = os.path.join(self.tmpdir, 'merged' + writers.get_writer(output_format).extension)
+        a.write(base, output_format=output_format)
+        b = self.merged(base, FULL_ROWS)
+        self.assertEqual(b.changed_tubes, [])
+        self.assertEqual(self.csv_text(b), expected)
+        self.assertRaises(SerializationError, b.write_changes, os.path.join(self.tmpdir, 'changes.csv'),
+                          output_format=writers.FORMAT_CSV)
+
+    def test_csv_base(self):
+        self.check_merge(writers.FORMAT_CSV)
+
+    def test_columnar_base(self):
+        self.check_merge(writers.FORMAT_COLUMNAR)
+
+    @unittest.skipIf(openpyxl is None, 'openpyxl is not installed')
+    def test_xlsx_base(self):
+        self.check_merge(writers.FORMAT_XLSX)
+
+    def test_write_changes(self):
+        a = self.merged(self.compile(root_rows([1, 2]), writers.FORMAT_CSV), root_rows([3]))
+        self.assertEqual(a.changed_tubes, [1, 2])
+        fp = os.path.join(self.tmpdir, 'changes.csv')
+        a.write_changes(fp, output_format=writers.FORMAT_CSV)
+        rows = list(writers.read_rows(fp))
+        self.assertEqual(len(rows) - 1, sum(len(tube_obj) for tube_obj in a.tubes))
+
+    def test_finalized_root_missing_from_new_last_session(self):
+        base = self.compile(root_rows([1, 2, 3]), writers.FORMAT_CSV)
+        # Root R1 of tube 1 is not observed in session 4.
+        rows = [row for row in root_rows([1, 2, 3, 4]) if not (row[0] == 1 and row[2] == 'R1' and row[4] == 4)]
+        src, wb = self.source(rows)
+        a = self.analyzer(wb)
+        a.load_compiled(base)
+        before = self.csv_text(a)
+        self.assertRaises(DataError, a.merge, src)
+        # No tube was changed.
+        self.assertEqual(self.csv_text(a), before)
+        self.assertEqual(a.changed_tubes, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Tests of the pipelined mode, which must write the same output as a normal run.
+"""
+from __future__ import print_function
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Custom
+import analyzer
+import pipeline
+import writers
+
+from errors import DataError
+from workbooks import CUSTOM_FIELDS, Workbook, root_rows
+
+__author__ = 'wgibb'
+
+
+def setUpModule():
+    logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='winroot-test-')
+        self.src = os.path.join(self.tmpdir, 'source.xlsx')
+        self.chunk_rows = pipeline.CHUNK_ROWS
+        # Small chunks, so the rows of every tube are spread over several of them.
+        pipeline.CHUNK_ROWS = 5
+
+    def tearDown(self):
+        pipeline.CHUNK_ROWS = self.chunk_rows
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def analyzer(self, wb):
+        with open(self.src, 'w') as f:
+            f.write(repr(wb))
+        a = analyzer.Analyzer(additional_root_fields=CUSTOM_FIELDS, read_only=True)
+        a._load_workbook = lambda fp, read_only=None: wb
+        return a
+
+    def read(self, fp):
+        with open(fp) as f:
+            return f.read()
+
+    def test_matches_a_normal_run(self):
+        # The rows are ordered by session, so the rows of each tube are not contiguous.
+        wb = Workbook(root_rows([1, 2, 3, 4], tubes=(3, 1, 2)))
+        expected = os.path.join(self.tmpdir, 'expected.csv')
+        a = self.analyzer(wb)
+        a.insert(self.src)
+        a.write(expected, output_format=writers.FORMAT_CSV)
+        for queue_size in (1, pipeline.DEFAULT_QUEUE_SIZE):
+            output = os.path.join(self.tmpdir, 'pipelined-{}.csv'.format(queue_size))
+            b = self.analyzer(wb)
+            b.insert_pipelined(self.src, output, output_format=writers.FORMAT_CSV, queue_size=queue_size)
+            self.assertEqual(self.read(output), self.read(expected))
+            self.assertEqual(b.tubes, [])
+            self.assertEqual(b.metrics.counters, a.metrics.counters)
+            self.assertEqual(sorted(b.metrics.tubes), sorted(a.metrics.tubes))
+
+    def test_tube_numbers_must_match(self):
+        rows = root_rows([1, 2])
+        wb = Workbook(rows + [(9, ) + row[1:] for row in root_rows([1])],
+                      synthesis_rows=Workbook(rows).sheets['Synthesis'].rows[1:])
+        output = os.path.join(self.tmpdir, 'output.csv')
+        self.assertRaises(DataError, self.analyzer(wb).insert_pipelined, self.src, output,
+                          output_format=writers.FORMAT_CSV)
+        # No partial output is left behind.
+        self.assertFalse(os.path.exists(output))
+
+    def test_chunked(self):
+        self.assertEqual(list(pipeline.chunked(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(pipeline.chunked([], 3)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Tests of the TipLivStatus classification rules.
+"""
+from __future__ import print_function
+import json
+import logging
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Custom
+import status
+
+from errors import FieldsError
+from root import STATUS_ALIVE, STATUS_GONE
+
+__author__ = 'wgibb'
+
+ALIVE = (STATUS_ALIVE, False)
+GONE = (STATUS_GONE, False)
+
+
+def setUpModule():
+    logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+class TestStatusRules(unittest.TestCase):
+    def test_default_rules(self):
+        rules = status.DEFAULT_RULES
+        self.assertEqual(rules.classify(1, 'A'), ALIVE)
+        self.assertEqual(rules.classify(1, 'Alive'), ALIVE)
+        self.assertEqual(rules.classify(1, 'D'), GONE)
+        self.assertEqual(rules.classify(1, 'G'), GONE)
+        self.assertIsNone(rules.classify(1, 'a'))
+        self.assertIsNone(rules.classify(1, 'Q'))
+        self.assertIsNone(rules.classify(1, None))
+        self.assertIsNone(rules.classify(1, ['A']))
+        # Observations with other than one tip are anomalous, whatever their status.
+        self.assertEqual(rules.classify(2, 'Q'), (STATUS_ALIVE, True))
+        self.assertEqual(rules.classify(0, 'D'), (STATUS_ALIVE, True))
+
+    def test_exact_and_prefix_match(self):
+        prefix = status.StatusRules(alive=['Al'], gone=['De'])
+        exact = status.StatusRules(alive=['Al'], gone=['De'], match=status.MATCH_EXACT)
+        self.assertEqual(prefix.classify(1, 'Alive'), ALIVE)
+        self.assertEqual(prefix.classify(1, 'Dead'), GONE)
+        self.assertIsNone(exact.classify(1, 'Alive'))
+        self.assertIsNone(exact.classify(1, 'Dead'))
+        self.assertEqual(exact.classify(1, 'Al'), ALIVE)
+        self.assertEqual(exact.classify(1, 'De'), GONE)
+        self.assertIsNone(prefix.classify(1, 'A'))
+
+    def test_ignore_case(self):
+        rules = status.StatusRules(alive=['Alive'], gone=['DEAD'], ignore_case=True)
+        self.assertEqual(rules.alive, ('alive', ))
+        self.assertEqual(rules.gone, ('dead', ))
+        self.assertEqual(rules.classify(1, 'ALIVE'), ALIVE)
+        self.assertEqual(rules.classify(1, 'dead root'), GONE)
+        rules = status.StatusRules(alive=['Alive'], gone=['DEAD'])
+        self.assertIsNone(rules.classify(1, 'ALIVE'))
+        self.assertIsNone(rules.classify(1, 'dead'))
+
+    def test_longest_label_wins(self):
+        rules = status.StatusRules(alive=['A', 'DA'], gone=['D', 'AG'])
+        self.assertEqual(rules.classify(1, 'A'), ALIVE)
+        self.assertEqual(rules.classify(1, 'AGone'), GONE)
+        self.assertEqual(rules.classify(1, 'D'), GONE)
+        self.assertEqual(rules.classify(1, 'DAlive'), ALIVE)
+        # The result of each distinct value is kept, and is not pickled with the rules.
+        self.assertEqual(rules._table['AGone'], GONE)
+        self.assertEqual(pickle.loads(pickle.dumps(rules))._table, {})
+
+    def test_invalid_rules(self):
+        self.assertRaises(FieldsError, status.StatusRules, match='fuzzy')
+        self.assertRaises(FieldsError, status.StatusRules, alive=[])
+        self.assertRaises(FieldsError, status.StatusRules, alive=[''])
+        self.assertRaises(FieldsError, status.StatusRules, alive=['A', 'D'])
+        # Labels which only differ in case overlap when the case is ignored.
+        self.assertRaises(FieldsError, status.StatusRules, alive=['a'], gone=['A'], ignore_case=True)
+
+
+class TestParseRules(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='winroot-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_inline_rules(self):
+        rules = status.parse_rules(' alive = Alive, Live ; gone=Dead,,Gone;match=exact;ignore_case=yes; ')
+        self.assertEqual(rules.alive, ('alive', 'live'))
+        self.assertEqual(rules.gone, ('dead', 'gone'))
+        self.assertEqual(rules.match, status.MATCH_EXACT)
+        self.assertTrue(rules.ignore_case)
+        # Omitted keys take their defaults.
+        rules = status.parse_rules('gone=X')
+        self.assertEqual(rules.alive, status.DEFAULT_ALIVE)
+        self.assertEqual(rules.gone, ('X', ))
+        self.assertEqual(rules.match, status.MATCH_PREFIX)
+        self.assertFalse(rules.ignore_case)
+
+    def test_invalid_inline_rules(self):
+        self.assertRaises(FieldsError, status.parse_rules, 'alive')
+        self.assertRaises(FieldsError, status.parse_rules, 'alive=A;colour=red')
+        self.assertRaises(FieldsError, status.parse_rules, 'ignore_case=maybe')
+        self.assertRaises(FieldsError, status.parse_rules, 'match=fuzzy')
+
+    def test_load_rules(self):
+        fp = os.path.join(self.tmpdir, 'rules.json')
+        with open(fp, 'w') as f:
+            json.dump({'alive': ['L'], 'gone': ['X'], 'match': 'exact'}, f)
+        rules = status.load_rules(fp)
+        self.assertEqual((rules.alive, rules.gone, rules.match), (('L', ), ('X', ), status.MATCH_EXACT))
+        self.assertEqual(repr(status.load_rules('alive=L;gone=X;match=exact')), repr(rules))
+        # A path to a file which does not exist is parsed as inline rules, and fails.
+        self.assertRaises(FieldsError, status.load_rules, os.path.join(self.tmpdir, 'rules.jsn'))
+        for content in ('{not json', '["A"]'):
+            with open(fp, 'w') as f:
+                f.write(content)
+            self.assertRaises(FieldsError, status.load_rules, fp)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+"""
+Round trip tests of the columnar format and the binary store built on it.
+"""
+from __future__ import print_function
+import datetime
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Custom
+import columnar
+import store
+
+from errors import AnalyzerError, DataError, SerializationError
+
+__author__ = 'wgibb'
+
+
+def setUpModule():
+    # Failures are logged as well as raised, which would clutter the test output.
+    logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+HEADER = ['Tube#', 'RootName', 'Length', 'Date', 'Day', 'anomaly', 'Mixed', 'Empty']
+ROWS = [(1, 'R1', 1.5, datetime.datetime(2015, 4, 1, 12, 30), datetime.date(2015, 4, 1), False, 1, None),
+        (1, 'R2', 2, datetime.datetime(2015, 4, 15), datetime.date(2015, 4, 15), True, '1', ''),
+        (2 ** 40, None, None, None, None, None, 1.0, None),
+        (-3, 'R1', 0.25, datetime.datetime(1969, 12, 31, 23, 59, 59, 5), datetime.date(1900, 1, 1), True, True, None),
+        (7, 'Ré', 10.0, datetime.datetime(2015, 5, 1), datetime.date(2015, 5, 1), False,
+         datetime.date(2015, 5, 1), None), ]
+
+
+class ColumnarTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='winroot-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write(self, tables, exact=False, name='test.wrc'):
+        fp = os.path.join(self.tmpdir, name)
+        writer = columnar.ColumnarWriter(fp)
+        for table_name, header, rows in tables:
+            table = writer.add_table(table_name, header, exact=exact)
+            for row in rows:
+                table.append(row)
+        writer.close()
+        return fp
+
+    @staticmethod
+    def types(rows):
+        return [tuple(type(v) for v in row) for row in rows]
+
+
+class TestColumnarRoundTrip(ColumnarTestCase):
+    def test_exact_round_trip(self):
+        fp = self.write([('ROOT', HEADER, ROWS)], exact=True)
+        for use_mmap in (True, False):
+            with columnar.ColumnarFile(fp, use_mmap=use_mmap) as cfile:
+                table = cfile.table('ROOT')
+                self.assertEqual(table.header, HEADER)
+                self.assertEqual(len(table), len(ROWS))
+                rows = list(table.iter_rows())
+            # Empty strings are stored as nulls.
+            expected = [tuple(None if v == '' else v for v in row) for row in ROWS]
+            self.assertEqual(rows, expected)
+            # Exact mode keeps the type of every value, even where values such as 1, '1' and True compare equal.
+            self.assertEqual(self.types(rows), self.types(expected))
+
+    def test_widened_round_trip(self):
+        header = ['Tube#', 'Length', 'Date', 'Mixed']
+        rows = [(1, 1, datetime.date(2015, 4, 1), 1),
+                (True, 2.5, datetime.datetime(2015, 4, 2, 6), 'one'),
+                (3, None, None, 2.5), ]
+        fp = self.write([('data', header, rows)])
+        with columnar.ColumnarFile(fp) as cfile:
+            table = cfile.table()
+            self.assertEqual([column.type for column in table.columns.values()],
+                             [columnar.TYPE_INT, columnar.TYPE_FLOAT, columnar.TYPE_DATETIME, columnar.TYPE_STR])
+            self.assertEqual(list(table.iter_rows()),
+                             [(1, 1.0, datetime.datetime(2015, 4, 1), '1'),
+                              (1, 2.5, datetime.datetime(2015, 4, 2, 6), 'one'),
+                              (3, None, None, '2.5'), ])
+
+    def test_multiple_tables(self):
+        fp = self.write([('ROOT', HEADER, ROWS),
+                         ('Synthesis', ['Tube#', 'RootName'], [(1, 'R1'), (2, 'R2')]),
+                         ('Empty', ['Tube#'], []), ], exact=True)
+        with columnar.ColumnarFile(fp) as cfile:
+            self.assertEqual(list(cfile.tables), ['ROOT', 'Synthesis', 'Empty'])
+            self.assertEqual(cfile.table().name, 'ROOT')
+            self.assertEqual(list(cfile.table('Synthesis').iter_rows()), [(1, 'R1'), (2, 'R2')])
+            self.assertEqual(list(cfile.table('Empty').iter_rows()), [])
+            self.assertRaises(SerializationError, cfile.table, 'Missing')
+
+    def test_decoded_columns(self):
+        fp = self.write([('ROOT', HEADER, ROWS)], exact=True)
+        with columnar.ColumnarFile(fp) as cfile:
+            table = cfile.table()
+            for index, name in enumerate(HEADER):
+                expected = [None if row[index] == '' else row[index] for row in ROWS]
+                self.assertEqual(list(table.column(name).decoded()), expected)
+            # Repeated strings are decoded to a single shared object.
+            names = table.column('RootName').decoded()
+            self.assertIs(names[0], names[3])
+
+    def test_int_columns_are_narrowed(self):
+        fp = self.write([('data', ['small', 'large'], [(i, i * 2 ** 33) for i in range(-5, 5)])])
+        with columnar.ColumnarFile(fp) as cfile:
+            table = cfile.table()
+            self.assertEqual(table.column('small').values.format, 'b')
+            self.assertEqual(table.column('large').values.format, 'q')
+            self.assertEqual(list(table.column('large')), [i * 2 ** 33 for i in range(-5, 5)])
+
+    def test_version_1_files_are_read(self):
+        # Version 1 files were written without exact mode, so string columns have no string_kinds segment.
+        rows = [(1, 'R1', 1.5), (2, None, None), (3, 'R1', 2.0)]
+        version = columnar.VERSION
+        columnar.VERSION = 1
+        try:
+            fp = self.write([('data', ['Tube#', 'RootName', 'Length'], rows)])
+        finally:
+            columnar.VERSION = version
+        with columnar.ColumnarFile(fp) as cfile:
+            self.assertEqual(list(cfile.table().iter_rows()), rows)
+
+    def test_unsupported_files(self):
+        fp = os.path.join(self.tmpdir, 'not_columnar.wrc')
+        with open(fp, 'wb') as f:
+            f.write(b'PK\x03\x04 not a columnar file')
+        self.assertRaises(SerializationError, columnar.ColumnarFile, fp)
+        version = columnar.VERSION
+        columnar.VERSION = max(columnar.SUPPORTED_VERSIONS) + 1
+        try:
+            fp = self.write([('data', ['Tube#'], [(1, )])])
+        finally:
+            columnar.VERSION = version
+        self.assertRaises(SerializationError, columnar.ColumnarFile, fp)
+
+    def test_row_length_mismatch(self):
+        writer = columnar.ColumnarWriter(os.path.join(self.tmpdir, 'bad.wrc'))
+        table = writer.add_table('data', ['Tube#', 'RootName'])
+        self.assertRaises(SerializationError, table.append, (1, ))
+        self.assertRaises(SerializationError, writer.add_table, 'data', ['Tube#'])
+
+
+class TestStore(ColumnarTestCase):
+    def test_read_columns(self):
+        fp = self.write([('ROOT', HEADER, ROWS)], exact=True, name='test' + store.STORE_EXTENSION)
+        self.assertTrue(store.is_store(fp))
+        data_store = store.open_store(fp)
+        try:
+            columns = store.read_columns(data_store, 'ROOT', ['RootName', 'Tube#'])
+            self.assertEqual(list(columns), ['RootName', 'Tube#'])
+            self.assertEqual(list(columns['Tube#']), [row[0] for row in ROWS])
+            self.assertEqual(list(columns['RootName']), [row[1] for row in ROWS])
+            self.assertRaises(DataError, store.read_columns, data_store, 'ROOT', ['Missing'])
+            self.assertRaises(AnalyzerError, store.read_columns, data_store, 'Synthesis', ['Tube#'])
+            del columns
+        finally:
+            data_store.close()
+
+    def test_is_store(self):
+        fp = os.path.join(self.tmpdir, 'workbook.xlsx')
+        with open(fp, 'wb') as f:
+            f.write(b'PK\x03\x04')
+        self.assertFalse(store.is_store(fp))
+        self.assertRaises(AnalyzerError, store.is_store, os.path.join(self.tmpdir, 'missing.xlsx'))
+        self.assertRaises(AnalyzerError, store.open_store, fp)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Tests of the validation of sources, which must count every issue of a source in a single pass.
+"""
+from __future__ import print_function
+import io
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Custom
+import analyzer
+import columnar
+import store
+import validate
+
+from workbooks import CUSTOM_FIELDS, ROOT_HEADER, Workbook, root_rows
+
+__author__ = 'wgibb'
+
+
+def setUpModule():
+    logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+class TestValidate(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='winroot-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def source(self, wb, name='source'):
+        """Return the path of a store holding the ROOT and Synthesis sheets of the workbook."""
+        fp = os.path.join(self.tmpdir, name + store.STORE_EXTENSION)
+        writer = columnar.ColumnarWriter(fp)
+        for sheet_name in ('ROOT', 'Synthesis'):
+            rows = wb.get_sheet_by_name(sheet_name).rows
+            table = writer.add_table(sheet_name, rows[0], exact=True)
+            for row in rows[1:]:
+                table.append(row)
+        writer.close()
+        return fp
+
+    def invalid_source(self):
+        """Return the path of a source with one issue of each kind found in the rows of the sheets."""
+        rows = root_rows([1, 2])
+        synthesis_rows = Workbook(rows).get_sheet_by_name('Synthesis').rows[1:]
+        session = ROOT_HEADER.index('Session#')
+        status = ROOT_HEADER.index('TipLivStatus')
+        rows[0] = rows[0][:session] + ('two', ) + rows[0][session + 1:]
+        rows[1] = rows[1][:status] + ('Q', ) + rows[1][status + 1:]
+        # Tube 3 has no Synthesis rows.
+        rows.append((3, ) + rows[2][1:])
+        return self.source(Workbook(rows, synthesis_rows=synthesis_rows + [synthesis_rows[0]]))
+
+    def validate(self, src, **kwargs):
+        return validate.validate_source(src, additional_root_fields=CUSTOM_FIELDS, **kwargs)
+
+    def test_valid_source(self):
+        rows = root_rows([1, 2])
+        report = self.validate(self.source(Workbook(rows)))
+        self.assertTrue(report.ok)
+        self.assertEqual(report.issues, [])
+        self.assertEqual(report.rows, {'Synthesis': 8, 'ROOT': len(rows)})
+
+    def test_issue_counts(self):
+        report = self.validate(self.invalid_source())
+        self.assertFalse(report.ok)
+        self.assertEqual(dict(report.counts), {validate.ISSUE_VALUE: 1,
+                                               validate.ISSUE_DUPLICATE: 1,
+                                               validate.ISSUE_STATUS: 1,
+                                               validate.ISSUE_COVERAGE: 1, })
+        self.assertEqual([(issue.kind, issue.sheet, issue.row) for issue in report.issues],
+                         [(validate.ISSUE_DUPLICATE, 'Synthesis', 10),
+                          (validate.ISSUE_VALUE, 'ROOT', 2),
+                          (validate.ISSUE_STATUS, 'ROOT', 3),
+                          (validate.ISSUE_COVERAGE, 'ROOT', None), ])
+
+    def test_missing_column(self):
+        # A sheet missing a column is not read any further, so this is checked on a source of its own.
+        rows = root_rows([1, 2])
+        header = [column for column in ROOT_HEADER if column != 'Length']
+        src = self.source(Workbook([row[:-1] for row in rows], root_header=header))
+        report = self.validate(src)
+        self.assertEqual(dict(report.counts), {validate.ISSUE_HEADER: 1})
+        self.assertEqual(report.issues[0].message, 'Missing column [Length]')
+        # Without the custom field, the column is not required.
+        self.assertTrue(validate.validate_source(src).ok)
+
+    def test_max_issues(self):
+        rows = root_rows([1, 2])
+        status = ROOT_HEADER.index('TipLivStatus')
+        rows = [row[:status] + ('Q', ) + row[status + 1:] for row in rows]
+        src = self.source(Workbook(rows))
+        report = self.validate(src, max_issues=3)
+        # Every issue is counted, but only max_issues of each kind are kept.
+        self.assertEqual(dict(report.counts), {validate.ISSUE_STATUS: len(rows)})
+        self.assertEqual([issue.row for issue in report.issues], [2, 3, 4])
+        lines = validate.format_report(report)
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[-1], '    ... and {} more issues'.format(len(rows) - 3))
+        self.assertEqual(len(self.validate(src, max_issues=None).issues), len(rows))
+
+    def test_max_issues_option(self):
+        src = self.invalid_source()
+        options = analyzer.validate_options().parse_args(['-s', src, '-f', 'Length', 'FINAL', '-j', '1',
+                                                          '--max-issues', '0'])
+        stdout = sys.stdout
+        sys.stdout = out = io.StringIO()
+        try:
+            with self.assertRaises(SystemExit) as cm:
+                analyzer.validate_main(options)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(cm.exception.code, 1)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('INVALID [{}]'.format(src)))
+        self.assertEqual(lines[1:], ['    ... and 4 more issues', 'Validated 1 sources, 1 invalid'])
+
+
+if __name__ == '__main__':
+    unittest.main()
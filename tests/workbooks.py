@@ -0,0 +1,79 @@
+"""
+In memory stand ins for openpyxl workbooks, used by the tests so they do not depend on openpyxl.
+"""
+from __future__ import print_function
+import datetime
+
+__author__ = 'wgibb'
+
+ROOT_HEADER = ['Tube#', 'Location#', 'RootName', 'BirthSession', 'Session#', 'DeathSession', 'TipLivStatus',
+               'NumberOfTips', 'Date', 'Order', 'Length']
+SYNTHESIS_HEADER = ['Tube#', 'Location#', 'RootName', 'BirthSession', 'AliveTipsAtBirth', 'AliveTipsAtDeath']
+CUSTOM_FIELDS = {'Length': 'FINAL'}
+
+
+class Cell(object):
+    def __init__(self, value):
+        self.value = value
+
+
+class Sheet(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def iter_rows(self):
+        for row in self.rows:
+            yield tuple(Cell(value) for value in row)
+
+
+class Workbook(object):
+    """A workbook with ROOT and Synthesis sheets.
+
+    Unless synthesis_rows are given, the Synthesis sheet holds a row for each distinct root of the
+    ROOT rows.
+    """
+    def __init__(self, root_rows, synthesis_rows=None, root_header=ROOT_HEADER, synthesis_header=SYNTHESIS_HEADER):
+        if synthesis_rows is None:
+            identities = []
+            for row in root_rows:
+                identity = (row[0], row[1], row[2], row[3])
+                if identity not in identities:
+                    identities.append(identity)
+            synthesis_rows = [identity + (i % 3, i % 2) for i, identity in enumerate(identities)]
+        self.sheets = {'ROOT': Sheet([root_header] + list(root_rows)),
+                       'Synthesis': Sheet([synthesis_header] + list(synthesis_rows)), }
+
+    def get_sheet_names(self):
+        return list(self.sheets)
+
+    def get_sheet_by_name(self, name):
+        return self.sheets[name]
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return repr(sorted((name, sheet.rows) for name, sheet in self.sheets.items()))
+
+
+def root_rows(sessions, tubes=(1, 2), roots=4):
+    """Return ROOT rows for the given sessions, ordered by session as WinRHIZO exports are.
+
+    Root i of each tube is born in session 1 + i % 2.  Root 0 dies in session 3, and root 3 is
+    recorded as gone in session 2 only, so it comes back to life after that.
+    """
+    rows = []
+    for session in sessions:
+        for tn in tubes:
+            for i in range(roots):
+                birth = 1 + i % 2
+                if session < birth:
+                    continue
+                death = 3 if i == 0 else 0
+                status = 'D' if death and session >= death else 'A'
+                if i == 3 and session == 2:
+                    death, status = 2, 'G'
+                rows.append((tn, i + 1, 'R{}'.format(i), birth, session, death if status != 'A' else 0, status, 1,
+                             datetime.datetime(2015, 4, 1) + datetime.timedelta(days=14 * session), i % 3,
+                             10 * session + i))
+    return rows
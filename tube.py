@@ -2,8 +2,10 @@
 Class for the tube.
 """
 from __future__ import print_function
+import collections
 import logging
 import fields
+from root import STATUS_ALIVE, STATUS_GONE
 
 log = logging.getLogger(__name__)
 __author__ = 'wgibb'
@@ -17,6 +19,13 @@ class Tube(object):
         self.tipStats = ''
         self.sessionDates = {}
         self.index = 0
+        # Root identities left unmatched by insert_synthesis_data.
+        self.missingSynthesis = []
+        self.orphanedSynthesis = []
+        # Root identity -> root, kept in sync with self.roots by add_root.
+        self._identity_index = {}
+        # Processing counters, such as observations inserted and status transitions.
+        self.stats = collections.Counter()
 
     def __iter__(self):
         for root in self.roots:
@@ -28,57 +37,90 @@ class Tube(object):
     def add_root(self, root):
         root.set('Tube#', self.tubeNumber)
         self.roots.append(root)
+        # Only the first root with a given identity is reachable through the index, matching the
+        # first-match behavior of a scan over self.roots.
+        self._identity_index.setdefault(root.identity, root)
+
+    def get_root(self, identity, default=None):
+        return self._identity_index.get(identity, default)
 
     def insert_or_update_root(self, root):
         # insert root if the root identity is new
-        insert = True
-        for existingRoot in self:
-            if root.identity == existingRoot.identity:
-                insert = False
-                # If there was a change, update the root attributes
-                if existingRoot.isAlive.startswith('A') and root.isAlive.startswith(('G', 'D')):
-                    # root changed from A to G
-                    log.debug('Changing root from A to {}'.format(root.isAlive))
-                    existingRoot.set('DeathSession', root.get('DeathSession'))
-                    existingRoot.isAlive = root.isAlive
-                elif existingRoot.isAlive.startswith(('G', 'D')) and root.isAlive.startswith('A'):
-                    # root changed from G to A
-                    log.debug('Changing root from {} to {}'.format(existingRoot.isAlive, root.isAlive))
-                    existingRoot.set('DeathSession', '')
-                    existingRoot.isAlive = root.isAlive
+        # Debug messages are given their arguments lazily, so they are never formatted when disabled.
+        self.stats['observations'] += 1
+        existingRoot = self._identity_index.get(root.identity)
+        if existingRoot is not None:
+            # If there was a change, update the root attributes
+            if existingRoot.status == STATUS_ALIVE and root.status == STATUS_GONE:
+                # root changed from A to G
+                log.debug('Changing root from A to %s', root.isAlive)
+                existingRoot.set('DeathSession', root.get('DeathSession'))
+                existingRoot.status = root.status
+                self.stats['alive_to_gone'] += 1
+            elif existingRoot.status == STATUS_GONE and root.status == STATUS_ALIVE:
+                # root changed from G to A
+                log.debug('Changing root from %s to %s', existingRoot.isAlive, root.isAlive)
+                existingRoot.set('DeathSession', '')
+                existingRoot.status = root.status
+                self.stats['gone_to_alive'] += 1
         # add the root to the tube
-        if insert:
+        else:
             # possible to insert a root at the last session.  likely rare though.
             # need to finalize this root before adding it into the tube.
-            log.debug('Adding root to tube %s' % (str(root.identity)))
+            log.debug('Adding root to tube %s', root.identity)
             self.add_root(root)
+            self.stats['roots_created'] += 1
         return True
 
     def finalize_root(self, root_obj, root_fields):
-        finalized = False
-        for existingRoot in self:
-            if root_obj.identity == existingRoot.identity:
-                if root_obj.get('Session#') == self.maxSessionCount:
-                    existingRoot.highestOrder = root_obj.get('Order')
-                if existingRoot.isAlive.startswith('A'):
-                    existingRoot.set('DeathSession', 0)
-                    existingRoot.censored = 1
-                # XXX Icky!
-                if existingRoot.isAlive.startswith(('D', 'G')):
-                    existingRoot.censored = 0
-                # Update custom fields which are set when the root is finalized
-                for attr, state in root_fields.additional_fields.items():
-                    if state != fields.ROOT_FINAL:
-                        continue
-                    existingRoot.set(attr, root_obj.get(attr))
-                finalized = True
+        existingRoot = self._identity_index.get(root_obj.identity)
+        if existingRoot is None:
+            return False
+        self.stats['finalized'] += 1
+        if root_obj.get('Session#') == self.maxSessionCount:
+            existingRoot.highestOrder = root_obj.get('Order')
+        if existingRoot.status == STATUS_ALIVE:
+            existingRoot.set('DeathSession', 0)
+            existingRoot.censored = 1
+            self.stats['censored'] += 1
+        elif existingRoot.status == STATUS_GONE:
+            existingRoot.censored = 0
+            self.stats['died'] += 1
+        # Update custom fields which are set when the root is finalized
+        for attr, state in root_fields.additional_fields.items():
+            if state != fields.ROOT_FINAL:
+                continue
+            existingRoot.set(attr, root_obj.get(attr))
+        return True
+
+    def insert_synthesis_data(self, sdata, slots, update=False):
+        """Join the synthesis data of the tube onto its roots.
 
-        return finalized
+        sdata maps root identity -> tuple of the synthesis only values, which are set on the root
+        attributes named by slots.  The identity values are not set again, since each root already
+        holds them.  Roots without synthesis data, and synthesis data without a root, are recorded
+        in missingSynthesis and orphanedSynthesis instead of being treated as an error.
 
-    def insert_synthesis_data(self, sdata):
-        for root_obj in self:
-            # log.debug('Inserting synthesis data for {}'.format(root_obj.identity))
-            sd = sdata.get(root_obj.identity)
-            # log.debug(sd)
-            for k, v in sd.items():
-                root_obj.set(k, v)
+        When update is set, sdata holds newer synthesis data for some of the roots.  Roots without
+        newer data keep the values they hold, and are only recorded as missing if they hold none.
+        """
+        missing = []
+        matched = 0
+        for root_obj in self.roots:
+            values = sdata.get(root_obj.identity)
+            if values is None:
+                if not (update and slots and hasattr(root_obj, slots[0])):
+                    missing.append(root_obj.identity)
+                continue
+            matched += 1
+            for attr, value in zip(slots, values):
+                setattr(root_obj, attr, value)
+        orphaned = []
+        if matched != len(sdata):
+            orphaned = [identity for identity in sdata if identity not in self._identity_index]
+        self.missingSynthesis = missing
+        self.orphanedSynthesis = orphaned
+        self.stats['synthesis_matched'] += matched
+        self.stats['synthesis_missing'] += len(missing)
+        self.stats['synthesis_orphaned'] += len(orphaned)
+        return not missing and not orphaned
@@ -2,6 +2,8 @@
 Utility functions.
 """
 from __future__ import print_function
+import array
+import collections
 import logging
 import sys
 
@@ -12,7 +14,7 @@ __author__ = 'wgibb'
 
 # http://code.activestate.com/recipes/577058/
 def query_yes_no(question, default="yes"):
-    """Ask a yes/no question via raw_input() and return their answer.
+    """Ask a yes/no question via input() and return their answer.
     "question" is a string that is presented to the user.
     "default" is the presumed answer if the user just hits <Enter>.
         It must be "yes" (the default), "no" or None (meaning
@@ -33,8 +35,7 @@ def query_yes_no(question, default="yes"):
 
     while True:
         sys.stdout.write(question + prompt)
-        # XXX not python3 friendly.
-        choice = raw_input().lower()
+        choice = input().lower()
         if default is not None and choice == '':
             return valid[default]
         elif choice in valid:
@@ -45,7 +46,9 @@ def query_yes_no(question, default="yes"):
 
 def print_items_keys(iterable):
     for thing in iterable:
-        for attr, value in thing.__dict__.items():
+        # Roots use slots rather than an instance dictionary.
+        items = thing.items() if hasattr(thing, 'items') else thing.__dict__.items()
+        for attr, value in items:
             print(attr, value)
         print('================================')
 
@@ -60,50 +63,109 @@ def get_index_by_value(cell_list, value):
 
     if the value is not found, return false
     """
-    index = False
-    for cell in cell_list:
+    for index, cell in enumerate(cell_list):
         if cell.value == value:
-            try:
-                index = cell_list.index(cell)
-            except ValueError:
-                log.exception('Failed to get index for value after finding a match')
-                return index
-            break
-    return index
+            return index
+    return False
 
 
 def stats(wb, sheetlist, value, verbose=False):
     """generate counts of different values in a given column, based on column name
-    this is done across a workbook"""
+    this is done across a workbook.
+
+    Each sheet is streamed row by row, so this works on read only workbooks.  See summary.summarize
+    for summaries of several columns in a single pass."""
     dicty = {}
     for sheet in sheetlist:
         ws = wb.get_sheet_by_name(sheet)
-        row1 = ws.rows[0]
-        index = get_index_by_value(row1, value)
-        for cell in ws.columns[index]:
-            if cell.value in dicty:
-                dicty[cell.value] += 1
+        for (cell_value,) in iter_rows_from_columns(ws, [value]):
+            if cell_value in dicty:
+                dicty[cell_value] += 1
             else:
-                dicty[cell.value] = 1
+                dicty[cell_value] = 1
                 if verbose:
                     log.info('Found new cell.value in sheet: {}'.format(sheet))
     return dicty
 
 
 def build_data_from_fields(ws, fields):
-    header = ws.rows[0]
-    header_index = {}
+    """Return a dictionary of the required field values for each data row in ws.
+
+    The values are extracted column by column with build_columns_from_fields, and each row is only
+    turned into a dictionary at the end.  Rows which do not contain any of the values are skipped.
+    """
+    keys = list(fields.required_attributes)
+    columns = build_columns_from_fields(ws, keys)
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+
+def resolve_header(header, columns):
+    """Return the position of each of the columns in the header values, in a single pass over the header.
+
+    The first occurrence of a value in the header is used.
+    """
+    positions = {}
+    for index, value in enumerate(header):
+        if value not in positions:
+            positions[value] = index
     ret = []
-    for key in fields.required_attributes:
-        index = get_index_by_value(header, key)
-        if index is False:
+    for key in columns:
+        if key not in positions:
             raise DataError('Failed to obtain header value: {}'.format(key))
-        header_index[key] = index
-    ws_end = len(ws.columns[0])
-    if not ws_end:
-        raise DataError('Failed to find end of the ws data')
-    # This skips the header row, as we are embedding all of the required data into dictionaries.
-    for row in ws.rows[1:ws_end]:
-        d = {key: row[index].value for key, index in header_index.items()}
-        ret.append(d)
-    return ret
+        ret.append(positions[key])
+    return tuple(ret)
+
+
+def iter_rows_from_columns(ws, columns):
+    """Yield a tuple of the values of the given columns, in order, for each data row in ws.
+
+    This reads the worksheet row by row, so it is suitable for read only worksheets.  Rows which
+    do not contain any of the column values are skipped.
+    """
+    rows = ws.iter_rows()
+    try:
+        header = [cell.value for cell in next(rows)]
+    except StopIteration:
+        raise DataError('Failed to find a header row in the ws data')
+    positions = resolve_header(header, columns)
+    for row in rows:
+        width = len(row)
+        values = tuple(row[index].value if index < width else None for index in positions)
+        if all(v is None for v in values):
+            continue
+        yield values
+
+
+def column_array(values):
+    """Pack a list of column values into a typed array where possible.
+
+    Columns holding only ints (or only floats) are returned as an array, which stores the values
+    contiguously instead of as separate objects.  Any other column is returned as a list.
+    """
+    if not values:
+        return values
+    value_type = type(values[0])
+    if value_type not in (int, float):
+        return values
+    for value in values:
+        if type(value) is not value_type:
+            return values
+    try:
+        return array.array('q' if value_type is int else 'd', values)
+    except OverflowError:
+        return values
+
+
+def build_columns_from_fields(ws, columns):
+    """Extract the given columns from ws, returning an OrderedDict of column name -> column values.
+
+    The header is resolved in a single pass, and the values of each column are gathered into one
+    contiguous sequence (see column_array) rather than into a dictionary per row.  Rows which do
+    not contain any of the column values are skipped.
+    """
+    values = [[] for _ in columns]
+    appends = [v.append for v in values]
+    for row in iter_rows_from_columns(ws, columns):
+        for append, value in zip(appends, row):
+            append(value)
+    return collections.OrderedDict((key, column_array(v)) for key, v in zip(columns, values))
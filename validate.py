@@ -0,0 +1,271 @@
+"""
+Validation of source workbooks and stores before they are analyzed.
+
+validate_source reads a source once, streaming only the columns it checks from a read only
+workbook (or from a store written by the convert command), and checks that:
+
+    - the ROOT and Synthesis sheets hold every column required by the RootDataFields and
+      SynthesisDataFields, including any custom fields,
+    - the tube, location, session and tip count values are integers,
+    - each root identity appears only once in the Synthesis sheet,
+    - every TipLivStatus is classified by the status rules,
+    - the ROOT and Synthesis sheets cover the same tubes.
+
+Problems are collected in a ValidationReport instead of being raised, so a single pass reports
+every problem in a source.  Batches of sources are validated in parallel worker processes.
+"""
+from __future__ import print_function
+import collections
+import json
+import logging
+# Custom
+import fields
+import ingest
+import store
+import utility
+
+from errors import DataError
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+SHEET_NAMES = {'root_data': 'ROOT',
+               'synthesis_data': 'Synthesis', }
+# Number of issues of each kind kept in a report.  Every issue is still counted.
+DEFAULT_MAX_ISSUES = 100
+
+ISSUE_SOURCE = 'source'
+ISSUE_SHEET = 'sheet'
+ISSUE_HEADER = 'header'
+ISSUE_VALUE = 'value'
+ISSUE_DUPLICATE = 'duplicate'
+ISSUE_STATUS = 'status'
+ISSUE_COVERAGE = 'coverage'
+
+# Columns whose values must be integers.
+INT_COLUMNS = ('Tube#', 'Location#', 'BirthSession', 'Session#', 'NumberOfTips')
+
+# row is the 1 based row number in the sheet, or None for issues which do not concern a single row.
+Issue = collections.namedtuple('Issue', ['kind', 'sheet', 'row', 'message'])
+
+
+class ValidationReport(object):
+    def __init__(self, source, max_issues=DEFAULT_MAX_ISSUES):
+        self.source = source
+        self.max_issues = max_issues
+        self.issues = []
+        self.counts = collections.Counter()  # Issue kind -> number of issues found, including those not kept.
+        self.rows = collections.OrderedDict()  # Sheet name -> number of data rows checked.
+
+    @property
+    def ok(self):
+        return not self.counts
+
+    def add(self, kind, message, sheet=None, row=None):
+        self.counts[kind] += 1
+        if self.max_issues is None or self.counts[kind] <= self.max_issues:
+            self.issues.append(Issue(kind=kind, sheet=sheet, row=row, message=message))
+
+    def report(self):
+        return {'source': self.source,
+                'ok': self.ok,
+                'rows': dict(self.rows),
+                'counts': dict(self.counts),
+                'issues': [dict(issue._asdict()) for issue in self.issues], }
+
+
+def _open(src):
+    if store.is_store(src):
+        return store.open_store(src)
+    import openpyxl
+    return openpyxl.load_workbook(filename=src, read_only=True)
+
+
+def _read_header(source, sheet_name):
+    """Return the header of a sheet, an empty list if the sheet is empty, or None if there is no such sheet."""
+    if hasattr(source, 'tables'):
+        if sheet_name not in source.tables:
+            return None
+        return source.tables[sheet_name].header
+    if sheet_name not in source.get_sheet_names():
+        return None
+    try:
+        return [cell.value for cell in next(source.get_sheet_by_name(sheet_name).iter_rows())]
+    except StopIteration:
+        return []
+
+
+def _iter_rows(source, sheet_name, columns):
+    """Yield (row number, tuple of the values of the columns) for each data row of a sheet.
+
+    Rows without any of the values are skipped.  Stores do not hold such rows, so the row numbers
+    of a store count its stored rows.
+    """
+    if hasattr(source, 'tables'):
+        values = store.read_columns(source, sheet_name, columns)
+        for row_number, row in enumerate(zip(*values.values()), 2):
+            yield row_number, row
+        return
+    rows = source.get_sheet_by_name(sheet_name).iter_rows()
+    positions = utility.resolve_header([cell.value for cell in next(rows)], columns)
+    for row_number, row in enumerate(rows, 2):
+        width = len(row)
+        values = tuple(row[index].value if index < width else None for index in positions)
+        if all(v is None for v in values):
+            continue
+        yield row_number, values
+
+
+def _check_header(source, sheet_name, columns, report):
+    """Record missing sheets and columns, and return True if every column is present."""
+    header = _read_header(source, sheet_name)
+    if header is None:
+        report.add(ISSUE_SHEET, 'Missing sheet [{}]'.format(sheet_name), sheet=sheet_name)
+        return False
+    if not header:
+        report.add(ISSUE_HEADER, 'Missing header row', sheet=sheet_name)
+        return False
+    missing = [column for column in columns if column not in header]
+    for column in missing:
+        report.add(ISSUE_HEADER, 'Missing column [{}]'.format(column), sheet=sheet_name, row=1)
+    return not missing
+
+
+def _check_ints(columns, row, sheet_name, row_number, report):
+    """Return the row with the values of the INT_COLUMNS coerced, recording those which are not integers."""
+    ret = []
+    for column, value in zip(columns, row):
+        if column in INT_COLUMNS and type(value) is not int:
+            value = ingest.coerce_int(value)
+            if type(value) is not int:
+                report.add(ISSUE_VALUE, 'Value of [{}] is not an integer [{!r}]'.format(column, value),
+                           sheet=sheet_name, row=row_number)
+        ret.append(value)
+    return ret
+
+
+def _check_synthesis(source, sheet_name, schema, report):
+    """Check the Synthesis sheet, returning the set of its tube numbers, or None if it could not be read."""
+    if not _check_header(source, sheet_name, schema.synthesis_columns, report):
+        return None
+    columns = schema.synthesis_identity_columns
+    tubes = set()
+    seen = {}  # (tube number, root identity) -> row number.
+    count = 0
+    for row_number, row in _iter_rows(source, sheet_name, columns):
+        count += 1
+        tn, rootname, location, birthsession = _check_ints(columns, row, sheet_name, row_number, report)
+        if type(tn) is int:
+            tubes.add(tn)
+        key = (tn, rootname, location, birthsession)
+        first = seen.setdefault(key, row_number)
+        if first != row_number:
+            report.add(ISSUE_DUPLICATE, 'Duplicate root in tube [{}], first seen in row {}: RootName [{}] Location# '
+                                        '[{}] BirthSession [{}]'.format(tn, first, rootname, location, birthsession),
+                       sheet=sheet_name, row=row_number)
+    report.rows[sheet_name] = count
+    return tubes
+
+
+def _check_root(source, sheet_name, schema, report):
+    """Check the ROOT sheet, returning the set of its tube numbers, or None if it could not be read."""
+    if not _check_header(source, sheet_name, schema.root_columns, report):
+        return None
+    columns = ('Tube#', 'Location#', 'BirthSession', 'Session#', 'NumberOfTips', 'TipLivStatus')
+    classify = schema.status_rules.classify
+    tubes = set()
+    count = 0
+    for row_number, row in _iter_rows(source, sheet_name, columns):
+        count += 1
+        row = _check_ints(columns, row, sheet_name, row_number, report)
+        # Tube numbers which are not integers are already reported, and are left out of the tube coverage.
+        if type(row[0]) is int:
+            tubes.add(row[0])
+        if classify(row[4], row[5]) is None:
+            report.add(ISSUE_STATUS, 'Unknown TipLivStatus [{}]'.format(row[5]), sheet=sheet_name, row=row_number)
+    report.rows[sheet_name] = count
+    return tubes
+
+
+def validate_source(src, additional_root_fields=None, status_rules=None, sheet_names=None,
+                    max_issues=DEFAULT_MAX_ISSUES):
+    """Validate a source workbook or store in a single pass, returning a ValidationReport of every problem found.
+
+    additional_root_fields and status_rules are those the source would be analyzed with.
+    sheet_names maps root_data and synthesis_data to the names of the sheets, and defaults to
+    SHEET_NAMES.
+    """
+    log.info('Validating source [{}]'.format(src))
+    sheet_names = sheet_names or SHEET_NAMES
+    schema = fields.RecordSchema(fields.RootDataFields(additional_fields=additional_root_fields),
+                                 fields.SynthesisDataFields(),
+                                 status_rules=status_rules)
+    report = ValidationReport(src, max_issues=max_issues)
+    try:
+        source = _open(src)
+    except Exception as e:
+        report.add(ISSUE_SOURCE, 'Failed to open source: {}'.format(e))
+        return report
+    try:
+        synthesis_sheet = sheet_names.get('synthesis_data')
+        root_sheet = sheet_names.get('root_data')
+        synthesis_tubes = _check_synthesis(source, synthesis_sheet, schema, report)
+        root_tubes = _check_root(source, root_sheet, schema, report)
+    except DataError as e:
+        report.add(ISSUE_SOURCE, 'Failed to read source: {}'.format(e))
+        return report
+    finally:
+        source.close()
+    if root_tubes is not None and synthesis_tubes is not None:
+        for tn in sorted(root_tubes.difference(synthesis_tubes), key=str):
+            report.add(ISSUE_COVERAGE, 'Tube [{}] has no Synthesis rows'.format(tn), sheet=root_sheet)
+        for tn in sorted(synthesis_tubes.difference(root_tubes), key=str):
+            report.add(ISSUE_COVERAGE, 'Tube [{}] has no ROOT rows'.format(tn), sheet=synthesis_sheet)
+    log.info('Validated source [{}], {} issues'.format(src, sum(report.counts.values())))
+    return report
+
+
+def _validate_job(job):
+    src, kwargs = job
+    return validate_source(src, **kwargs)
+
+
+def validate_batch(sources, jobs=None, **kwargs):
+    """Validate each source in a pool of worker processes, returning a list of ValidationReport in source order.
+
+    The keyword arguments are passed to validate_source.
+    """
+    job_list = [(src, kwargs) for src in sources]
+    if jobs == 1 or len(job_list) < 2:
+        return [_validate_job(job) for job in job_list]
+    import multiprocessing
+    pool = multiprocessing.Pool(processes=jobs)
+    try:
+        return pool.map(_validate_job, job_list, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_json(reports, fp):
+    with open(fp, 'w') as f:
+        json.dump([report.report() for report in reports], f, indent=2, default=str)
+    return True
+
+
+def format_report(report):
+    """Return the lines of a plain text summary of a report, listing the issues kept in it."""
+    rows = ', '.join('{} {} rows'.format(sheet_name, count) for sheet_name, count in report.rows.items())
+    if report.ok:
+        return ['OK      [{}] ({})'.format(report.source, rows)]
+    counts = ', '.join('{} {}'.format(kind, count) for kind, count in sorted(report.counts.items()))
+    lines = ['INVALID [{}] ({}) - {}'.format(report.source, rows, counts)]
+    for issue in report.issues:
+        where = issue.sheet or ''
+        if issue.row is not None:
+            where = '{} row {}'.format(where, issue.row)
+        lines.append('    {}: {}: {}'.format(where, issue.kind, issue.message))
+    dropped = sum(report.counts.values()) - len(report.issues)
+    if dropped:
+        lines.append('    ... and {} more issues'.format(dropped))
+    return lines
@@ -0,0 +1,178 @@
+"""
+Output backends for compiled root data.
+
+Each backend is constructed with an output path and the header row, accepts rows of values in
+header order, and finishes the output when it is closed.
+"""
+from __future__ import print_function
+import csv
+import io
+import logging
+import os
+# Custom
+import columnar
+
+from errors import SerializationError
+
+log = logging.getLogger(__name__)
+__author__ = 'wgibb'
+
+COMPILED_TITLE = 'Compiled Data'  # XXX Custom title?
+
+FORMAT_XLSX = 'xlsx'
+FORMAT_CSV = 'csv'
+FORMAT_COLUMNAR = 'columnar'
+
+
+class OutputWriter(object):
+    extension = ''
+
+    def __init__(self, fp, header, title=COMPILED_TITLE):
+        self.fp = fp
+        self.header = list(header)
+        self.title = title
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Only finish the output if the rows were written successfully.
+        if exc_type is None:
+            self.close()
+
+    def write_row(self, row):
+        raise NotImplementedError
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def close(self):
+        raise NotImplementedError
+
+    def abort(self):
+        """Discard the output without finishing it.  Backends which write as they go remove the partial output."""
+        pass
+
+
+class XlsxWriter(OutputWriter):
+    """Stream rows into a write only workbook."""
+    extension = '.xlsx'
+
+    def __init__(self, fp, header, title=COMPILED_TITLE):
+        super(XlsxWriter, self).__init__(fp, header, title=title)
+        import openpyxl
+        self.wb = openpyxl.Workbook(write_only=True)
+        self.ws = self.wb.create_sheet(title=self.title)
+        self.ws.append(self.header)
+
+    def write_row(self, row):
+        self.ws.append(row)
+        self.rows += 1
+
+    def close(self):
+        self.wb.save(filename=self.fp)
+        return True
+
+
+class CsvWriter(OutputWriter):
+    """Stream rows into a comma separated values file."""
+    extension = '.csv'
+
+    def __init__(self, fp, header, title=COMPILED_TITLE):
+        super(CsvWriter, self).__init__(fp, header, title=title)
+        self.f = io.open(self.fp, 'w', newline='')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(self.header)
+
+    def write_row(self, row):
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.writer.writerow(row)
+            self.rows += 1
+
+    def close(self):
+        self.f.close()
+        return True
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.fp)
+
+
+class ColumnarWriter(OutputWriter):
+    """Collect rows into typed columns, stored in the columnar binary format.
+
+    Session numbers, censored flags, tip counts and dates are stored as fixed width typed arrays,
+    and repeated strings such as root names and statuses are dictionary encoded.  The output can be
+    read back with columnar.ColumnarFile.
+    """
+    extension = '.wrc'
+
+    def __init__(self, fp, header, title=COMPILED_TITLE):
+        super(ColumnarWriter, self).__init__(fp, header, title=title)
+        self.writer = columnar.ColumnarWriter(self.fp)
+        self.table = self.writer.add_table(self.title, self.header)
+
+    def write_row(self, row):
+        self.table.append(row)
+        self.rows += 1
+
+    def close(self):
+        return self.writer.close()
+
+
+WRITERS = {FORMAT_XLSX: XlsxWriter,
+           FORMAT_CSV: CsvWriter,
+           FORMAT_COLUMNAR: ColumnarWriter, }
+
+
+def get_writer(output_format):
+    try:
+        return WRITERS[output_format]
+    except KeyError:
+        raise SerializationError('Unknown output format [{}]'.format(output_format))
+
+
+def get_format(fp):
+    """Return the output format of a file, from its extension."""
+    extension = os.path.splitext(fp)[1].lower()
+    for output_format, writer in WRITERS.items():
+        if writer.extension == extension:
+            return output_format
+    raise SerializationError('Unknown output format for file [{}]'.format(fp))
+
+
+def read_rows(fp, title=COMPILED_TITLE):
+    """Yield the rows of an output written by one of the backends, starting with the header row.
+
+    The format is chosen by the extension of fp.  Values read back from a csv output are strings,
+    and empty values read back from the other formats may be None.
+    """
+    output_format = get_format(fp)
+    if output_format == FORMAT_CSV:
+        with io.open(fp, 'r', newline='') as f:
+            for row in csv.reader(f):
+                yield row
+    elif output_format == FORMAT_COLUMNAR:
+        with columnar.ColumnarFile(fp) as cfile:
+            table = cfile.table(title if title in cfile.tables else None)
+            yield table.header
+            for row in table.iter_rows():
+                yield row
+    else:
+        import openpyxl
+        wb = openpyxl.load_workbook(filename=fp, read_only=True)
+        try:
+            if title in wb.get_sheet_names():
+                ws = wb.get_sheet_by_name(title)
+            else:
+                ws = wb.worksheets[0]
+            for row in ws.iter_rows():
+                yield tuple(cell.value for cell in row)
+        finally:
+            wb.close()